@@ -0,0 +1,79 @@
+# accounts/area_tree.py
+
+"""
+The City/Area tree for the area settings page, built from one query and
+cached as ready-to-send JSON. The cache key carries a version number that
+the City and Area receivers in accounts/models.py bump after each change,
+so a stale tree is never read; old versions simply expire. With a
+per-process cache other workers don't see the bump, so the tree is only
+kept for invalidated_timeout() there.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .caching import invalidated_timeout
+
+DEFAULT_AREA_TREE_TIMEOUT = 86400
+VERSION_KEY = 'area_tree:version'
+
+
+def tree_version():
+    # Seeded from the clock so a version lost to eviction doesn't reuse an old number.
+    cache.add(VERSION_KEY, int(time.time() * 1000), timeout=None)
+    return cache.get(VERSION_KEY)
+
+
+def bump_version():
+    def bump():
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            tree_version()
+    transaction.on_commit(bump)
+
+
+def build_area_tree():
+    """[{'id', 'name', 'areas': [area, ...]}] with each area's sub_areas nested under it."""
+    from .models import City
+
+    cities, nodes, parents = {}, {}, []
+    rows = City.objects.order_by('pk', 'areas__pk').values(
+        'pk', 'name', 'areas__pk', 'areas__name', 'areas__parent_id',
+    )
+    for row in rows:
+        city = cities.setdefault(row['pk'], {'id': row['pk'], 'name': row['name'], 'areas': []})
+        if row['areas__pk'] is None:
+            continue
+        nodes[row['areas__pk']] = {'id': row['areas__pk'], 'name': row['areas__name'], 'parent': None, 'sub_areas': []}
+        parents.append((row['areas__pk'], row['areas__parent_id'], city))
+    area_city = {area_id: city['id'] for area_id, _, city in parents}
+    for area_id, parent_id, city in parents:
+        node = nodes[area_id]
+        if parent_id is None:
+            city['areas'].append(node)
+        elif area_city.get(parent_id) == city['id']:
+            # An area filed under a parent from another city is left out, as before.
+            node['parent'] = {'id': parent_id, 'name': nodes[parent_id]['name']}
+            nodes[parent_id]['sub_areas'].append(node)
+    return list(cities.values())
+
+
+def cached_area_tree():
+    """(JSON bytes, ETag) of build_area_tree() for the current version."""
+    key = f'area_tree:{tree_version()}'
+    cached = cache.get(key)
+    if cached is None:
+        body = json.dumps(build_area_tree()).encode()
+        # A content hash, not the version: with per-process caches the same
+        # version number can stand for different trees in different workers.
+        cached = (body, hashlib.md5(body).hexdigest())
+        cache.set(key, cached, invalidated_timeout(
+            getattr(settings, 'AREA_TREE_CACHE_TIMEOUT', DEFAULT_AREA_TREE_TIMEOUT)
+        ))
+    return cached
@@ -0,0 +1,24 @@
+# accounts/caching.py
+
+"""
+Timeouts for cache entries that are invalidated on change. Invalidation only
+reaches the process that made the change when the cache is per-process
+(LocMemCache), so there the timeout is cut to LOCAL_CACHE_MAX_TIMEOUT, which
+bounds how long other workers serve a stale entry.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+DEFAULT_LOCAL_CACHE_MAX_TIMEOUT = 60
+
+
+def is_local_cache():
+    return isinstance(caches['default'], LocMemCache)
+
+
+def invalidated_timeout(timeout):
+    if is_local_cache():
+        return min(timeout, getattr(settings, 'LOCAL_CACHE_MAX_TIMEOUT', DEFAULT_LOCAL_CACHE_MAX_TIMEOUT))
+    return timeout
@@ -4,6 +4,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, AuthenticationForm
 from django.core.validators import RegexValidator
 from .models import CustomUser, Company,  Area
+from .phones import clean_phone
 
 class CustomUserCreationForm(UserCreationForm):
     company = forms.ModelChoiceField(queryset=Company.objects.all(), required=False)
@@ -12,6 +13,9 @@ class CustomUserCreationForm(UserCreationForm):
         model = CustomUser
         fields = ('mobile', 'email', 'company', 'user_type')
 
+    def clean_mobile(self):
+        return clean_phone(self.cleaned_data['mobile'])
+
 class CustomUserChangeForm(UserChangeForm):
     company = forms.ModelChoiceField(queryset=Company.objects.all(), required=False)
     
@@ -19,6 +23,9 @@ class CustomUserChangeForm(UserChangeForm):
         model = CustomUser
         fields = ('mobile', 'email', 'company', 'user_type')
 
+    def clean_mobile(self):
+        return clean_phone(self.cleaned_data['mobile'])
+
 class CustomAuthenticationForm(AuthenticationForm):
     username = forms.CharField(
         label="Mobile Number",
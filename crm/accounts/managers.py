@@ -1,15 +1,32 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
+from .phones import phone_key
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, mobile, first_name, last_name, password, **extra_fields):
         if not mobile:
             raise ValueError(_('The Mobile must be set'))
-        user = self.model(mobile=mobile, first_name=first_name, last_name=last_name, **extra_fields)
+        user = self.model(mobile=phone_key(mobile) or mobile, first_name=first_name, last_name=last_name, **extra_fields)
         user.set_password(password)
         user.save()
         return user
 
+    def make_random_password(self, length=10,
+                             allowed_chars='abcdefghjkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789'):
+        # BaseUserManager dropped this in Django 5.1; account creation still uses it.
+        return get_random_string(length, allowed_chars)
+
+    def get_by_natural_key(self, mobile):
+        # Accounts created before numbers were normalized keep the number as typed.
+        key = phone_key(mobile)
+        if key and key != mobile:
+            try:
+                return self.get(mobile=key)
+            except self.model.DoesNotExist:
+                pass
+        return self.get(mobile=mobile)
+
     def create_superuser(self, mobile, first_name, last_name, password, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -6,6 +6,7 @@ from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.validators import RegexValidator
 from .managers import CustomUserManager
+from .phones import phone_key
 
 class City(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -96,6 +97,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.get_full_name() or self.mobile
 
+    def save(self, *args, **kwargs):
+        self.mobile = phone_key(self.mobile) or self.mobile
+        super().save(*args, **kwargs)
+
     def get_full_name(self):
         full_name = '%s %s' % (self.first_name, self.last_name)
         return full_name.strip()
@@ -137,3 +142,37 @@ class Service(models.Model):
     def __str__(self):
         return self.name
 
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from . import area_tree, team
+
+
+@receiver(m2m_changed, sender=CustomUser.managers.through)
+def team_changed(sender, instance, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        team.invalidate_team({instance.pk, *pk_set})
+    elif action == 'pre_clear':
+        # Both sides of the cleared links, read before they are gone.
+        team.invalidate_team({
+            instance.pk,
+            *instance.managers.values_list('pk', flat=True),
+            *instance.technicians.values_list('pk', flat=True),
+        })
+
+
+@receiver(pre_delete, sender=CustomUser)
+def team_member_deleted(sender, instance, **kwargs):
+    team.invalidate_team({
+        instance.pk,
+        *instance.managers.values_list('pk', flat=True),
+        *instance.technicians.values_list('pk', flat=True),
+    })
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Area)
+@receiver(post_delete, sender=Area)
+def area_tree_changed(sender, **kwargs):
+    area_tree.bump_version()
@@ -0,0 +1,79 @@
+# accounts/phones.py
+
+"""
+Phone number normalization. Every mobile number that is looked up or stored
+as a key goes through normalize_phone(), so "+966 55 123 4567", "0551234567"
+and "00966551234567" all become "+966551234567".
+"""
+
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+DEFAULT_COUNTRY_CODE = '966'
+# Shortest national number accepted for the default country: Saudi mobile and
+# landline numbers both have 9 digits after the country code.
+DEFAULT_MIN_NATIONAL_DIGITS = 9
+SEPARATORS = re.compile(r'[\s\-().]')
+
+
+def normalize_phone(value, country_code=None):
+    """
+    The E.164 form of `value`. Numbers without an international prefix are
+    taken to be national numbers of PHONE_DEFAULT_COUNTRY_CODE, which must
+    have at least PHONE_MIN_NATIONAL_DIGITS digits. Raises ValueError when
+    `value` can't be a phone number.
+    """
+    country_code = country_code or getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', DEFAULT_COUNTRY_CODE)
+    min_national_digits = getattr(settings, 'PHONE_MIN_NATIONAL_DIGITS', DEFAULT_MIN_NATIONAL_DIGITS)
+    number = SEPARATORS.sub('', str(value or ''))
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0'):
+        digits = country_code + number[1:]
+    elif number.startswith(country_code) and len(number) > len(country_code) + 8:
+        # Already has the country code, just without the '+'.
+        digits = number
+    else:
+        digits = country_code + number
+    if (not digits.isdigit() or not 8 <= len(digits) <= 15 or digits.startswith('0')
+            or digits.startswith(country_code) and len(digits) - len(country_code) < min_national_digits):
+        raise ValueError(f"{value!r} is not a valid phone number.")
+    return '+' + digits
+
+
+def clean_phone(value):
+    """normalize_phone() for form and serializer fields: raises ValidationError."""
+    try:
+        return normalize_phone(value)
+    except ValueError:
+        raise ValidationError("Enter a valid mobile number, e.g. +966551234567 or 0551234567.")
+
+
+def phone_key(value):
+    """normalize_phone(value), or None for values that aren't phone numbers."""
+    try:
+        return normalize_phone(value)
+    except ValueError:
+        return None
+
+
+def subscriber_digits(fragment):
+    """
+    The part of a typed number fragment that follows its trunk or country
+    prefix ("0551234", "00966551234" and "+966551234" all give "551234"), so
+    it matches a number stored in any format. Returns '' if `fragment` isn't
+    a run of digits.
+    """
+    country_code = getattr(settings, 'PHONE_DEFAULT_COUNTRY_CODE', DEFAULT_COUNTRY_CODE)
+    number = SEPARATORS.sub('', fragment or '')
+    digits = number.lstrip('+')
+    if not digits.isdigit():
+        return ''
+    for prefix in ('00' + country_code, country_code, '00', '0'):
+        if digits.startswith(prefix):
+            return digits[len(prefix):]
+    return digits
@@ -0,0 +1,47 @@
+# accounts/team.py
+
+"""
+Cached team membership: a manager's technicians and a technician's managers.
+Lists are cached per user and dropped by the receivers in accounts/models.py
+when CustomUser.managers changes or a member is deleted (in this process
+only, with a per-process cache: see accounts/caching.py).
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import invalidated_timeout
+
+DEFAULT_TEAM_CACHE_TIMEOUT = 3600
+ROLES = ('technicians', 'managers')
+
+
+def _key(user_id, role):
+    return f'team:{role}:{user_id}'
+
+
+def team_role(user):
+    if user.is_manager:
+        return 'technicians'
+    if user.is_technician:
+        return 'managers'
+    return None
+
+
+def team_members(user):
+    """The user's technicians (managers) or managers (technicians) as a list; one query on a cache miss."""
+    role = team_role(user)
+    if role is None:
+        return []
+    key = _key(user.pk, role)
+    members = cache.get(key)
+    if members is None:
+        members = list(getattr(user, role).order_by('first_name', 'last_name', 'pk'))
+        cache.set(key, members, invalidated_timeout(
+            getattr(settings, 'TEAM_CACHE_TIMEOUT', DEFAULT_TEAM_CACHE_TIMEOUT)
+        ))
+    return members
+
+
+def invalidate_team(user_ids):
+    cache.delete_many([_key(user_id, role) for user_id in user_ids for role in ROLES])
@@ -7,7 +7,10 @@ from django.contrib import messages
 from .forms import CustomUserCreationForm, CustomAuthenticationForm
 from django.contrib.auth.decorators import login_required
 from .models import City, Area, Service
+from django.utils import timezone
+from crmapp.appointment_queries import cached_count, keyset_page
 from crmapp.models import Appointment, Technician, Customer
+from . import team
 
 def register(request):
     if request.method == 'POST':
@@ -43,46 +46,50 @@ def custom_login(request):
         form = CustomAuthenticationForm()
     return render(request, 'account/login.html', {'form': form})
 
+PROFILE_PAGE_SIZE = 20
+PROFILE_SCOPES = ('upcoming', 'past', 'all')
+
 @login_required
 def profile(request):
     user = request.user
-    team_members = []
-    appointments = []
-    
+    scope = request.GET.get('scope')
+    if scope not in PROFILE_SCOPES:
+        scope = 'upcoming'
+    team_members = team.team_members(user)
+
     if user.user_type == 'MANAGER':
-        team_members = user.get_technicians()
-        # Get appointments for all technicians under this manager
-        technician_users = Technician.objects.filter(user__in=team_members)
-        appointments = Appointment.objects.select_related(
-            'slot__technician', 
-            'customer', 
-            'slot__technician__user',
-            'customer__user'
-        ).filter(slot__technician__in=technician_users).order_by('slot__date', 'slot__start_time')
+        # Appointment.technician is keyed by the technician's user id.
+        appointments = Appointment.objects.filter(technician_id__in=[member.pk for member in team_members])
     elif user.is_technician:
-        team_members = user.get_managers()
-        # Get appointments for this technician
-        technician = Technician.objects.get(user=user)
-        appointments = Appointment.objects.select_related(
-            'slot__technician', 
-            'customer', 
-            'slot__technician__user',
-            'customer__user'
-        ).filter(slot__technician=technician).order_by('slot__date', 'slot__start_time')
+        appointments = Appointment.objects.filter(technician_id=user.pk)
     else:
         # For customers or other user types
-        appointments = Appointment.objects.select_related(
-            'slot__technician', 
-            'customer', 
-            'slot__technician__user',
-            'customer__user'
-        ).filter(customer=user).order_by('slot__date', 'slot__start_time')
-    
+        appointments = Appointment.objects.filter(customer__user=user)
+
+    today = timezone.now().date()
+    if scope == 'upcoming':
+        appointments = appointments.filter(date__gte=today)
+    elif scope == 'past':
+        appointments = appointments.filter(date__lt=today)
+
+    listed = appointments.select_related('technician__user', 'customer')
+    try:
+        page, next_cursor = keyset_page(listed, request.GET.get('cursor'), PROFILE_PAGE_SIZE, descending=scope == 'past')
+    except ValueError:
+        page, next_cursor = keyset_page(listed, None, PROFILE_PAGE_SIZE, descending=scope == 'past')
+
     context = {
         'user': user,
         'team_members': team_members,
-        'appointments': appointments,
-        'appointment_count': appointments.count(),
+        'service_areas': list(user.service_areas.select_related('city')),
+        'appointments': page,
+        'appointment_count': cached_count(
+            appointments, ('profile', user.pk, scope, today, [member.pk for member in team_members]),
+        ),
+        'scope': scope,
+        'scopes': PROFILE_SCOPES,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
     return render(request, 'account/profile.html', context)
 @login_required
@@ -85,6 +85,15 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds to wait for a lock; the run_jobs workers write concurrently.
+            'timeout': 20,
+        },
+        # A file rather than the shared in-memory default, so threaded tests
+        # get one connection per thread with normal locking.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -134,6 +143,59 @@ STATICFILES_DIRS = [
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap4"
 
+# Slots are generated this many days ahead; run `manage.py extend_slot_horizon` daily.
+SLOT_BOOKING_HORIZON_DAYS = 60
+
+# 'materialized' reads availability from pre-generated Slot rows; 'virtual'
+# computes it from TechnicianSchedule rules and only creates a Slot on booking;
+# 'bitmap' is 'virtual' backed by per-technician-day free masks.
+AVAILABILITY_ENGINE = 'materialized'
+
+# Per-process cache. Use a shared backend (Redis, Memcached) when running more
+# than one process (web workers, run_jobs): invalidations only reach the process
+# that sends them, so with this backend entries are kept short instead.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crm',
+    }
+}
+
+# Seconds a cached (technician, date) availability list may live. Entries are
+# invalidated on booking and schedule changes; this only bounds staleness.
+# Capped at LOCAL_CACHE_MAX_TIMEOUT with LocMemCache (see below).
+AVAILABILITY_CACHE_TIMEOUT = 300
+
+# Seconds the month-view availability heatmap is cached for (not invalidated).
+AVAILABILITY_HEATMAP_TIMEOUT = 60
+
+# Seconds the appointment list's total count is cached for (not invalidated).
+APPOINTMENT_COUNT_TIMEOUT = 60
+
+# Seconds a user's team list is cached for; changes to the team invalidate it.
+TEAM_CACHE_TIMEOUT = 3600
+
+# Seconds the city/area tree is cached for; City and Area changes invalidate it.
+AREA_TREE_CACHE_TIMEOUT = 86400
+
+# With the per-process LocMemCache an invalidation only reaches one worker, so
+# the availability, team and area tree timeouts are capped at this many
+# seconds (accounts/caching.py). warm_availability_cache needs a shared backend.
+LOCAL_CACHE_MAX_TIMEOUT = 60
+
+# Seconds a slot picked in the booking form stays hidden from other agents.
+# Run `manage.py reap_slot_holds` periodically to delete expired holds.
+SLOT_HOLD_SECONDS = 180
+
+# Queue slot generation as BackgroundJob rows instead of running it in the
+# request. Only turn this on where `manage.py run_jobs` is kept running (e.g.
+# under systemd or supervisor): without a worker no slots are generated.
+SLOT_JOBS_ASYNC = False
+
+# Seconds without a heartbeat after which a RUNNING job is treated as
+# abandoned by a dead worker and queued again.
+JOB_STALE_SECONDS = 600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
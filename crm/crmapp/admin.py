@@ -1,16 +1,29 @@
 # crm/admin.py
 
+from django import forms
 from django.contrib import admin
 from .models import CustomUser, Customer, Technician, TechnicianSchedule
+from .forms import TechnicianScheduleInlineFormSet
 from accounts.models import City, Area, Service
+from accounts.phones import phone_key
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'mobile_number',  'area', 'created_by', 'created_at', 'creation_method', 'create_account')
     list_filter = ('created_at', 'creation_method', 'create_account')
-    search_fields = ('name', 'mobile_number',  'area')
+    search_fields = ('name', 'mobile_number', 'area__name')
     readonly_fields = ('created_by', 'created_at', 'updated_at', 'creation_method')
 
+    def get_search_results(self, request, queryset, search_term):
+        filtered = queryset
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        # A full number in any format finds the customer through the normalized key,
+        # within the changelist filters already applied to the incoming queryset.
+        key = phone_key(search_term)
+        if key:
+            queryset |= filtered.filter(mobile_key=key)
+        return queryset, may_have_duplicates
+
     def save_model(self, request, obj, form, change):
         if not change:
             obj.created_by = request.user
@@ -30,6 +43,7 @@ class CustomerAdmin(admin.ModelAdmin):
             
 class TechnicianScheduleInline(admin.TabularInline):
     model = TechnicianSchedule
+    formset = TechnicianScheduleInlineFormSet
     extra = 1  # Number of extra forms to display
     autocomplete_fields = ['schedule']
     # Optionally, you can add fields to display in the inline
@@ -136,20 +150,22 @@ from .models import Appointment, TechnicianSchedule, Slot
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
     list_display = ('customer', 'get_technician', 'get_date', 'get_time', 'status')
-    list_filter = ('status', 'slot__date', 'slot__technician')
-    search_fields = ('customer__name', 'slot__technician__name')
-    date_hierarchy = 'slot__date'
+    list_filter = ('status', 'date', 'technician')
+    search_fields = ('customer__name', 'technician__user__first_name', 'technician__user__last_name')
+    date_hierarchy = 'date'
+    list_select_related = ('customer', 'technician__user')
 
     def get_technician(self, obj):
-        return obj.slot.technician
+        return obj.technician
     get_technician.short_description = 'Technician'
 
     def get_date(self, obj):
-        return obj.slot.date
+        return obj.date
     get_date.short_description = 'Date'
+    get_date.admin_order_field = 'date'
 
     def get_time(self, obj):
-        return f"{obj.slot.start_time.strftime('%H:%M')} - {obj.slot.end_time.strftime('%H:%M')}"
+        return f"{obj.start_time.strftime('%H:%M')} - {obj.end_time.strftime('%H:%M')}"
     get_time.short_description = 'Time'
 
 @admin.register(TechnicianSchedule)
@@ -167,4 +183,13 @@ class SlotAdmin(admin.ModelAdmin):
 
     def is_booked(self, obj):
         return hasattr(obj, 'appointment')
-    is_booked.boolean = True
\ No newline at end of file
+    is_booked.boolean = True
+
+from .models import BackgroundJob
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('kind', 'key', 'status', 'payload', 'progress', 'result', 'error', 'created_by',
+                       'created_at', 'started_at', 'heartbeat_at', 'finished_at')
@@ -4,12 +4,13 @@ from rest_framework import generics, permissions
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from .models import Customer
-from .serializers import CustomerSerializer
+from .serializers import CustomerSerializer, TechnicianSerializer
+from .customer_ingest import ingest_customers
+from .bulk_booking import summarize
+from .permissions import IsBackOffice, IsBackOfficeAdminWrites
 from rest_framework import viewsets
 from .models import Technician
 
-from rest_framework.permissions import IsAuthenticated
-
 CustomUser = get_user_model()
 
 class CustomerCreateAPI(generics.CreateAPIView):
@@ -24,8 +25,11 @@ class CustomerCreateAPI(generics.CreateAPIView):
         if create_account:
             # Create a CustomUser for this customer
             password = CustomUser.objects.make_random_password()
+            first_name, _, last_name = customer.name.partition(' ')
             user = CustomUser.objects.create_user(
                 mobile=customer.mobile_number,
+                first_name=first_name,
+                last_name=last_name,
                 password=password
             )
             customer.user = user
@@ -33,19 +37,46 @@ class CustomerCreateAPI(generics.CreateAPIView):
             
             # You might want to send this password to the customer via SMS
             # For now, we'll just include it in the response
-            return Response({
+            self.response_data = {
                 "message": "Customer created successfully with an account",
                 "temporary_password": password
-            })
+            }
         else:
-            return Response({
+            self.response_data = {
                 "message": "Customer created successfully without an account"
-            })
+            }
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.data.update(self.response_data)
+        return response
+
+class CustomerBulkAPI(generics.GenericAPIView):
+    """
+    Create or update up to MAX_INGEST_ROWS customers per call from a JSON list
+    (or {"customers": [...]}), matched on the normalized mobile number.
+    ?dry_run=1 only validates. Accounts are created by background jobs whose
+    ids are returned as account_jobs; poll them under /api/jobs/.
+    """
+    permission_classes = [IsBackOffice]
+
+    def post(self, request):
+        data = request.data
+        rows = data.get('customers', []) if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            return Response({'error': "Expected a list of customer rows."}, status=400)
+        try:
+            report, jobs = ingest_customers(
+                rows, user=request.user, dry_run=request.query_params.get('dry_run') in ('1', 'true'),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response({'summary': summarize(report), 'account_jobs': [job.pk for job in jobs], 'rows': report})
 
 class TechnicianViewSet(viewsets.ModelViewSet):
     queryset = Technician.objects.all()
     serializer_class = TechnicianSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsBackOfficeAdminWrites]
 
     def perform_create(self, serializer):
         create_account = serializer.validated_data.pop('create_account', False)
@@ -79,14 +110,15 @@ class TechnicianViewSet(viewsets.ModelViewSet):
 # crm/api.py
 
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
-from .models import Schedule, TechnicianSchedule
-from .serializers import ScheduleSerializer, TechnicianScheduleSerializer
+from .models import BackgroundJob, Schedule, TechnicianSchedule
+from .serializers import BackgroundJobSerializer, ScheduleSerializer, TechnicianScheduleSerializer
+from .permissions import IsBackOffice, IsBackOfficeAdminWrites
+from .slots import sync_schedule_slots
 
 class ScheduleViewSet(viewsets.ModelViewSet):
     queryset = Schedule.objects.all()
     serializer_class = ScheduleSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsBackOfficeAdminWrites]
 
     def perform_create(self, serializer):
         schedule = serializer.save(created_by=self.request.user)
@@ -94,43 +126,125 @@ class ScheduleViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         schedule = serializer.save()
-        schedule.slots.all().delete()
-        self.create_slots(schedule)
+        sync_schedule_slots(schedule)
 
     def create_slots(self, schedule):
         from .views import create_slots
         create_slots(schedule)
 
 class TechnicianScheduleViewSet(viewsets.ModelViewSet):
+    # Saving queues slot generation (see TechnicianSchedule.request_slot_sync);
+    # the response carries the job id to poll under /api/jobs/.
     queryset = TechnicianSchedule.objects.all()
     serializer_class = TechnicianScheduleSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsBackOfficeAdminWrites]
+
+class BackgroundJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = BackgroundJob.objects.all().order_by('-created_at')
+    serializer_class = BackgroundJobSerializer
+    permission_classes = [IsBackOffice]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        status = self.request.query_params.get('status')
+        if status:
+            queryset = queryset.filter(status=status.upper())
+        return queryset
 
 # crm/api.py
 
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from datetime import datetime
 from .models import Appointment
 from .serializers import AppointmentSerializer
+from .availability import get_engine
+from .availability_cache import cached_free_slots_range
+from .holds import active_holds, without_held
+from .bulk_booking import import_appointments, parse_csv, parse_json, summarize
+from .permissions import IsBackOfficeAdminDeletes
+
+# Upper bounds for one available_slots call (a few weeks of a crew's calendar).
+MAX_AVAILABILITY_DAYS = 31
+MAX_AVAILABILITY_TECHNICIANS = 50
 
 class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsBackOfficeAdminDeletes]
 
     @action(detail=False, methods=['get'])
     def available_slots(self, request):
-        technician_id = request.query_params.get('technician')
-        date = request.query_params.get('date')
-
-        if not technician_id or not date:
-            return Response({'error': 'Both technician and date are required.'}, status=400)
-
-        # Use the same logic as in the get_available_slots view
-        # Return available slots for the given technician and date
+        """
+        Free slots for one or more technicians over a date range:
+        ?technician=1&technician=2 (or technician=1,2) with either date or
+        date_from/date_to. Days map to [start, end, slot] triples.
+        """
+        technician_ids = [
+            value for param in request.query_params.getlist('technician') for value in param.split(',') if value
+        ]
+        date_from = request.query_params.get('date_from') or request.query_params.get('date')
+        date_to = request.query_params.get('date_to') or date_from
+
+        if not technician_ids or not date_from:
+            return Response({'error': 'technician and date (or date_from/date_to) are required.'}, status=400)
+
+        try:
+            technician_ids = sorted({int(value) for value in technician_ids})
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'error': 'Invalid technician or date.'}, status=400)
+        if date_to < date_from:
+            return Response({'error': 'date_to must not be before date_from.'}, status=400)
+        if (date_to - date_from).days >= MAX_AVAILABILITY_DAYS or len(technician_ids) > MAX_AVAILABILITY_TECHNICIANS:
+            return Response({'error': f'At most {MAX_AVAILABILITY_TECHNICIANS} technicians and '
+                                      f'{MAX_AVAILABILITY_DAYS} days per request.'}, status=400)
+
+        days = cached_free_slots_range(technician_ids, date_from, date_to)
+        held = active_holds(technician_ids, date_from, date_to, exclude_user=request.user)
+        technicians = {}
+        for (technician_id, day), slots in sorted(days.items()):
+            technicians.setdefault(str(technician_id), {})[day.isoformat()] = [
+                [slot['start_time'].strftime('%H:%M'), slot['end_time'].strftime('%H:%M'), slot['id']]
+                for slot in without_held(slots, held.get((technician_id, day)))
+            ]
+        return Response({
+            'engine': get_engine().name,
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'technicians': technicians,
+        })
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Book many appointments at once from a JSON list (or {"appointments": [...]}),
+        a text/csv body or an uploaded 'file'. ?dry_run=1 only validates.
+        Returns a per-row report; see crmapp.bulk_booking for the row format.
+        """
+        try:
+            # Checked before request.FILES, which would run DRF's parsers on the CSV body.
+            if request.content_type.startswith('text/csv'):
+                rows = parse_csv(request.body.decode('utf-8-sig'))
+            elif request.FILES.get('file'):
+                upload = request.FILES['file']
+                text = upload.read().decode('utf-8-sig')
+                rows = parse_csv(text) if upload.name.lower().endswith('.csv') else parse_json(text)
+            else:
+                data = request.data
+                rows = data.get('appointments', []) if isinstance(data, dict) else data
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError("Expected a list of appointment rows.")
+            report = import_appointments(
+                rows, user=request.user, dry_run=request.query_params.get('dry_run') in ('1', 'true'),
+            )
+        except (ValueError, UnicodeDecodeError) as e:
+            return Response({'error': str(e)}, status=400)
+        return Response({'summary': summarize(report), 'rows': report})
 
     def perform_create(self, serializer):
+        # Booked through crmapp.booking; a taken slot comes back as a 400 on 'slot'.
         serializer.save()
         # You might want to add additional logic here, such as sending notifications
\ No newline at end of file
@@ -0,0 +1,107 @@
+# crm/appointment_queries.py
+
+"""
+Query helpers shared by the appointment list and exports: date windows,
+filters pushed into SQL, keyset pagination and a cached total count.
+"""
+
+import base64
+import hashlib
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+DEFAULT_COUNT_TIMEOUT = 60
+
+PERIOD_DAYS = {'today': 0, '7d': 7, '1m': 30, '6m': 180, '1y': 365}
+
+# Keyset order; the cursor carries the last row's values of these fields.
+ORDERING = ('date', 'start_time', 'id')
+
+
+def appointment_window(time_period=None, custom_date_range=None, today=None):
+    """(start_date, end_date) for a time_period key or a 'd M, Y to d M, Y' range."""
+    today = today or date.today()
+    if custom_date_range:
+        start_date, end_date = custom_date_range.split(' to ')
+        return (datetime.strptime(start_date, '%d %b, %Y').date(),
+                datetime.strptime(end_date, '%d %b, %Y').date())
+    return today, today + timedelta(days=PERIOD_DAYS.get(time_period, 7))
+
+
+def clean_filters(params):
+    """technician/area/status/service from request params; ids that aren't numbers are dropped."""
+    filters = {'status': params.get('status') or None}
+    for name in ('technician', 'area', 'service'):
+        value = params.get(name) or ''
+        filters[name] = int(value) if value.isdigit() else None
+    return filters
+
+
+def filter_appointments(queryset, start_date=None, end_date=None, technician=None, area=None, status=None,
+                        service=None):
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    if technician:
+        queryset = queryset.filter(technician_id=technician)
+    if area:
+        queryset = queryset.filter(customer__area_id=area)
+    if status:
+        queryset = queryset.filter(status=status)
+    if service:
+        queryset = queryset.filter(service__id=service)
+    return queryset
+
+
+def encode_cursor(appointment):
+    raw = f"{appointment.date.isoformat()}|{appointment.start_time.strftime('%H:%M:%S')}|{appointment.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for a malformed cursor."""
+    slot_date, start_time, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return date.fromisoformat(slot_date), time.fromisoformat(start_time), int(pk)
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=False):
+    """
+    One page of `queryset` in ORDERING (or its reverse) after `cursor`. Returns
+    (rows, next_cursor). The cost of a page doesn't grow with how far into the
+    results it is.
+    """
+    if descending:
+        queryset = queryset.order_by(*(f'-{field}' for field in ORDERING))
+    else:
+        queryset = queryset.order_by(*ORDERING)
+    if cursor:
+        slot_date, start_time, pk = decode_cursor(cursor)
+        after = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'date__{after}': slot_date})
+            | Q(date=slot_date, **{f'start_time__{after}': start_time})
+            | Q(date=slot_date, start_time=start_time, **{f'id__{after}': pk})
+        )
+    rows = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def cached_count(queryset, key_parts):
+    """
+    count() of `queryset`, cached for APPOINTMENT_COUNT_TIMEOUT seconds under
+    `key_parts` (the filters that produced it). May lag new bookings by that long.
+    """
+    digest = hashlib.md5(repr(key_parts).encode()).hexdigest()
+    key = f'appointments:count:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'APPOINTMENT_COUNT_TIMEOUT', DEFAULT_COUNT_TIMEOUT))
+    return count
@@ -0,0 +1,483 @@
+# crm/availability.py
+
+import base64
+import json
+from datetime import date as date_type, datetime, time, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Q
+
+from .slots import is_working_day, iter_slot_times
+
+MATERIALIZED = 'materialized'
+VIRTUAL = 'virtual'
+BITMAP = 'bitmap'
+
+
+def overlaps(start_time, end_time, intervals):
+    return any(start_time < other_end and end_time > other_start for other_start, other_end in intervals)
+
+
+def date_range(date_from, date_to):
+    return [date_from + timedelta(days=offset) for offset in range((date_to - date_from).days + 1)]
+
+
+def technician_name(first_name, last_name, mobile):
+    return f"{first_name} {last_name}".strip() or mobile
+
+
+def search_key(opening):
+    """Ranking of search results: earliest first, ties broken by technician then slot."""
+    return (opening['date'], opening['start_time'], opening['technician_id'], opening['id'])
+
+
+def in_window(opening_date, start_time, end_time, time_from, time_to, now):
+    if time_from and start_time < time_from:
+        return False
+    if time_to and end_time > time_to:
+        return False
+    return not (now and opening_date == now.date() and start_time < now.time())
+
+
+class MaterializedAvailability:
+    """Availability read from pre-generated Slot rows. Slot values are Slot ids."""
+
+    name = MATERIALIZED
+    materializes_slots = True
+
+    def free_slots(self, technician_id, date, appointment_id=None):
+        from .models import Slot
+
+        slots = Slot.objects.filter(technician_id=technician_id, date=date)
+        if appointment_id:
+            slots = slots.filter(Q(appointment__isnull=True) | Q(appointment__id=appointment_id))
+        else:
+            slots = slots.filter(appointment__isnull=True)
+        return list(slots.order_by('start_time').values('id', 'start_time', 'end_time'))
+
+    def free_slots_range(self, technician_ids, date_from, date_to):
+        """{(technician_id, date): free_slots()} for every technician and day in the range, in one query."""
+        from .models import Slot
+
+        days = {(technician_id, day): [] for technician_id in technician_ids for day in date_range(date_from, date_to)}
+        for row in Slot.objects.filter(
+            technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to, appointment__isnull=True,
+        ).order_by('date', 'start_time').values('id', 'technician_id', 'date', 'start_time', 'end_time'):
+            days[row.pop('technician_id'), row.pop('date')].append(row)
+        return days
+
+    def slot_value(self, slot):
+        return slot.pk
+
+    def search(self, technicians, date_from, date_to, time_from=None, time_to=None, after=None, limit=10, now=None):
+        """Free slots of `technicians` (a queryset) ranked by search_key, in one query."""
+        from .models import Slot
+
+        slots = Slot.objects.filter(
+            technician__in=technicians.values('pk'), appointment__isnull=True, date__gte=date_from, date__lte=date_to,
+        )
+        if time_from:
+            slots = slots.filter(start_time__gte=time_from)
+        if time_to:
+            slots = slots.filter(end_time__lte=time_to)
+        if now:
+            slots = slots.exclude(date=now.date(), start_time__lt=now.time())
+        if after:
+            # Keyset pagination: continue strictly after the last row returned.
+            after_date, after_start, after_technician, after_id = after
+            slots = slots.filter(
+                Q(date__gt=after_date)
+                | Q(date=after_date, start_time__gt=after_start)
+                | Q(date=after_date, start_time=after_start, technician_id__gt=after_technician)
+                | Q(date=after_date, start_time=after_start, technician_id=after_technician, id__gt=after_id)
+            )
+        rows = slots.order_by('date', 'start_time', 'technician_id', 'id').values_list(
+            'id', 'technician_id', 'date', 'start_time', 'end_time',
+            'technician__user__first_name', 'technician__user__last_name', 'technician__user__mobile',
+        )[:limit]
+        return [
+            {'id': slot_id, 'technician_id': technician_id, 'technician_name': technician_name(first, last, mobile),
+             'date': slot_date, 'start_time': start_time, 'end_time': end_time}
+            for slot_id, technician_id, slot_date, start_time, end_time, first, last, mobile in rows
+        ]
+
+    def day_counts(self, technicians, date_from, date_to, by_technician=False):
+        """Free and booked slot counts per day (and technician) in one GROUP BY query."""
+        from .models import Slot
+
+        fields = ['date', 'technician_id'] if by_technician else ['date']
+        return list(
+            Slot.objects.filter(technician__in=technicians.values('pk'), date__gte=date_from, date__lte=date_to)
+            .values(*fields)
+            .annotate(free=Count('id', filter=Q(appointment__isnull=True)), booked=Count('appointment'))
+            .order_by(*fields)
+        )
+
+    def resolve_slot(self, technician, date, value, appointment_id=None):
+        from .models import Slot
+
+        try:
+            return Slot.objects.get(pk=int(value), technician=technician, date=date)
+        except (Slot.DoesNotExist, ValueError, TypeError):
+            raise ValidationError("The selected slot is not available for this technician and date.")
+
+    def slot_times(self, technician_id, date, value):
+        """(start_time, end_time) of a slot value, without checking that it is free."""
+        from .models import Slot
+
+        try:
+            times = Slot.objects.filter(pk=int(value), technician_id=technician_id, date=date).values_list(
+                'start_time', 'end_time').first()
+        except (ValueError, TypeError):
+            times = None
+        if times is None:
+            raise ValidationError("The selected slot is not available for this technician and date.")
+        return times
+
+
+class VirtualAvailability:
+    """
+    Availability computed from TechnicianSchedule and Schedule rules minus booked
+    appointments. Nothing is stored until a booking materializes its Slot row.
+
+    Slot values are "<schedule_id>-<HHMM>-<HHMM>" tokens; the technician and
+    date come from the request.
+    """
+
+    name = VIRTUAL
+    materializes_slots = False
+
+    def schedules_for(self, technician_id, date):
+        from .models import TechnicianSchedule
+
+        return [
+            technician_schedule.schedule
+            for technician_schedule in TechnicianSchedule.objects.filter(
+                technician_id=technician_id, start_date__lte=date,
+            ).exclude(end_date__lt=date).select_related('schedule')
+            if is_working_day(technician_schedule.schedule, date)
+        ]
+
+    def booked_intervals(self, technician_id, date, appointment_id=None):
+        from .models import Slot
+
+        booked = Slot.objects.filter(technician_id=technician_id, date=date, appointment__isnull=False)
+        if appointment_id:
+            booked = booked.exclude(appointment__id=appointment_id)
+        return list(booked.values_list('start_time', 'end_time'))
+
+    def free_slots(self, technician_id, date, appointment_id=None):
+        booked = self.booked_intervals(technician_id, date, appointment_id)
+        slots = [
+            {'id': self.token(schedule.pk, start_time, end_time), 'start_time': start_time, 'end_time': end_time}
+            for schedule in self.schedules_for(technician_id, date)
+            for start_time, end_time in iter_slot_times(schedule, date)
+            if not overlaps(start_time, end_time, booked)
+        ]
+        return sorted(slots, key=lambda slot: slot['start_time'])
+
+    def free_checker(self, technician_ids, date_from, date_to):
+        """Return is_free(technician_id, date, start_time, end_time) for a date range, in one query."""
+        from .models import Slot
+
+        booked = {}
+        for technician_id, slot_date, start_time, end_time in Slot.objects.filter(
+            technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to, appointment__isnull=False,
+        ).values_list('technician_id', 'date', 'start_time', 'end_time'):
+            booked.setdefault((technician_id, slot_date), []).append((start_time, end_time))
+
+        def is_free(technician_id, slot_date, start_time, end_time):
+            return not overlaps(start_time, end_time, booked.get((technician_id, slot_date), ()))
+        return is_free
+
+    def free_slots_range(self, technician_ids, date_from, date_to):
+        """{(technician_id, date): free_slots()} for every technician and day in the range, in two queries."""
+        from .models import TechnicianSchedule
+
+        days = {(technician_id, day): [] for technician_id in technician_ids for day in date_range(date_from, date_to)}
+        assignments = list(
+            TechnicianSchedule.objects.filter(
+                technician_id__in=technician_ids, start_date__lte=date_to,
+            ).exclude(end_date__lt=date_from).select_related('schedule')
+        )
+        if not assignments:
+            return days
+        is_free = self.free_checker({a.technician_id for a in assignments}, date_from, date_to)
+        for assignment in assignments:
+            for day in date_range(max(date_from, assignment.start_date), min(date_to, assignment.end_date or date_to)):
+                if not is_working_day(assignment.schedule, day):
+                    continue
+                days[assignment.technician_id, day].extend(
+                    {'id': self.token(assignment.schedule_id, start_time, end_time),
+                     'start_time': start_time, 'end_time': end_time}
+                    for start_time, end_time in iter_slot_times(assignment.schedule, day)
+                    if is_free(assignment.technician_id, day, start_time, end_time)
+                )
+        for slots in days.values():
+            slots.sort(key=lambda slot: slot['start_time'])
+        return days
+
+    def day_counts(self, technicians, date_from, date_to, by_technician=False):
+        """
+        Free and booked slot counts per day (and technician). Free slots are
+        not stored, so they come from free_slots_range(); bookings are one
+        GROUP BY over Slot.
+        """
+        from .models import Slot
+
+        technician_ids = list(technicians.values_list('pk', flat=True).distinct())
+        if not technician_ids:
+            return []
+        counts = {}
+        for (technician_id, day), slots in self.free_slots_range(technician_ids, date_from, date_to).items():
+            key = (day, technician_id) if by_technician else (day,)
+            counts.setdefault(key, {'free': 0, 'booked': 0})['free'] += len(slots)
+        for row in Slot.objects.filter(
+            technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to, appointment__isnull=False,
+        ).values('date', 'technician_id').annotate(booked=Count('id')):
+            key = (row['date'], row['technician_id']) if by_technician else (row['date'],)
+            counts.setdefault(key, {'free': 0, 'booked': 0})['booked'] += row['booked']
+        fields = ['date', 'technician_id'] if by_technician else ['date']
+        return [
+            {**dict(zip(fields, key)), **value} for key, value in sorted(counts.items())
+            if value['free'] or value['booked']
+        ]
+
+    def search(self, technicians, date_from, date_to, time_from=None, time_to=None, after=None, limit=10, now=None):
+        """
+        Free slots of `technicians` (a queryset) ranked by search_key. Reads the
+        schedules and the bookings of the range in two queries, then walks
+        the days in order and stops once `limit` openings are found.
+        """
+        from .models import TechnicianSchedule
+
+        assignments = list(
+            TechnicianSchedule.objects.filter(
+                technician__in=technicians.values('pk'), start_date__lte=date_to,
+            ).exclude(end_date__lt=date_from).select_related('schedule', 'technician__user')
+        )
+        if not assignments:
+            return []
+        is_free = self.free_checker({a.technician_id for a in assignments}, date_from, date_to)
+
+        openings = []
+        current = date_from
+        while current <= date_to and len(openings) < limit:
+            day = []
+            for assignment in assignments:
+                if (assignment.start_date > current or (assignment.end_date and assignment.end_date < current)
+                        or not is_working_day(assignment.schedule, current)):
+                    continue
+                user = assignment.technician.user
+                for start_time, end_time in iter_slot_times(assignment.schedule, current):
+                    opening = {
+                        'id': self.token(assignment.schedule_id, start_time, end_time),
+                        'technician_id': assignment.technician_id,
+                        'technician_name': technician_name(user.first_name, user.last_name, user.mobile),
+                        'date': current, 'start_time': start_time, 'end_time': end_time,
+                    }
+                    if after and search_key(opening) <= tuple(after):
+                        continue
+                    if (in_window(current, start_time, end_time, time_from, time_to, now)
+                            and is_free(assignment.technician_id, current, start_time, end_time)):
+                        day.append(opening)
+            openings.extend(sorted(day, key=search_key))
+            current += timedelta(days=1)
+        return openings[:limit]
+
+    def token(self, schedule_id, start_time, end_time):
+        return f"{schedule_id}-{start_time:%H%M}-{end_time:%H%M}"
+
+    def slot_value(self, slot):
+        return self.token(slot.schedule_id, slot.start_time, slot.end_time)
+
+    def parse_token(self, value):
+        try:
+            schedule_id, start, end = str(value).split('-')
+            return (int(schedule_id), datetime.strptime(start, '%H%M').time(),
+                    datetime.strptime(end, '%H%M').time())
+        except ValueError:
+            raise ValidationError("Invalid time slot.")
+
+    def slot_times(self, technician_id, date, value):
+        schedule_id, start_time, end_time = self.parse_token(value)
+        return start_time, end_time
+
+    def find_slot(self, technician, date, value, appointment_id=None):
+        """Validate a token and return its (schedule, start_time, end_time) without writing anything."""
+        schedule_id, start_time, end_time = self.parse_token(value)
+        schedule = next((s for s in self.schedules_for(technician.pk, date) if s.pk == schedule_id), None)
+        if schedule is None or (start_time, end_time) not in set(iter_slot_times(schedule, date)):
+            raise ValidationError("The selected slot is not available for this technician and date.")
+        if not self.is_free(technician.pk, date, start_time, end_time, appointment_id):
+            raise ValidationError("This slot is already booked.")
+        return schedule, start_time, end_time
+
+    def is_free(self, technician_id, date, start_time, end_time, appointment_id=None):
+        return not overlaps(start_time, end_time, self.booked_intervals(technician_id, date, appointment_id))
+
+    def resolve_slot(self, technician, date, value, appointment_id=None):
+        """
+        Return the Slot row for a token, creating it if needed. Call inside the
+        transaction that saves the Appointment so the row only exists if the
+        booking does.
+        """
+        from .models import Slot
+
+        schedule, start_time, end_time = self.find_slot(technician, date, value, appointment_id)
+        slot, created = Slot.objects.get_or_create(
+            schedule=schedule, technician=technician, date=date, start_time=start_time, end_time=end_time,
+        )
+        return slot
+
+
+class BitmapAvailability(VirtualAvailability):
+    """
+    Rule-computed slots filtered through the per-technician-day free bitmap
+    (TechnicianDayAvailability) instead of a query over booked Slot rows.
+    Tokens are the same as VirtualAvailability's.
+    """
+
+    name = BITMAP
+
+    def free_mask(self, technician_id, date, appointment_id=None):
+        from .bitmaps import get_day_masks, interval_mask
+        from .models import Slot
+
+        mask = get_day_masks(technician_id, [date])[date]
+        if appointment_id:
+            # The appointment being edited may keep its own slot.
+            own = Slot.objects.filter(appointment__id=appointment_id, technician_id=technician_id, date=date).first()
+            if own:
+                mask |= interval_mask(own.start_time, own.end_time)
+        return mask
+
+    def free_slots(self, technician_id, date, appointment_id=None):
+        from .bitmaps import interval_mask
+
+        free = self.free_mask(technician_id, date, appointment_id)
+        if not free:
+            return []
+        slots = []
+        for schedule in self.schedules_for(technician_id, date):
+            for start_time, end_time in iter_slot_times(schedule, date):
+                mask = interval_mask(start_time, end_time)
+                if free & mask == mask:
+                    slots.append({'id': self.token(schedule.pk, start_time, end_time),
+                                  'start_time': start_time, 'end_time': end_time})
+        return sorted(slots, key=lambda slot: slot['start_time'])
+
+    def is_free(self, technician_id, date, start_time, end_time, appointment_id=None):
+        from .bitmaps import interval_mask
+
+        mask = interval_mask(start_time, end_time)
+        return self.free_mask(technician_id, date, appointment_id) & mask == mask
+
+    def free_checker(self, technician_ids, date_from, date_to):
+        from .bitmaps import interval_mask, rebuild_day_masks
+        from .models import TechnicianDayAvailability
+
+        masks = {
+            (technician_id, day): mask
+            for technician_id, day, mask in TechnicianDayAvailability.objects.filter(
+                technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to,
+            ).values_list('technician_id', 'date', 'free_mask')
+        }
+
+        def is_free(technician_id, slot_date, start_time, end_time):
+            if (technician_id, slot_date) not in masks:
+                # Build the technician's missing days for the whole range at once.
+                for day, mask in rebuild_day_masks(technician_id, date_from, date_to).items():
+                    masks[technician_id, day] = mask
+            mask = interval_mask(start_time, end_time)
+            return masks[technician_id, slot_date] & mask == mask
+        return is_free
+
+
+ENGINES = {
+    MATERIALIZED: MaterializedAvailability,
+    VIRTUAL: VirtualAvailability,
+    BITMAP: BitmapAvailability,
+}
+
+
+def get_engine(name=None):
+    return ENGINES[name or getattr(settings, 'AVAILABILITY_ENGINE', MATERIALIZED)]()
+
+
+def encode_cursor(opening):
+    key = search_key(opening)
+    raw = json.dumps([key[0].isoformat(), key[1].strftime('%H:%M:%S'), key[2], key[3]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        opening_date, start_time, technician_id, slot_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (date_type.fromisoformat(opening_date), time.fromisoformat(start_time), int(technician_id), slot_id)
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid cursor.")
+
+
+def eligible_technicians(area_id=None, city_id=None, service_ids=()):
+    """Technicians working in the area (or anywhere in the city) who offer all of `service_ids`."""
+    from .models import Technician
+
+    technicians = Technician.objects.all()
+    if area_id:
+        technicians = technicians.filter(working_areas__id=area_id)
+    elif city_id:
+        technicians = technicians.filter(working_areas__city_id=city_id)
+    for service_id in service_ids:
+        technicians = technicians.filter(services__id=service_id)
+    return technicians
+
+
+def search_availability(area_id, service_ids=(), date_from=None, date_to=None, time_from=None, time_to=None,
+                        limit=10, cursor=None, user=None):
+    """
+    Earliest open slots across every technician who works in `area_id` and
+    offers all of `service_ids`. Returns (openings, next_cursor); pass
+    next_cursor back to get the following page. Slots held by users other
+    than `user` are left out, so a page can be shorter than `limit`.
+    """
+    from django.utils import timezone
+
+    from .holds import active_holds
+    from .slots import booking_horizon_end
+
+    now = timezone.localtime()
+    date_from = max(date_from or now.date(), now.date())
+    date_to = min(date_to or booking_horizon_end(), booking_horizon_end())
+    technicians = eligible_technicians(area_id=area_id, service_ids=service_ids)
+
+    openings = get_engine().search(
+        technicians, date_from, date_to, time_from, time_to,
+        after=decode_cursor(cursor) if cursor else None, limit=limit + 1, now=now,
+    )
+    next_cursor = encode_cursor(openings[limit - 1]) if len(openings) > limit else None
+    openings = openings[:limit]
+    if openings:
+        held = active_holds({o['technician_id'] for o in openings}, openings[0]['date'], openings[-1]['date'],
+                            exclude_user=user)
+        openings = [
+            o for o in openings
+            if not overlaps(o['start_time'], o['end_time'], held.get((o['technician_id'], o['date']), ()))
+        ]
+    return openings, next_cursor
+
+
+def availability_heatmap(date_from, date_to, area_id=None, city_id=None, service_ids=(), by_technician=False):
+    """
+    Free and booked slot counts per day for the technicians matching the
+    filters, optionally split by technician. Without the split every day of
+    the range is present, with zero counts where nobody works.
+    """
+    rows = get_engine().day_counts(
+        eligible_technicians(area_id, city_id, service_ids), date_from, date_to, by_technician,
+    )
+    if by_technician:
+        return rows
+    counts = {row['date']: row for row in rows}
+    return [counts.get(day, {'date': day, 'free': 0, 'booked': 0}) for day in date_range(date_from, date_to)]
@@ -0,0 +1,121 @@
+# crm/availability_cache.py
+
+"""
+Per-(technician, date) cache of engine.free_slots(). Entries are dropped by
+the Appointment and slots_changed receivers in models.py once the change
+commits. Those deletes only reach other processes (web workers, run_jobs)
+through a shared cache backend; with the per-process LocMemCache entries
+live at most LOCAL_CACHE_MAX_TIMEOUT seconds instead.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from accounts.caching import invalidated_timeout
+
+from .availability import ENGINES, availability_heatmap, date_range, get_engine
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_HEATMAP_TIMEOUT = 60
+HITS_KEY = 'availability:stats:hits'
+MISSES_KEY = 'availability:stats:misses'
+
+
+def cache_key(engine_name, technician_id, date):
+    return f'availability:{engine_name}:{technician_id}:{date.isoformat()}'
+
+
+def _count(key, delta=1):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+
+
+def _timeout():
+    return invalidated_timeout(getattr(settings, 'AVAILABILITY_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def cached_free_slots(technician_id, date, appointment_id=None):
+    engine = get_engine()
+    if appointment_id:
+        # Editing keeps the appointment's own slot selectable; not cached.
+        return engine.free_slots(technician_id, date, appointment_id)
+    key = cache_key(engine.name, technician_id, date)
+    slots = cache.get(key)
+    if slots is not None:
+        _count(HITS_KEY)
+        return slots
+    _count(MISSES_KEY)
+    slots = engine.free_slots(technician_id, date)
+    cache.set(key, slots, _timeout())
+    return slots
+
+
+def cached_free_slots_range(technician_ids, date_from, date_to):
+    """
+    {(technician_id, date): free slots} for several technicians and days.
+    Cached days come from one get_many(); the rest are computed together by
+    the engine's free_slots_range() and stored with one set_many().
+    """
+    engine = get_engine()
+    keys = {
+        cache_key(engine.name, technician_id, day): (technician_id, day)
+        for technician_id in technician_ids for day in date_range(date_from, date_to)
+    }
+    found = cache.get_many(list(keys))
+    days = {keys[key]: slots for key, slots in found.items()}
+    missing = [keys[key] for key in keys if key not in found]
+    _count(HITS_KEY, len(found))
+    _count(MISSES_KEY, len(missing))
+    if missing:
+        computed = engine.free_slots_range(
+            sorted({technician_id for technician_id, _ in missing}),
+            min(day for _, day in missing), max(day for _, day in missing),
+        )
+        fresh = {cache_key(engine.name, *day_key): computed[day_key] for day_key in missing}
+        cache.set_many(fresh, _timeout())
+        days.update({day_key: computed[day_key] for day_key in missing})
+    return days
+
+
+def invalidate(technician_id, date_from, date_to=None):
+    """Drop the cached days of a technician once the current transaction commits."""
+    date_to = date_to or date_from
+    keys = [
+        cache_key(engine_name, technician_id, day)
+        for day in date_range(date_from, date_to)
+        for engine_name in ENGINES
+    ]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def cached_heatmap(date_from, date_to, area_id=None, city_id=None, service_ids=(), by_technician=False):
+    """
+    availability_heatmap() behind a short TTL (AVAILABILITY_HEATMAP_TIMEOUT).
+    Not invalidated on bookings: a month view may lag by up to the TTL.
+    """
+    service_ids = sorted(set(service_ids))
+    key = (f"availability:heatmap:{get_engine().name}:{date_from.isoformat()}:{date_to.isoformat()}:"
+           f"{area_id or ''}:{city_id or ''}:{','.join(map(str, service_ids))}:{int(by_technician)}")
+    rows = cache.get(key)
+    if rows is None:
+        rows = availability_heatmap(date_from, date_to, area_id, city_id, service_ids, by_technician)
+        cache.set(key, rows, getattr(settings, 'AVAILABILITY_HEATMAP_TIMEOUT', DEFAULT_HEATMAP_TIMEOUT))
+    return rows
+
+
+def cache_stats():
+    # Counted in the cache, so with LocMemCache only this process's lookups.
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
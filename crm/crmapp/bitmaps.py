@@ -0,0 +1,200 @@
+# crm/bitmaps.py
+
+"""
+Per-technician-day availability bitmaps. The day is split into fixed units of
+AVAILABILITY_UNIT_MINUTES; bit i of TechnicianDayAvailability.free_mask is set
+when unit i is inside a working schedule and not booked. Bookings flip bits
+with conditional UPDATEs, so two bookings of the same units cannot both win.
+
+The masks are only exact when every slot starts on a unit boundary, so
+while this engine is active schedules must start at a multiple of the unit
+and have a duration that is one (see alignment_error).
+"""
+
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .slots import booking_horizon_end, is_working_day
+
+DEFAULT_UNIT_MINUTES = 30
+
+
+def unit_minutes():
+    minutes = getattr(settings, 'AVAILABILITY_UNIT_MINUTES', DEFAULT_UNIT_MINUTES)
+    # The mask is a signed 64-bit column, so a day must fit in 63 units.
+    if (24 * 60) // minutes > 63:
+        raise ValueError("AVAILABILITY_UNIT_MINUTES is too small to fit a day in a 64-bit mask.")
+    return minutes
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def alignment_error(start_time, duration):
+    """Why a schedule's slots can't be represented in the bitmaps, or None if they can."""
+    unit = unit_minutes()
+    if _minutes(start_time) % unit or duration % unit:
+        return (f"With the bitmap availability engine, schedules must start on a multiple of {unit} minutes "
+                f"and have a slot duration that is a multiple of {unit} minutes.")
+    return None
+
+
+def interval_mask(start_time, end_time, inner=False):
+    """
+    Bits covering [start_time, end_time). By default every unit the interval
+    touches is included (used for bookings); with `inner` only units fully
+    inside it are (used for working hours).
+    """
+    unit = unit_minutes()
+    start, end = _minutes(start_time), _minutes(end_time)
+    if inner:
+        first, last = -(-start // unit), end // unit
+    else:
+        first, last = start // unit, -(-end // unit)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def unit_time(index):
+    minutes = index * unit_minutes()
+    return time(minutes // 60, minutes % 60) if minutes < 24 * 60 else time.max
+
+
+def first_free_run(mask, units):
+    """Index of the first run of `units` consecutive set bits in `mask`, or None."""
+    run = mask
+    for shift in range(1, units):
+        run &= mask >> shift
+    if not run:
+        return None
+    return (run & -run).bit_length() - 1
+
+
+def compute_day_masks(technician_id, dates, exclude_slot_id=None):
+    """
+    {date: free_mask} computed from schedule rules minus booked slots (other
+    than `exclude_slot_id`). Two queries.
+    """
+    from .models import Slot, TechnicianSchedule
+
+    dates = sorted(dates)
+    if not dates:
+        return {}
+    schedules = list(
+        TechnicianSchedule.objects.filter(technician_id=technician_id, start_date__lte=dates[-1])
+        .exclude(end_date__lt=dates[0]).select_related('schedule')
+    )
+    masks = {}
+    for date in dates:
+        mask = 0
+        for technician_schedule in schedules:
+            if (technician_schedule.start_date <= date
+                    and (technician_schedule.end_date is None or technician_schedule.end_date >= date)
+                    and is_working_day(technician_schedule.schedule, date)):
+                schedule = technician_schedule.schedule
+                mask |= interval_mask(schedule.start_time, schedule.end_time, inner=True)
+        masks[date] = mask
+    booked = Slot.objects.filter(
+        technician_id=technician_id, date__in=dates, appointment__isnull=False,
+    ).exclude(pk=exclude_slot_id).values_list('date', 'start_time', 'end_time')
+    for date, start_time, end_time in booked:
+        masks[date] &= ~interval_mask(start_time, end_time)
+    return masks
+
+
+def rebuild_day_masks(technician_id, date_from, date_to):
+    """Recompute and upsert the bitmaps of one technician for [date_from, date_to]."""
+    from .models import TechnicianDayAvailability
+
+    dates = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    masks = compute_day_masks(technician_id, dates)
+    TechnicianDayAvailability.objects.bulk_create(
+        [TechnicianDayAvailability(technician_id=technician_id, date=date, free_mask=mask)
+         for date, mask in masks.items()],
+        update_conflicts=True, unique_fields=['technician', 'date'], update_fields=['free_mask'],
+        batch_size=500,
+    )
+    return masks
+
+
+def get_day_masks(technician_id, dates):
+    """{date: free_mask}, building any missing rows first."""
+    from .models import TechnicianDayAvailability
+
+    masks = dict(
+        TechnicianDayAvailability.objects.filter(technician_id=technician_id, date__in=dates)
+        .values_list('date', 'free_mask')
+    )
+    missing = [date for date in dates if date not in masks]
+    if missing:
+        masks.update(rebuild_day_masks(technician_id, min(missing), max(missing)))
+    return {date: masks[date] for date in dates}
+
+
+def claim(technician_id, date, start_time, end_time):
+    """
+    Clear the bits of a booking. Raises IntegrityError if any of them is
+    already clear, so the surrounding booking transaction rolls back.
+    """
+    from .models import TechnicianDayAvailability
+
+    mask = interval_mask(start_time, end_time)
+    row = TechnicianDayAvailability.objects.filter(technician_id=technician_id, date=date)
+    if not row.exists():
+        # Built from the bookings in this transaction, so it already has the bits cleared.
+        rebuild_day_masks(technician_id, date, date)
+        return
+    claimed = row.alias(hit=F('free_mask').bitand(mask)).filter(hit=mask).update(free_mask=F('free_mask') - mask)
+    if not claimed:
+        raise IntegrityError("This slot is already booked.")
+
+
+def release(technician_id, date, start_time, end_time, exclude_slot_id=None):
+    """
+    Recompute the bits of a cancelled or moved booking from the schedule rules
+    and the bookings that remain, so units another booking still covers stay
+    clear. `exclude_slot_id` is a booking claimed right after (a move within
+    the day), left for claim() to clear.
+    """
+    from .models import TechnicianDayAvailability
+
+    rows = TechnicianDayAvailability.objects.filter(technician_id=technician_id, date=date)
+    with transaction.atomic():
+        # Lock the row first so a concurrent claim() waits for the recomputed bits.
+        if not rows.select_for_update().exists():
+            return
+        mask = interval_mask(start_time, end_time)
+        free = compute_day_masks(technician_id, [date], exclude_slot_id)[date] & mask
+        rows.update(free_mask=F('free_mask').bitand(~mask).bitor(free))
+
+
+def first_free_block(technician_ids, minutes, date_from=None, date_to=None):
+    """
+    First (technician_id, date, start_time, end_time) with `minutes` of
+    consecutive free time, scanning stored bitmaps in one query.
+    """
+    from .models import TechnicianDayAvailability
+
+    date_from = date_from or timezone.now().date()
+    date_to = date_to or booking_horizon_end()
+    units = -(-minutes // unit_minutes())
+    rows = TechnicianDayAvailability.objects.filter(
+        technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to, free_mask__gt=0,
+    ).order_by('date').values_list('technician_id', 'date', 'free_mask')
+    best = None
+    for technician_id, date, mask in rows:
+        if best and date > best[1]:
+            break
+        index = first_free_run(mask, units)
+        if index is not None and (best is None or (date, index) < (best[1], best[2])):
+            best = (technician_id, date, index)
+    if best is None:
+        return None
+    technician_id, date, index = best
+    return technician_id, date, unit_time(index), unit_time(index + units)
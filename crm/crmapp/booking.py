@@ -0,0 +1,70 @@
+# crm/booking.py
+
+"""
+Booking path for appointments. The database decides who gets a slot: the
+unique Appointment.slot column (and, for the bitmap engine, the conditional
+mask update) rejects the second booking, so there is no check-then-insert
+window for two agents to race through.
+"""
+
+from django.db import IntegrityError, transaction
+
+SLOT_TAKEN = "This slot is already booked."
+
+
+class SlotHeld(Exception):
+    pass
+
+
+class BookingResult:
+    def __init__(self, appointment=None, error=None):
+        self.appointment = appointment
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __bool__(self):
+        return self.ok
+
+
+def book_appointment(appointment, save_m2m=None, user=None):
+    """
+    Insert or move `appointment` onto its slot, plus its many-to-many rows via
+    `save_m2m`. Returns a BookingResult whose error is SLOT_TAKEN when another
+    booking holds the slot; nothing is written in that case.
+
+    With `user`, a slot held by another user is refused (SLOT_HELD) and the
+    user's own hold is consumed.
+    """
+    from .holds import SLOT_HELD, held_by_other, lock_technician, release_holds
+
+    # Read the slot before the transaction: on SQLite a read followed by a
+    # write inside one transaction fails with "database is locked" under
+    # concurrent bookings instead of waiting.
+    if appointment.slot_id:
+        appointment.copy_slot_fields()
+    adding = appointment._state.adding
+    try:
+        with transaction.atomic():
+            # The form already validated the fields; the slot is checked by the INSERT itself.
+            appointment.save(validate=False)
+            if user is not None:
+                # Holds are checked after the write and under the lock hold_slot()
+                # takes, so no hold can be placed between the check and the booking.
+                slot = appointment.slot
+                lock_technician(slot.technician_id)
+                if held_by_other(user, slot.technician_id, slot.date, slot.start_time, slot.end_time):
+                    raise SlotHeld
+            if save_m2m:
+                save_m2m()
+            if user is not None:
+                release_holds(user)
+    except SlotHeld:
+        if adding:
+            appointment.pk, appointment._state.adding = None, True
+        return BookingResult(error=SLOT_HELD)
+    except IntegrityError:
+        return BookingResult(error=SLOT_TAKEN)
+    return BookingResult(appointment)
@@ -0,0 +1,281 @@
+# crm/bulk_booking.py
+
+"""
+Bulk appointment import. A batch is validated with a fixed number of
+queries (customers, technicians, slots, holds, services, materials) and
+written with bulk INSERTs. bulk_create() skips model signals, so under the
+bitmap engine the bits are claimed here with the same conditional UPDATE a
+single booking uses, the availability cache is invalidated per technician
+afterwards and the dashboard rollups are updated in one pass.
+
+Rows are dicts with name, mobile_number, technician (user id), date
+(YYYY-MM-DD), start_time (HH:MM) and optional notes, services (service ids)
+and materials (material codes). CSV files use the same columns, with ';'
+between list values.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from accounts.phones import phone_key
+
+from . import availability_cache, bitmaps, customer_search, rollups
+from .availability import BITMAP, get_engine
+from .booking import SLOT_TAKEN, book_appointment
+from .holds import SLOT_HELD, active_holds
+
+MAX_BULK_ROWS = 1000
+# (technician, date) pairs matched per Slot query; keeps the OR-ed WHERE clause small.
+KEY_CHUNK = 200
+LIST_FIELDS = ('services', 'materials')
+
+
+def parse_csv(text):
+    rows = []
+    for row in csv.DictReader(io.StringIO(text)):
+        for field in LIST_FIELDS:
+            row[field] = [value.strip() for value in (row.get(field) or '').split(';') if value.strip()]
+        rows.append(row)
+    return rows
+
+
+def parse_json(text):
+    data = json.loads(text)
+    return data.get('appointments', []) if isinstance(data, dict) else data
+
+
+def _error(index, message):
+    return {'row': index, 'status': 'error', 'error': message}
+
+
+def _clean_row(row):
+    """Normalize one input row; raises ValueError with a message for the report."""
+    missing = [field for field in ('name', 'mobile_number', 'technician', 'date', 'start_time') if not row.get(field)]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+    mobile_key = phone_key(row['mobile_number'])
+    if mobile_key is None:
+        raise ValueError("Invalid mobile_number.")
+    try:
+        technician_id = int(row['technician'])
+        date = datetime.strptime(str(row['date']), '%Y-%m-%d').date()
+        start_time = datetime.strptime(str(row['start_time'])[:5], '%H:%M').time()
+        services = [int(service_id) for service_id in row.get('services') or []]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid technician, date, start_time or services.")
+    return {
+        'name': str(row['name']).strip(),
+        'mobile_number': str(row['mobile_number']).strip(),
+        'mobile_key': mobile_key,
+        'technician_id': technician_id,
+        'date': date,
+        'start_time': start_time,
+        'notes': row.get('notes') or None,
+        'services': services,
+        'materials': [str(code) for code in row.get('materials') or []],
+    }
+
+
+def _slot_rows(keys, *fields):
+    """Values of the Slot rows starting at exactly the (technician_id, date, start_time) `keys`."""
+    from .models import Slot
+
+    starts = {}
+    for technician_id, date, start_time in keys:
+        starts.setdefault((technician_id, date), set()).add(start_time)
+    days = sorted(starts)
+    for chunk in range(0, len(days), KEY_CHUNK):
+        match = Q()
+        for technician_id, date in days[chunk:chunk + KEY_CHUNK]:
+            match |= Q(technician_id=technician_id, date=date, start_time__in=starts[technician_id, date])
+        yield from Slot.objects.filter(match).values_list(*fields)
+
+
+def _find_slots(engine, keys):
+    """
+    {(technician_id, date, start_time): (slot_id or None, schedule_id, end_time, booked)} for the
+    free or booked slots matching `keys`. Rule-computed engines return slot_id None for slots
+    without a row yet.
+    """
+    found = {}
+    for slot_id, technician_id, schedule_id, date, start_time, end_time, appointment_id in _slot_rows(
+        keys, 'id', 'technician_id', 'schedule_id', 'date', 'start_time', 'end_time', 'appointment',
+    ):
+        if engine.materializes_slots or appointment_id:
+            found[technician_id, date, start_time] = (slot_id, schedule_id, end_time, appointment_id is not None)
+    if engine.materializes_slots:
+        return found
+
+    technician_ids = sorted({technician_id for technician_id, _, _ in keys})
+    date_from, date_to = min(date for _, date, _ in keys), max(date for _, date, _ in keys)
+    for (technician_id, date), slots in engine.free_slots_range(technician_ids, date_from, date_to).items():
+        for slot in slots:
+            key = (technician_id, date, slot['start_time'])
+            if key in keys and key not in found:
+                schedule_id = engine.parse_token(slot['id'])[0]
+                found[key] = (None, schedule_id, slot['end_time'], False)
+    return found
+
+
+def import_appointments(rows, user=None, dry_run=False):
+    """
+    Validate and book `rows` as one batch. Returns a report with one entry per
+    input row: {'row', 'status': 'booked'|'valid'|'error', 'appointment'?, 'error'?}.
+    """
+    from accounts.models import Service
+    from .models import Appointment, Customer, Material, Slot, Technician
+
+    if len(rows) > MAX_BULK_ROWS:
+        raise ValueError(f"At most {MAX_BULK_ROWS} rows per batch.")
+
+    report = [None] * len(rows)
+    cleaned = {}
+    for index, row in enumerate(rows):
+        try:
+            cleaned[index] = _clean_row(row)
+        except ValueError as e:
+            report[index] = _error(index, str(e))
+
+    engine = get_engine()
+    technicians = set(Technician.objects.filter(
+        pk__in={row['technician_id'] for row in cleaned.values()}
+    ).values_list('pk', flat=True))
+    services = set(Service.objects.filter(
+        pk__in={service for row in cleaned.values() for service in row['services']}
+    ).values_list('pk', flat=True))
+    materials = dict(Material.objects.filter(
+        code__in={code for row in cleaned.values() for code in row['materials']}
+    ).values_list('code', 'pk'))
+
+    for index, row in list(cleaned.items()):
+        unknown_services = set(row['services']) - services
+        unknown_materials = set(row['materials']) - set(materials)
+        if row['technician_id'] not in technicians:
+            report[index] = _error(index, "Unknown technician.")
+        elif unknown_services:
+            report[index] = _error(index, f"Unknown services: {sorted(unknown_services)}.")
+        elif unknown_materials:
+            report[index] = _error(index, f"Unknown materials: {sorted(unknown_materials)}.")
+        else:
+            continue
+        del cleaned[index]
+
+    keys = {(row['technician_id'], row['date'], row['start_time']) for row in cleaned.values()}
+    found = _find_slots(engine, keys) if keys else {}
+    held = {}
+    if keys and user is not None:
+        held = active_holds(
+            {technician_id for technician_id, _, _ in keys},
+            min(date for _, date, _ in keys), max(date for _, date, _ in keys), exclude_user=user,
+        )
+    claimed = set()
+    for index, row in list(cleaned.items()):
+        key = (row['technician_id'], row['date'], row['start_time'])
+        if key not in found:
+            report[index] = _error(index, "No slot starts at this time for this technician and date.")
+        elif found[key][3] or key in claimed:
+            report[index] = _error(index, SLOT_TAKEN)
+        elif any(start < found[key][2] and end > row['start_time'] for start, end in held.get(key[:2], ())):
+            report[index] = _error(index, SLOT_HELD)
+        else:
+            claimed.add(key)
+            continue
+        del cleaned[index]
+
+    if dry_run or not cleaned:
+        for index in cleaned:
+            report[index] = {'row': index, 'status': 'valid'}
+        return report
+
+    with transaction.atomic():
+        customers = dict(Customer.objects.filter(
+            mobile_key__in={row['mobile_key'] for row in cleaned.values()}
+        ).values_list('mobile_key', 'pk'))
+        new_customers = {}
+        for row in cleaned.values():
+            if row['mobile_key'] not in customers and row['mobile_key'] not in new_customers:
+                new_customers[row['mobile_key']] = Customer(
+                    name=row['name'], mobile_number=row['mobile_number'], mobile_key=row['mobile_key'],
+                    created_by=user, creation_method='API',
+                )
+        for customer in Customer.objects.bulk_create(new_customers.values()):
+            customers[customer.mobile_key] = customer.pk
+        customer_search.index_customers(new_customers.values())
+
+        # Rule-computed engines book slots that have no row yet.
+        missing = [key for key in claimed if found[key][0] is None]
+        if missing:
+            Slot.objects.bulk_create([
+                Slot(schedule_id=found[key][1], technician_id=key[0], date=key[1], start_time=key[2],
+                     end_time=found[key][2])
+                for key in missing
+            ], ignore_conflicts=True)
+            for slot_id, technician_id, date, start_time in _slot_rows(
+                missing, 'id', 'technician_id', 'date', 'start_time',
+            ):
+                if found[technician_id, date, start_time][0] is None:
+                    found[technician_id, date, start_time] = (slot_id,) + found[technician_id, date, start_time][1:]
+
+        appointments = {
+            index: Appointment(
+                customer_id=customers[row['mobile_key']], technician_id=row['technician_id'],
+                slot_id=found[row['technician_id'], row['date'], row['start_time']][0], notes=row['notes'],
+                # bulk_create() skips save(), so the slot columns are set here.
+                date=row['date'], start_time=row['start_time'],
+                end_time=found[row['technician_id'], row['date'], row['start_time']][2],
+            )
+            for index, row in cleaned.items()
+        }
+        dates = {}
+        for row in cleaned.values():
+            dates.setdefault(row['technician_id'], set()).add(row['date'])
+        if engine.name == BITMAP:
+            # claim() can only detect a conflict on an existing row.
+            for technician_id, booked_dates in dates.items():
+                bitmaps.get_day_masks(technician_id, sorted(booked_dates))
+        saved_one_by_one = False
+        try:
+            with transaction.atomic():
+                if engine.name == BITMAP:
+                    for appointment in appointments.values():
+                        bitmaps.claim(appointment.technician_id, appointment.date,
+                                      appointment.start_time, appointment.end_time)
+                Appointment.objects.bulk_create(appointments.values())
+        except IntegrityError:
+            # A slot was booked after validation, or two rows overlap; fall back to
+            # one savepoint per row, where save() claims the bits itself.
+            saved_one_by_one = True
+            for index, appointment in appointments.items():
+                appointment.pk = None
+                if not book_appointment(appointment):
+                    report[index] = _error(index, SLOT_TAKEN)
+            appointments = {index: a for index, a in appointments.items() if report[index] is None}
+
+        Appointment.service.through.objects.bulk_create([
+            Appointment.service.through(appointment_id=appointment.pk, service_id=service_id)
+            for index, appointment in appointments.items() for service_id in set(cleaned[index]['services'])
+        ])
+        Appointment.materials.through.objects.bulk_create([
+            Appointment.materials.through(appointment_id=appointment.pk, material_id=materials[code])
+            for index, appointment in appointments.items() for code in set(cleaned[index]['materials'])
+        ])
+        for index, appointment in appointments.items():
+            report[index] = {'row': index, 'status': 'booked', 'appointment': appointment.pk}
+        # save() already counted the rows it booked; the through rows never send signals.
+        rollups.add_appointments([a.pk for a in appointments.values()], counts=not saved_one_by_one)
+
+        for technician_id, booked_dates in dates.items():
+            availability_cache.invalidate(technician_id, min(booked_dates), max(booked_dates))
+    return report
+
+
+def summarize(report):
+    counts = {}
+    for entry in report:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return counts
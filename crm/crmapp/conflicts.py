@@ -0,0 +1,106 @@
+# crm/conflicts.py
+
+from django.db.models import Q
+
+from .slots import WEEKDAY_FIELDS
+
+
+def conflict_filter(start_date, end_date, schedule):
+    """
+    Q matching TechnicianSchedules whose dates, working days and hours overlap
+    the given assignment. Open-ended (null end_date) ranges overlap everything
+    after their start. Returns None when the schedule has no working days.
+    """
+    days = Q()
+    for day in WEEKDAY_FIELDS:
+        if getattr(schedule, day):
+            days |= Q(**{f'schedule__{day}': True})
+    if not days:
+        return None
+
+    dates = Q(end_date__isnull=True) | Q(end_date__gte=start_date)
+    if end_date:
+        dates &= Q(start_date__lte=end_date)
+    hours = Q(schedule__start_time__lt=schedule.end_time, schedule__end_time__gt=schedule.start_time)
+    return dates & hours & days
+
+
+def _entry(start_date, end_date, start_time, end_time, weekdays, label):
+    return {
+        'start_date': start_date, 'end_date': end_date, 'start_time': start_time, 'end_time': end_time,
+        'weekdays': weekdays, 'label': label,
+    }
+
+
+def _label(name, start_date, end_date):
+    return f"{name} ({start_date} to {end_date or 'ongoing'})"
+
+
+def overlap(a, b):
+    if a['end_date'] and a['end_date'] < b['start_date']:
+        return False
+    if b['end_date'] and b['end_date'] < a['start_date']:
+        return False
+    if not (a['start_time'] < b['end_time'] and a['end_time'] > b['start_time']):
+        return False
+    return bool(a['weekdays'] & b['weekdays'])
+
+
+def find_schedule_conflicts(assignments, ignore=()):
+    """
+    Validate a batch of proposed TechnicianSchedule assignments (saved or not)
+    against each other and against the stored schedules, using one query for
+    the stored ones. Stored rows whose pk is in `ignore` (e.g. being deleted)
+    are skipped. Returns {index in `assignments`: [conflict labels]}.
+    """
+    from .models import Schedule, TechnicianSchedule
+
+    candidates = [
+        (index, assignment) for index, assignment in enumerate(assignments)
+        if assignment.technician_id and assignment.schedule_id and assignment.start_date
+    ]
+    if not candidates:
+        return {}
+
+    uncached = {a.schedule_id for _, a in candidates if not TechnicianSchedule.schedule.is_cached(a)}
+    schedules = Schedule.objects.in_bulk(uncached) if uncached else {}
+    proposed = {}
+    for index, assignment in candidates:
+        schedule = schedules.get(assignment.schedule_id) or assignment.schedule
+        weekdays = {day for day in WEEKDAY_FIELDS if getattr(schedule, day)}
+        proposed[index] = (assignment.technician_id, _entry(
+            assignment.start_date, assignment.end_date, schedule.start_time, schedule.end_time, weekdays,
+            _label(schedule.name, assignment.start_date, assignment.end_date),
+        ))
+
+    earliest = min(entry['start_date'] for _, entry in proposed.values())
+    stored = TechnicianSchedule.objects.filter(
+        technician_id__in={technician_id for technician_id, _ in proposed.values()},
+    ).filter(Q(end_date__isnull=True) | Q(end_date__gte=earliest))
+    if all(entry['end_date'] for _, entry in proposed.values()):
+        stored = stored.filter(start_date__lte=max(entry['end_date'] for _, entry in proposed.values()))
+    # Rows being edited in this batch are compared with their new values instead.
+    stored = stored.exclude(pk__in=[a.pk for _, a in candidates if a.pk] + list(ignore))
+
+    existing = {}
+    for row in stored.values('technician_id', 'start_date', 'end_date', 'schedule__name',
+                             'schedule__start_time', 'schedule__end_time',
+                             *[f'schedule__{day}' for day in WEEKDAY_FIELDS]):
+        existing.setdefault(row['technician_id'], []).append(_entry(
+            row['start_date'], row['end_date'], row['schedule__start_time'], row['schedule__end_time'],
+            {day for day in WEEKDAY_FIELDS if row[f'schedule__{day}']},
+            _label(row['schedule__name'], row['start_date'], row['end_date']),
+        ))
+
+    by_technician = {}
+    for index, (technician_id, entry) in proposed.items():
+        by_technician.setdefault(technician_id, []).append((index, entry))
+
+    conflicts = {}
+    for technician_id, batch in by_technician.items():
+        for index, entry in batch:
+            found = [other['label'] for other in existing.get(technician_id, []) if overlap(entry, other)]
+            found += [other['label'] for other_index, other in batch if other_index != index and overlap(entry, other)]
+            if found:
+                conflicts[index] = found
+    return conflicts
@@ -0,0 +1,314 @@
+# crm/customer_dedupe.py
+
+"""
+Finding and merging near-duplicate customers. Exact duplicates can't exist
+any more (mobile_key is unique); what is left are rows entered with a
+mistyped number, a different country prefix or a number that never
+normalized. The work is linear in the number of customers:
+
+1. Blocking: every customer is hashed into a few blocks: the last
+   PHONE_TAIL digits of its number, and its name (without spaces) together
+   with either half of those digits, so one mistyped digit still shares a
+   block. Only customers sharing a block are compared; blocks bigger than
+   max_block are skipped.
+2. Scoring: each pair in a block gets score_pair(). A pair at or above the
+   threshold is a duplicate only if same_number() holds; otherwise it is
+   only reported for review, since two people with a common name in one
+   area can have numbers a digit apart, or the same digits in two
+   countries. Two customers that both have an account are also left for
+   review: Customer.user is one-to-one, so merging would orphan one.
+3. Clustering: union-find joins the duplicate pairs into clusters and
+   choose_keeper() picks the customer the others are merged into.
+4. Merging: appointments are repointed with one UPDATE per batch of
+   clusters, then the duplicates are deleted.
+"""
+
+import difflib
+import hashlib
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.utils import timezone
+
+from . import customer_search, rollups
+
+PHONE_TAIL = 9
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_BLOCK = 50
+SCAN_CHUNK_SIZE = 5000
+MERGE_BATCH_SIZE = 500
+# Score weights; they add up to 1.
+PHONE_WEIGHT, NAME_WEIGHT, AREA_WEIGHT = 0.5, 0.4, 0.1
+
+NON_WORD = re.compile(r'[^\w\s]|_')
+
+
+def name_key(name):
+    """Lower-case, accent-free, punctuation-free name with its words sorted."""
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(sorted(NON_WORD.sub(' ', name.casefold()).split()))
+
+
+def phone_tail(mobile_key, mobile_number):
+    """The last PHONE_TAIL digits of the number, or '' if it has fewer."""
+    digits = ''.join(char for char in (mobile_key or mobile_number or '') if char.isdigit())
+    return digits[-PHONE_TAIL:] if len(digits) >= PHONE_TAIL else ''
+
+
+def _block_hash(kind, value):
+    return int.from_bytes(hashlib.blake2b(f'{kind}:{value}'.encode(), digest_size=8).digest(), 'big')
+
+
+def block_keys(name, mobile_number, mobile_key):
+    tail = phone_tail(mobile_key, mobile_number)
+    if not tail:
+        return []
+    keys = [_block_hash('phone', tail)]
+    name = name_key(name).replace(' ', '')
+    if name:
+        keys.append(_block_hash('name', f'{name}:{tail[:PHONE_TAIL // 2]}'))
+        keys.append(_block_hash('name', f'{name}:{tail[PHONE_TAIL // 2:]}'))
+    return keys
+
+
+def same_number(a, b):
+    """
+    Whether two customer rows have the same number: the same mobile_key when
+    both normalized, else the same tail, which is all an un-normalized
+    number can be compared on.
+    """
+    if a['mobile_key'] and b['mobile_key']:
+        return a['mobile_key'] == b['mobile_key']
+    return bool(a['tail']) and a['tail'] == b['tail']
+
+
+def phone_similarity(a, b):
+    """1 for the same tail, 0.6 for one wrong or two swapped digits, else 0."""
+    if not a or not b:
+        return 0
+    if a == b:
+        return 1
+    if len(a) != len(b):
+        return 0
+    diffs = [i for i in range(len(a)) if a[i] != b[i]]
+    if len(diffs) == 1:
+        return 0.6
+    if len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]:
+        return 0.6
+    return 0
+
+
+def score_pair(a, b):
+    """
+    Similarity in [0, 1] of two customers given as dicts with 'tail', 'name'
+    (name_key) and 'area_id'.
+    """
+    phone = phone_similarity(a['tail'], b['tail'])
+    # Spaces are ignored: "Al Harbi" and "Alharbi" are the same name.
+    name_a, name_b = a['name'].replace(' ', ''), b['name'].replace(' ', '')
+    name = difflib.SequenceMatcher(None, name_a, name_b).ratio() if name_a and name_b else 0
+    area = 1 if a['area_id'] is not None and a['area_id'] == b['area_id'] else 0
+    return round(PHONE_WEIGHT * phone + NAME_WEIGHT * name + AREA_WEIGHT * area, 3)
+
+
+def find_blocks(customers, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    {block hash: [customer ids]} for the blocks of `customers` (a queryset)
+    with more than one member. A single pass over the table.
+    """
+    blocks = {}
+    rows = customers.order_by().values_list('pk', 'name', 'mobile_number', 'mobile_key')
+    for pk, name, mobile_number, mobile_key in rows.iterator(chunk_size=chunk_size):
+        for key in block_keys(name, mobile_number, mobile_key):
+            # Most blocks hold one customer, so a list is only made for the second one.
+            members = blocks.get(key)
+            if members is None:
+                blocks[key] = pk
+            elif isinstance(members, list):
+                members.append(pk)
+            else:
+                blocks[key] = [members, pk]
+    return {key: members for key, members in blocks.items() if isinstance(members, list)}
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = item
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while item != root:
+            self.parent[item], item = root, self.parent.get(item, item)
+        return root
+
+    def union(self, a, b):
+        self.parent.setdefault(a, a)
+        self.parent.setdefault(b, b)
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), set()).add(item)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def _customer_rows(ids, chunk_size=1000):
+    from .models import Customer
+
+    ids = sorted(ids)
+    rows = {}
+    for start in range(0, len(ids), chunk_size):
+        for pk, name, mobile_number, mobile_key, area_id, user_id in Customer.objects.filter(
+            pk__in=ids[start:start + chunk_size],
+        ).values_list('pk', 'name', 'mobile_number', 'mobile_key', 'area_id', 'user_id'):
+            rows[pk] = {
+                'pk': pk, 'name': name_key(name), 'display_name': name, 'mobile_number': mobile_number,
+                'mobile_key': mobile_key, 'tail': phone_tail(mobile_key, mobile_number), 'area_id': area_id,
+                'user_id': user_id,
+            }
+    return rows
+
+
+def choose_keeper(rows):
+    """The customer to keep: one with an account, then one with a valid number, then the oldest."""
+    return min(rows, key=lambda row: (row['user_id'] is None, row['mobile_key'] is None, row['pk']))
+
+
+def find_duplicates(customers=None, threshold=DEFAULT_THRESHOLD, max_block=DEFAULT_MAX_BLOCK):
+    """
+    Block, score and cluster `customers` (default: all). Returns (clusters,
+    reviews, stats); each cluster is {'keeper', 'duplicates', 'pairs':
+    [(a, b, score)], 'rows'} and each review, a pair that scored high enough
+    but is not merged (a different number, or an account on both sides), is
+    {'score', 'rows'}.
+    """
+    from .models import Appointment, Customer
+
+    if customers is None:
+        customers = Customer.objects.all()
+    stats = {'customers': customers.count(), 'blocks': 0, 'skipped_blocks': 0, 'pairs': 0, 'matches': 0, 'reviews': 0}
+    blocks = find_blocks(customers)
+    candidate_blocks = []
+    for members in blocks.values():
+        if len(members) > max_block:
+            stats['skipped_blocks'] += 1
+        else:
+            candidate_blocks.append(members)
+    stats['blocks'] = len(candidate_blocks)
+    del blocks
+
+    rows = _customer_rows({pk for members in candidate_blocks for pk in members})
+    union_find, scored, matches, reviews = UnionFind(), set(), [], []
+    # Union-find root: whether a customer of its cluster has an account.
+    accounts = {}
+
+    def has_account(pk):
+        root = union_find.find(pk)
+        return accounts.get(root, rows[root]['user_id'] is not None)
+
+    for members in candidate_blocks:
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (min(a, b), max(a, b))
+                if pair in scored:
+                    continue
+                scored.add(pair)
+                if a not in rows or b not in rows:
+                    continue
+                score = score_pair(rows[a], rows[b])
+                if score < threshold:
+                    continue
+                joined = union_find.find(a) == union_find.find(b)
+                if not same_number(rows[a], rows[b]) or (not joined and has_account(a) and has_account(b)):
+                    reviews.append({'score': score, 'rows': [rows[pk] for pk in pair]})
+                    continue
+                account = has_account(a) or has_account(b)
+                matches.append(pair + (score,))
+                union_find.union(a, b)
+                accounts[union_find.find(a)] = account
+    stats['pairs'], stats['matches'], stats['reviews'] = len(scored), len(matches), len(reviews)
+
+    clusters = {}
+    for group in union_find.groups():
+        keeper = choose_keeper([rows[pk] for pk in group])
+        clusters[keeper['pk']] = {
+            'keeper': keeper['pk'],
+            'duplicates': [pk for pk in group if pk != keeper['pk']],
+            'pairs': [],
+            'rows': [rows[pk] for pk in group],
+        }
+    cluster_of = {pk: keeper for keeper, cluster in clusters.items() for pk in [keeper, *cluster['duplicates']]}
+    for a, b, score in matches:
+        clusters[cluster_of[a]]['pairs'].append((a, b, score))
+
+    appointment_counts = {}
+    ids = sorted({*cluster_of, *(row['pk'] for review in reviews for row in review['rows'])})
+    for start in range(0, len(ids), 1000):
+        appointment_counts.update(
+            Appointment.objects.filter(customer_id__in=ids[start:start + 1000]).order_by()
+            .values_list('customer_id').annotate(n=Count('pk'))
+        )
+    for group in [*clusters.values(), *reviews]:
+        for row in group['rows']:
+            row['appointments'] = appointment_counts.get(row['pk'], 0)
+    stats['clusters'] = len(clusters)
+    stats['duplicates'] = sum(len(cluster['duplicates']) for cluster in clusters.values())
+    return list(clusters.values()), reviews, stats
+
+
+def merge_clusters(clusters, batch_size=MERGE_BATCH_SIZE):
+    """
+    Merge each cluster's duplicates into its keeper: appointments are
+    repointed, an account, area and notes the keeper lacks are taken over,
+    and the duplicates are deleted. Returns {'customers', 'appointments'}.
+    """
+    from .models import Appointment, Customer
+
+    merged = {'customers': 0, 'appointments': 0}
+    for start in range(0, len(clusters), batch_size):
+        batch = clusters[start:start + batch_size]
+        moves = {pk: cluster['keeper'] for cluster in batch for pk in cluster['duplicates']}
+        with transaction.atomic():
+            customers = Customer.objects.in_bulk([*moves, *(cluster['keeper'] for cluster in batch)])
+            moves = {pk: keeper for pk, keeper in moves.items() if pk in customers and keeper in customers}
+            if not moves:
+                continue
+            appointment_ids = list(Appointment.objects.filter(customer_id__in=moves).values_list('pk', flat=True))
+            # The customer's area is part of the rollup key.
+            rollups.add_appointments(appointment_ids, sign=-1)
+            Appointment.objects.filter(customer_id__in=moves).update(customer_id=Case(
+                *(When(customer_id=pk, then=Value(keeper)) for pk, keeper in moves.items()),
+                output_field=IntegerField(),
+            ))
+            rollups.add_appointments(appointment_ids, sign=1)
+
+            keepers, released = {}, []
+            now = timezone.now()
+            for pk, keeper_pk in sorted(moves.items()):
+                keeper, duplicate = customers[keeper_pk], customers[pk]
+                keepers[keeper_pk] = keeper
+                if not keeper.user_id and duplicate.user_id:
+                    keeper.user_id = duplicate.user_id
+                    released.append(pk)
+                keeper.area_id = keeper.area_id or duplicate.area_id
+                if duplicate.notes and duplicate.notes not in (keeper.notes or ''):
+                    keeper.notes = f"{keeper.notes}\n{duplicate.notes}" if keeper.notes else duplicate.notes
+                keeper.updated_at = now
+            # Customer.user is one-to-one: free the accounts before handing them over.
+            Customer.objects.filter(pk__in=released).update(user=None)
+            Customer.objects.bulk_update(keepers.values(), ['user', 'area', 'notes', 'updated_at'])
+            # A keeper that took over an area: its appointments, merged ones included, move with it.
+            rollups.move_customer_areas(rollups.area_changes(keepers.values()))
+            Customer.objects.filter(pk__in=moves).delete()
+            customer_search.index_customers(keepers.values())
+        merged['customers'] += len(moves)
+        merged['appointments'] += len(appointment_ids)
+    return merged
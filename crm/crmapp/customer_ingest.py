@@ -0,0 +1,207 @@
+# crm/customer_ingest.py
+
+"""
+Batch customer upsert for CRM syncs. A batch is matched against existing
+customers on mobile_key in one query and written with bulk_create() and
+bulk_update(), so the cost per record is a fraction of a query instead of a
+full request. Account creation is not done inline: customers that asked for
+an account are queued as PROVISION_CUSTOMER_ACCOUNTS jobs of ACCOUNT_JOB_SIZE
+customers, which provision_accounts() runs in the workers. The accounts get
+unusable passwords, so no password is ever stored in a job result; an admin
+gives the customer one with the users admin's "Reset password" action.
+
+Rows are dicts with name and mobile_number, and optional area (area id),
+notes and create_account. Fields left out of a row are not changed on an
+existing customer.
+"""
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.phones import phone_key
+
+from . import customer_search, rollups
+
+MAX_INGEST_ROWS = 5000
+ACCOUNT_JOB_SIZE = 200
+UPDATE_FIELDS = ('name', 'area_id', 'notes')
+TRUE_VALUES = (True, 1, '1', 'true', 'True', 'yes')
+
+
+def _error(index, message):
+    return {'row': index, 'status': 'error', 'error': message}
+
+
+def _clean_row(row):
+    """Normalize one input row; raises ValueError with a message for the report."""
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object.")
+    missing = [field for field in ('name', 'mobile_number') if not row.get(field)]
+    if missing:
+        raise ValueError(f"Missing {', '.join(missing)}.")
+    mobile_key = phone_key(row['mobile_number'])
+    if mobile_key is None:
+        raise ValueError("Invalid mobile_number.")
+    cleaned = {
+        'name': str(row['name']).strip()[:100],
+        'mobile_key': mobile_key,
+        'create_account': row.get('create_account') in TRUE_VALUES,
+    }
+    if 'area' in row:
+        try:
+            cleaned['area_id'] = int(row['area']) if row['area'] not in (None, '') else None
+        except (TypeError, ValueError):
+            raise ValueError("Invalid area.")
+    if 'notes' in row:
+        cleaned['notes'] = row['notes'] or None
+    return cleaned
+
+
+def ingest_customers(rows, user=None, dry_run=False):
+    """
+    Create or update `rows` as one batch. Returns (report, jobs): one report
+    entry per input row, {'row', 'status': 'created'|'updated'|'unchanged'|
+    'valid'|'error', 'customer'?, 'account'?, 'error'?}, and the queued
+    account jobs. 'account' is 'queued' when an account will be
+    created for the customer.
+    """
+    from accounts.models import Area
+    from .jobs import enqueue_account_provisioning
+    from .models import Customer
+
+    if len(rows) > MAX_INGEST_ROWS:
+        raise ValueError(f"At most {MAX_INGEST_ROWS} rows per batch.")
+
+    report = [None] * len(rows)
+    cleaned = {}
+    seen = {}
+    for index, row in enumerate(rows):
+        try:
+            row = _clean_row(row)
+        except ValueError as e:
+            report[index] = _error(index, str(e))
+            continue
+        if row['mobile_key'] in seen:
+            report[index] = _error(index, f"Same mobile number as row {seen[row['mobile_key']]}.")
+            continue
+        seen[row['mobile_key']] = index
+        cleaned[index] = row
+
+    areas = set(Area.objects.filter(
+        pk__in={row['area_id'] for row in cleaned.values() if row.get('area_id')}
+    ).values_list('pk', flat=True))
+    for index, row in list(cleaned.items()):
+        if row.get('area_id') and row['area_id'] not in areas:
+            report[index] = _error(index, "Unknown area.")
+            del cleaned[index]
+
+    existing = {
+        customer.mobile_key: customer
+        for customer in Customer.objects.filter(
+            mobile_key__in={row['mobile_key'] for row in cleaned.values()},
+        ).only('pk', 'mobile_key', 'user_id', 'create_account', *UPDATE_FIELDS)
+    }
+    if dry_run:
+        for index, row in cleaned.items():
+            customer = existing.get(row['mobile_key'])
+            report[index] = {'row': index, 'status': 'valid', 'customer': customer.pk if customer else None}
+        return report, []
+
+    now = timezone.now()
+    created, updated = {}, {}
+    for index, row in cleaned.items():
+        customer = existing.get(row['mobile_key'])
+        if customer is None:
+            created[index] = Customer(
+                name=row['name'], mobile_number=row['mobile_key'], mobile_key=row['mobile_key'],
+                area_id=row.get('area_id'), notes=row.get('notes'), create_account=row['create_account'],
+                created_by=user, creation_method='API',
+            )
+            continue
+        changed = False
+        for field in UPDATE_FIELDS:
+            if field in row and getattr(customer, field) != row[field]:
+                setattr(customer, field, row[field])
+                changed = True
+        if row['create_account'] and not customer.create_account:
+            customer.create_account = changed = True
+        if changed:
+            customer.updated_at = now
+            updated[index] = customer
+        else:
+            report[index] = {'row': index, 'status': 'unchanged', 'customer': customer.pk}
+
+    with transaction.atomic():
+        Customer.objects.bulk_create(created.values(), batch_size=500)
+        Customer.objects.bulk_update(
+            updated.values(), [*UPDATE_FIELDS, 'create_account', 'updated_at'], batch_size=500,
+        )
+        # bulk_update() skips the Customer receiver that re-keys the dashboard rollups.
+        rollups.move_customer_areas(rollups.area_changes(updated.values()))
+        # bulk writes skip the post_save receiver that maintains the search index.
+        customer_search.index_customers([*created.values(), *updated.values()])
+        for status, customers in (('created', created), ('updated', updated)):
+            for index, customer in customers.items():
+                report[index] = {'row': index, 'status': status, 'customer': customer.pk}
+
+        pending = []
+        for index, row in cleaned.items():
+            customer = created.get(index) or updated.get(index) or existing[row['mobile_key']]
+            if row['create_account'] and not customer.user_id:
+                pending.append(customer.pk)
+                report[index]['account'] = 'queued'
+        jobs = [
+            enqueue_account_provisioning(pending[start:start + ACCOUNT_JOB_SIZE], created_by=user)
+            for start in range(0, len(pending), ACCOUNT_JOB_SIZE)
+        ]
+    return report, jobs
+
+
+def provision_accounts(customer_ids, progress=None, batch_size=50):
+    """
+    Create and link a CustomUser with an unusable password for each of
+    `customer_ids` that still asks for an account and has none. A CUSTOMER
+    user that already exists with the same mobile is linked instead; one that
+    another customer owns, or a staff or technician account, is skipped.
+    Returns {'created', 'linked', 'skipped'}.
+    """
+    from accounts.models import CustomUser
+    from .models import Customer
+
+    created = linked = skipped = 0
+    customer_ids = list(customer_ids)
+    for start in range(0, len(customer_ids), batch_size):
+        with transaction.atomic():
+            customers = list(Customer.objects.filter(
+                pk__in=customer_ids[start:start + batch_size], create_account=True, user__isnull=True,
+            ).exclude(mobile_key=None))
+            users, taken = {}, set()
+            for mobile, user_id, user_type, owner_id in CustomUser.objects.filter(
+                mobile__in=[customer.mobile_key for customer in customers],
+            ).values_list('mobile', 'pk', 'user_type', 'customer'):
+                if user_type == 'CUSTOMER' and owner_id is None:
+                    users[mobile] = user_id
+                else:
+                    taken.add(mobile)
+            customers = [customer for customer in customers if customer.mobile_key not in taken]
+            skipped += len(taken)
+            new_users = {}
+            for customer in customers:
+                if customer.mobile_key in users:
+                    linked += 1
+                    continue
+                first_name, _, last_name = customer.name.partition(' ')
+                new_users[customer.mobile_key] = CustomUser(
+                    mobile=customer.mobile_key, first_name=first_name[:30], last_name=last_name[:150],
+                    user_type='CUSTOMER', password=make_password(None),
+                )
+            for new_user in CustomUser.objects.bulk_create(new_users.values()):
+                users[new_user.mobile] = new_user.pk
+            created += len(new_users)
+            for customer in customers:
+                customer.user_id = users[customer.mobile_key]
+            Customer.objects.bulk_update(customers, ['user'])
+        if progress:
+            progress(min(start + batch_size, len(customer_ids)) / len(customer_ids))
+    return {'created': created, 'linked': linked, 'skipped': skipped}
@@ -0,0 +1,129 @@
+# crm/customer_search.py
+
+"""
+Customer lookup for agents. On SQLite an FTS5 table with the trigram
+tokenizer (crmapp_customer_search, rowid = customer id) indexes name, mobile
+number and notes, so any substring of 3+ characters is an index lookup. The
+receivers in models.py keep it in sync; bulk writes call index_customers()
+themselves. Other databases fall back to icontains.
+
+Phone fragments are matched on the digits after their trunk or country
+prefix (search_terms()), so "0551234" finds "+966551234567".
+
+Matches come back newest customer first: ranking by relevance has to score
+every match, which is slow for common fragments like "055" or a popular name.
+"""
+
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery
+
+from accounts.phones import subscriber_digits
+
+TABLE = 'crmapp_customer_search'
+MIN_TERM_LENGTH = 3
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def search_terms(query):
+    """
+    The terms of `query`. Phone fragments lose their trunk or country prefix:
+    new numbers are stored as +966..., older ones as typed, and agents type
+    "055..."; the digits after the prefix are in all of them.
+    """
+    terms = []
+    for term in query.split():
+        digits = subscriber_digits(term)
+        terms.append(digits if len(digits) >= MIN_TERM_LENGTH else term)
+    return terms
+
+
+def match_expression(query):
+    """An FTS5 query requiring every term of 3+ characters, or '' if there is none."""
+    terms = [term for term in search_terms(query) if len(term) >= MIN_TERM_LENGTH]
+    return ' AND '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def index_customers(customers):
+    """(Re)index `customers` (Customer instances)."""
+    if not fts_enabled():
+        return
+    rows = [(c.pk, c.name or '', c.mobile_number or '', c.notes or '') for c in customers]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, name, mobile_number, notes) VALUES (%s, %s, %s, %s)', rows,
+        )
+
+
+def unindex_customers(customer_ids):
+    if not fts_enabled() or not customer_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(pk,) for pk in customer_ids])
+
+
+def rebuild_index():
+    """Re-fill the index from crmapp_customer in one statement. Returns the number of rows indexed."""
+    if not fts_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, name, mobile_number, notes) "
+            f"SELECT id, name, mobile_number, COALESCE(notes, '') FROM crmapp_customer"
+        )
+        return cursor.rowcount
+
+
+def matching_ids(query, limit=DEFAULT_LIMIT):
+    """Ids of customers matching every term of `query`, newest first."""
+    from .models import Customer
+
+    if not fts_enabled():
+        customers = Customer.objects.all()
+        for term in search_terms(query):
+            customers = customers.filter(
+                Q(name__icontains=term) | Q(mobile_number__icontains=term) | Q(notes__icontains=term)
+            )
+        return list(customers.order_by('-pk').values_list('pk', flat=True)[:limit])
+    expression = match_expression(query)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s', [expression, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_customers(query, limit=DEFAULT_LIMIT):
+    """
+    [(customer, latest appointment or None)] for `query`, newest customer
+    first. Three queries: the index, the customers and their latest bookings.
+    """
+    from .models import Appointment, Customer
+
+    ids = matching_ids(query, limit)
+    if not ids:
+        return []
+    latest = Appointment.objects.filter(customer=OuterRef('pk')).order_by('-date', '-start_time', '-pk')
+    customers = {
+        customer.pk: customer
+        for customer in Customer.objects.filter(pk__in=ids).select_related('area').annotate(
+            latest_appointment_id=Subquery(latest.values('pk')[:1]),
+        )
+    }
+    appointments = Appointment.objects.select_related('technician__user').in_bulk(
+        [customer.latest_appointment_id for customer in customers.values() if customer.latest_appointment_id]
+    )
+    return [
+        (customers[pk], appointments.get(customers[pk].latest_appointment_id))
+        for pk in ids if pk in customers
+    ]
@@ -0,0 +1,123 @@
+# crm/exports.py
+
+"""
+Streaming appointment exports. Rows are read with values() and iterator(),
+and services/materials are fetched per chunk, so memory stays flat however
+many appointments are exported.
+"""
+
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .appointment_queries import ORDERING
+
+EXPORT_CHUNK_SIZE = 2000
+
+# (column, values() lookup) in export order.
+EXPORT_FIELDS = (
+    ('id', 'id'),
+    ('date', 'date'),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('status', 'status'),
+    ('customer_name', 'customer__name'),
+    ('customer_mobile', 'customer__mobile_number'),
+    ('customer_area', 'customer__area__name'),
+    ('technician_id', 'technician__technician_id'),
+    ('technician_first_name', 'technician__user__first_name'),
+    ('technician_last_name', 'technician__user__last_name'),
+    ('notes', 'notes'),
+    ('created_at', 'created_at'),
+)
+EXPORT_COLUMNS = [column for column, _ in EXPORT_FIELDS] + ['services', 'materials']
+
+
+def _related_names(appointment_ids):
+    """({appointment_id: [service names]}, {appointment_id: [material codes]}) for one chunk."""
+    from .models import Appointment
+
+    services, materials = {}, {}
+    for appointment_id, name in Appointment.service.through.objects.filter(
+        appointment_id__in=appointment_ids,
+    ).order_by('service__name').values_list('appointment_id', 'service__name'):
+        services.setdefault(appointment_id, []).append(name)
+    for appointment_id, code in Appointment.materials.through.objects.filter(
+        appointment_id__in=appointment_ids,
+    ).order_by('material__code').values_list('appointment_id', 'material__code'):
+        materials.setdefault(appointment_id, []).append(code)
+    return services, materials
+
+
+def _with_related(chunk):
+    services, materials = _related_names([row['id'] for row in chunk])
+    for row in chunk:
+        row['services'] = services.get(row['id'], [])
+        row['materials'] = materials.get(row['id'], [])
+        yield row
+
+
+def iter_export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield one dict per appointment with EXPORT_COLUMNS as keys."""
+    rows = queryset.order_by(*ORDERING).values_list(*(lookup for _, lookup in EXPORT_FIELDS))
+    chunk = []
+    for values in rows.iterator(chunk_size=chunk_size):
+        chunk.append(dict(zip((column for column, _ in EXPORT_FIELDS), values)))
+        if len(chunk) == chunk_size:
+            yield from _with_related(chunk)
+            chunk = []
+    if chunk:
+        yield from _with_related(chunk)
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row = {**row, 'services': '; '.join(row['services']), 'materials': '; '.join(row['materials'])}
+        yield writer.writerow([row[column] for column in EXPORT_COLUMNS])
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def gzip_chunks(lines, min_chunk=64 * 1024):
+    """Gzip a stream of text lines, yielding compressed bytes every ~`min_chunk` input bytes."""
+    compressor = zlib.compressobj(wbits=31)
+    pending = 0
+    for line in lines:
+        data = line.encode()
+        pending += len(data)
+        out = compressor.compress(data)
+        if pending >= min_chunk:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv', 'csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'ndjson'),
+}
+
+
+def export_stream(queryset, file_format='csv', gzip=False):
+    """(iterable of str or bytes, content type, file extension) for `queryset`."""
+    render, content_type, extension = EXPORT_FORMATS[file_format]
+    lines = render(iter_export_rows(queryset))
+    if gzip:
+        return gzip_chunks(lines), 'application/gzip', extension + '.gz'
+    return lines, content_type, extension
@@ -2,7 +2,9 @@
 
 from django import forms
 from .models import Customer, Schedule, Slot, Technician, TechnicianSchedule, Material
+from .conflicts import find_schedule_conflicts
 from accounts.models import CustomUser, Area, Service
+from accounts.phones import clean_phone
 
 class CustomerForm(forms.ModelForm):
     create_account = forms.BooleanField(required=False, label="Create Customer Account")
@@ -14,6 +16,9 @@ class CustomerForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'rows': 3}),
         }
 
+    def clean_mobile_number(self):
+        return clean_phone(self.cleaned_data['mobile_number'])
+
 
 class TechnicianForm(forms.ModelForm):
     name = forms.CharField(max_length=100)
@@ -35,6 +40,9 @@ class TechnicianForm(forms.ModelForm):
             self.fields['mobile'].initial = self.instance.mobile_number
             self.fields['email'].initial = self.instance.user.email
 
+    def clean_mobile(self):
+        return clean_phone(self.cleaned_data['mobile'])
+
     def save(self, commit=True):
         technician = super().save(commit=False)
         
@@ -84,10 +92,54 @@ class TechnicianScheduleForm(forms.ModelForm):
             'end_date': forms.DateInput(attrs={'type': 'date'}),
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        candidate = TechnicianSchedule(
+            pk=self.instance.pk,
+            technician=cleaned_data.get('technician'),
+            schedule=cleaned_data.get('schedule'),
+            start_date=cleaned_data.get('start_date'),
+            end_date=cleaned_data.get('end_date'),
+        )
+        conflicts = find_schedule_conflicts([candidate]).get(0)
+        if conflicts:
+            raise forms.ValidationError(f"This schedule overlaps: {', '.join(conflicts)}")
+        return cleaned_data
+
+
+class TechnicianScheduleInlineFormSet(forms.BaseInlineFormSet):
+    """Checks every schedule row of a technician against each other and the stored ones at once."""
+
+    def clean(self):
+        super().clean()
+        rows = []
+        deleted = []
+        for form in self.forms:
+            if not hasattr(form, 'cleaned_data') or not form.cleaned_data:
+                continue
+            if form.cleaned_data.get('DELETE'):
+                if form.instance.pk:
+                    deleted.append(form.instance.pk)
+                continue
+            rows.append(form)
+        candidates = [
+            TechnicianSchedule(
+                pk=form.instance.pk,
+                technician_id=self.instance.pk,
+                schedule=form.cleaned_data.get('schedule'),
+                start_date=form.cleaned_data.get('start_date'),
+                end_date=form.cleaned_data.get('end_date'),
+            )
+            for form in rows
+        ]
+        for index, conflicts in find_schedule_conflicts(candidates, ignore=deleted).items():
+            rows[index].add_error(None, f"This schedule overlaps: {', '.join(conflicts)}")
+
 from django import forms
 from .models import Appointment, Technician, Slot
 from accounts.models import City, Area
 from django.db.models import Q 
+from .availability import get_engine
 
 class AppointmentForm(forms.ModelForm):
     city = forms.ModelChoiceField(queryset=City.objects.all(), empty_label="Select a city")
@@ -107,10 +159,16 @@ class AppointmentForm(forms.ModelForm):
 
     class Meta:
         model = Appointment
-        fields = ['city', 'area', 'technician', 'name', 'mobile_number', 'notes', 'date', 'slot', 'service', 'materials']
+        fields = ['city', 'area', 'technician', 'name', 'mobile_number', 'notes', 'slot', 'service', 'materials']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.engine = get_engine()
+        self.slot_token = None
+        if not self.engine.materializes_slots:
+            # Rule-computed slots have no row yet; the form carries a token and
+            # save() materializes it.
+            self.fields['slot'] = forms.CharField(required=False, widget=forms.Select)
 
         # Get the current slot ID if editing an existing appointment
         current_slot_id = None
@@ -143,6 +201,9 @@ class AppointmentForm(forms.ModelForm):
             except (ValueError, TypeError):
                 pass
 
+        if not self.engine.materializes_slots:
+            return
+
         if 'technician' in self.data and 'date' in self.data:
             try:
                 technician_id = int(self.data.get('technician'))
@@ -168,45 +229,55 @@ class AppointmentForm(forms.ModelForm):
             except (ValueError, TypeError):
                 pass
 
+    def clean_mobile_number(self):
+        return clean_phone(self.cleaned_data['mobile_number'])
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        # Both were fetched by their choice fields already, and the slot being
+        # free is enforced by the INSERT (crmapp.booking), so full_clean()
+        # doesn't need to query them again.
+        exclude.update({'technician', 'slot'})
+        return exclude
+
+    def clean_slot(self):
+        slot = self.cleaned_data.get('slot')
+        if self.engine.materializes_slots:
+            return slot
+        self.slot_token = slot or None
+        return None
+
     def clean(self):
         cleaned_data = super().clean()
         technician = cleaned_data.get('technician')
         date = cleaned_data.get('date')
         slot = cleaned_data.get('slot')
 
-        print(f"Debug - Clean method: technician={technician}, date={date}, slot={slot}")
-        print(f"Debug - Current instance: {self.instance.pk}")
+        if not self.engine.materializes_slots:
+            if not all([technician, date, self.slot_token]):
+                raise forms.ValidationError("Please select a technician, date, and time slot.")
+            self.engine.find_slot(technician, date, self.slot_token, self.instance.pk)
+            return cleaned_data
 
         if not all([technician, date, slot]):
             raise forms.ValidationError("Please select a technician, date, and time slot.")
 
-        if slot and slot.technician != technician:
+        if slot.technician_id != technician.pk:
             raise forms.ValidationError("The selected slot does not belong to the chosen technician.")
 
-        if slot and slot.date != date:
+        if slot.date != date:
             raise forms.ValidationError("The selected slot is not for the chosen date.")
 
-        # Check if the slot is booked
-        if slot:
-            print(f"Debug - Slot: {slot}")
-            print(f"Debug - Slot is_booked: {slot.is_booked()}")
-            slot_appointment = getattr(slot, 'appointment', None)
-            print(f"Debug - Slot appointment: {slot_appointment}")
-            
-            # If we're editing an existing appointment
-            if self.instance.pk:
-                print(f"Debug - Editing existing appointment: {self.instance.pk}")
-                # If the slot is booked by another appointment
-                if slot.is_booked() and slot_appointment and slot_appointment.pk != self.instance.pk:
-                    raise forms.ValidationError("This slot is already booked by another appointment.")
-            else:
-                if slot.is_booked():
-                    raise forms.ValidationError("This slot is already booked.")
-
+        # Whether the slot is still free is decided when the booking is
+        # written; see crmapp.booking.
         return cleaned_data
 
-
-
+    def save(self, commit=True):
+        if self.slot_token:
+            self.instance.slot = self.engine.resolve_slot(
+                self.cleaned_data['technician'], self.cleaned_data['date'], self.slot_token, self.instance.pk
+            )
+        return super().save(commit)
 
 
 class AddTeamMemberForm(forms.ModelForm):
@@ -222,4 +293,7 @@ class AddTeamMemberForm(forms.ModelForm):
         self.fields['user_type'].choices = [
             ('MANAGER', 'Manager'),
             ('TECHNICIAN', 'Technician'),
-        ]
\ No newline at end of file
+        ]
+
+    def clean_mobile(self):
+        return clean_phone(self.cleaned_data['mobile'])
\ No newline at end of file
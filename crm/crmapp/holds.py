@@ -0,0 +1,120 @@
+# crm/holds.py
+
+"""
+Slot holds: a user picking a slot in the booking form holds it for
+SLOT_HOLD_SECONDS. Availability shown to other users leaves held slots out,
+book_appointment() refuses them for other users, and booking consumes the
+user's own hold. Expired rows are simply ignored until reap_slot_holds runs.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .availability import overlaps
+
+DEFAULT_HOLD_SECONDS = 180
+SLOT_HELD = "This slot is being booked by another agent. Please pick another one."
+
+
+def hold_seconds():
+    return getattr(settings, 'SLOT_HOLD_SECONDS', DEFAULT_HOLD_SECONDS)
+
+
+def active_holds(technician_ids, date_from, date_to=None, exclude_user=None):
+    """{(technician_id, date): [(start_time, end_time)]} of unexpired holds, in one query."""
+    from .models import SlotHold
+
+    holds = SlotHold.objects.filter(
+        technician_id__in=technician_ids, date__gte=date_from, date__lte=date_to or date_from,
+        expires_at__gt=timezone.now(),
+    )
+    if exclude_user is not None:
+        holds = holds.exclude(user=exclude_user)
+    held = {}
+    for technician_id, date, start_time, end_time in holds.values_list('technician_id', 'date', 'start_time', 'end_time'):
+        held.setdefault((technician_id, date), []).append((start_time, end_time))
+    return held
+
+
+def without_held(slots, held):
+    """Drop the slots overlapping any of the `held` intervals."""
+    if not held:
+        return slots
+    return [slot for slot in slots if not overlaps(slot['start_time'], slot['end_time'], held)]
+
+
+def lock_technician(technician_id):
+    """
+    Serialize bookings and holds of one technician until the transaction
+    ends. A row lock where the database has them; SQLite has none, but its
+    writers are serialized by their first write, which both callers make
+    before checking.
+    """
+    from .models import Technician
+
+    list(Technician.objects.select_for_update().filter(pk=technician_id).values_list('pk', flat=True))
+
+
+def hold_slot(user, technician_id, date, start_time, end_time, appointment_id=None):
+    """
+    Hold an interval for `user`, or extend the user's existing hold on it.
+    `appointment_id` is the appointment being edited, whose own slot may be
+    held. Returns (hold, None) or (None, error message).
+    """
+    from .booking import SLOT_TAKEN
+    from .models import Slot, SlotHold
+
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=hold_seconds())
+    key = {'technician_id': technician_id, 'date': date, 'start_time': start_time, 'end_time': end_time}
+    try:
+        with transaction.atomic():
+            # An expired hold on the same interval would block the INSERT.
+            SlotHold.objects.filter(expires_at__lte=now, **key).delete()
+            # Checked under the lock book_appointment() takes, so a booking
+            # can't commit between these checks and the hold.
+            lock_technician(technician_id)
+            booked = Slot.objects.filter(
+                technician_id=technician_id, date=date, appointment__isnull=False,
+                start_time__lt=end_time, end_time__gt=start_time,
+            )
+            if appointment_id:
+                booked = booked.exclude(appointment__id=appointment_id)
+            error = SLOT_TAKEN if booked.exists() else (
+                SLOT_HELD if held_by_other(user, technician_id, date, start_time, end_time) else None
+            )
+            if error:
+                transaction.set_rollback(True)
+                return None, error
+            # A user holds one slot at a time; picking another releases the previous one.
+            SlotHold.objects.filter(user=user).exclude(**key).delete()
+            hold, created = SlotHold.objects.get_or_create(defaults={'user': user, 'expires_at': expires_at}, **key)
+    except IntegrityError:
+        return None, SLOT_HELD
+    if not created:
+        if hold.user_id != user.pk:
+            return None, SLOT_HELD
+        SlotHold.objects.filter(pk=hold.pk).update(expires_at=expires_at)
+        hold.expires_at = expires_at
+    return hold, None
+
+
+def release_holds(user, **filters):
+    from .models import SlotHold
+
+    return SlotHold.objects.filter(user=user, **filters).delete()[0]
+
+
+def held_by_other(user, technician_id, date, start_time, end_time):
+    held = active_holds([technician_id], date, exclude_user=user).get((technician_id, date), ())
+    return overlaps(start_time, end_time, held)
+
+
+def reap_expired_holds(before=None):
+    """Delete expired holds in one statement (expires_at is indexed). Returns the number deleted."""
+    from .models import SlotHold
+
+    return SlotHold.objects.filter(expires_at__lte=before or timezone.now()).delete()[0]
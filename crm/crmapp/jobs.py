@@ -0,0 +1,216 @@
+# crm/jobs.py
+
+"""
+A small database-backed job queue. Jobs are BackgroundJob rows; the
+`run_jobs` management command claims and runs them, so no broker is needed.
+
+A running job's heartbeat_at is refreshed as it reports progress. A job whose
+worker died stops beating; after JOB_STALE_SECONDS it is put back in the
+queue, so it no longer blocks the jobs that share its key.
+"""
+
+import logging
+import threading
+import time
+import traceback
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SYNC_TECHNICIAN_SLOTS = 'SYNC_TECHNICIAN_SLOTS'
+PROVISION_CUSTOMER_ACCOUNTS = 'PROVISION_CUSTOMER_ACCOUNTS'
+
+# Progress is only written back when it moves by at least this many percent,
+# or when the heartbeat is this many seconds old.
+PROGRESS_STEP = 5
+HEARTBEAT_SECONDS = 30
+DEFAULT_STALE_SECONDS = 600
+
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload=None, key='', created_by=None):
+    """Queue a job, or return the pending job that already has the same key."""
+    from .models import BackgroundJob
+
+    if not key:
+        return BackgroundJob.objects.create(kind=kind, key=key, payload=payload or {}, created_by=created_by)
+    while True:
+        pending = BackgroundJob.objects.filter(kind=kind, key=key, status='PENDING').first()
+        if pending:
+            return pending
+        try:
+            # The unique_pending_job_key constraint picks one winner between two enqueuers.
+            with transaction.atomic():
+                return BackgroundJob.objects.create(kind=kind, key=key, payload=payload or {}, created_by=created_by)
+        except IntegrityError:
+            continue
+
+
+def stale_seconds():
+    return getattr(settings, 'JOB_STALE_SECONDS', DEFAULT_STALE_SECONDS)
+
+
+def requeue_stale_jobs(now=None):
+    """
+    Put RUNNING jobs whose heartbeat is older than JOB_STALE_SECONDS back to
+    PENDING. One that another job with its key is already queued behind is
+    marked FAILED instead. Returns the number of jobs re-queued.
+    """
+    from .models import BackgroundJob
+
+    now = now or timezone.now()
+    requeued = 0
+    stale = BackgroundJob.objects.filter(status='RUNNING', heartbeat_at__lt=now - timedelta(seconds=stale_seconds()))
+    for job in stale.only('pk', 'kind', 'key', 'heartbeat_at'):
+        # Conditional on the heartbeat read, so a worker that beats meanwhile keeps its job.
+        current = BackgroundJob.objects.filter(pk=job.pk, status='RUNNING', heartbeat_at=job.heartbeat_at)
+        try:
+            with transaction.atomic():
+                updated = current.update(status='PENDING', started_at=None, heartbeat_at=None, progress=0)
+            requeued += updated
+        except IntegrityError:
+            updated = current.update(
+                status='FAILED', error="The worker stopped responding; a newer job for this key is queued.",
+                finished_at=now,
+            )
+        if updated:
+            logger.warning("Job %s stopped responding", job.pk)
+    return requeued
+
+
+def claim_next_job():
+    """Atomically move the oldest runnable job from PENDING to RUNNING and return it."""
+    from .models import BackgroundJob
+
+    requeue_stale_jobs()
+    running_keys = BackgroundJob.objects.filter(status='RUNNING').exclude(key='').values('key')
+    while True:
+        job = BackgroundJob.objects.filter(status='PENDING').exclude(key__in=running_keys).order_by('created_at').first()
+        if job is None:
+            return None
+        # Conditional update: only one worker can win the PENDING -> RUNNING transition.
+        now = timezone.now()
+        claimed = BackgroundJob.objects.filter(pk=job.pk, status='PENDING').update(
+            status='RUNNING', started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            job.status, job.started_at, job.heartbeat_at = 'RUNNING', now, now
+            return job
+
+
+def run_job(job):
+    from .models import BackgroundJob
+
+    reported = [0, time.monotonic()]
+
+    def progress(fraction):
+        percent = int(fraction * 100)
+        if percent - reported[0] >= PROGRESS_STEP or time.monotonic() - reported[1] >= HEARTBEAT_SECONDS:
+            reported[:] = [max(percent, reported[0]), time.monotonic()]
+            BackgroundJob.objects.filter(pk=job.pk).update(progress=reported[0], heartbeat_at=timezone.now())
+
+    try:
+        result = JOB_HANDLERS[job.kind](job, progress)
+    except Exception:
+        logger.exception("Job %s failed", job.pk)
+        BackgroundJob.objects.filter(pk=job.pk).update(
+            status='FAILED', error=traceback.format_exc(), finished_at=timezone.now()
+        )
+        return False
+    BackgroundJob.objects.filter(pk=job.pk).update(
+        status='DONE', progress=100, result=result, finished_at=timezone.now()
+    )
+    return True
+
+
+def work(stop_event, once=False, poll_interval=1.0):
+    """Worker loop: run jobs until `stop_event` is set, or until the queue is empty if `once`."""
+    processed = 0
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if once:
+                    break
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job)
+            processed += 1
+    finally:
+        connection.close()
+    return processed
+
+
+def run_workers(workers=4, once=False, poll_interval=1.0):
+    """Run `workers` worker threads until interrupted. Returns the number of jobs processed."""
+    stop_event = threading.Event()
+    counts = []
+    threads = [
+        threading.Thread(target=lambda: counts.append(work(stop_event, once, poll_interval)), daemon=True)
+        for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    return sum(counts)
+
+
+def enqueue_slot_sync(technician_schedule):
+    previous = getattr(technician_schedule, '_loaded_slot_scope', None)
+    if previous:
+        previous = [previous[0], previous[1], previous[2].isoformat(), previous[3].isoformat()]
+    return enqueue(
+        SYNC_TECHNICIAN_SLOTS,
+        payload={'technician_schedule': technician_schedule.pk, 'previous_scope': previous},
+        key=f'technician_schedule:{technician_schedule.pk}',
+    )
+
+
+@job_handler(SYNC_TECHNICIAN_SLOTS)
+def sync_technician_slots(job, progress):
+    from .models import TechnicianSchedule
+
+    try:
+        technician_schedule = TechnicianSchedule.objects.select_related('schedule', 'technician').get(
+            pk=job.payload['technician_schedule']
+        )
+    except TechnicianSchedule.DoesNotExist:
+        return {'skipped': 'Technician schedule no longer exists.'}
+
+    previous = job.payload.get('previous_scope')
+    if previous:
+        technician_schedule._loaded_slot_scope = (
+            previous[0], previous[1], date.fromisoformat(previous[2]), date.fromisoformat(previous[3])
+        )
+    result = technician_schedule.sync_slots(progress=progress)
+    return {'created': result.created, 'deleted': result.deleted, 'conflicts': result.conflicts}
+
+
+def enqueue_account_provisioning(customer_ids, created_by=None):
+    return enqueue(PROVISION_CUSTOMER_ACCOUNTS, payload={'customers': list(customer_ids)}, created_by=created_by)
+
+
+@job_handler(PROVISION_CUSTOMER_ACCOUNTS)
+def provision_customer_accounts(job, progress):
+    from .customer_ingest import provision_accounts
+
+    return provision_accounts(job.payload['customers'], progress=progress)
@@ -0,0 +1,127 @@
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import time as dt_time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crmapp.availability import BITMAP, ENGINES, MATERIALIZED
+from crmapp.bitmaps import rebuild_day_masks
+from crmapp.models import (
+    Appointment, Customer, Schedule, Slot, Technician, TechnicianDayAvailability, TechnicianSchedule,
+)
+from crmapp.slots import build_slots, bulk_create_slots
+
+CustomUser = get_user_model()
+
+
+def table_bytes(model):
+    """Bytes used by a model's table and its indexes, or None without SQLite's dbstat."""
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = %s)", [model._meta.db_table]
+            )
+        except Exception:
+            return None
+        return cursor.fetchone()[0] or 0
+
+
+class Command(BaseCommand):
+    help = 'Compare availability lookup latency and Slot storage across availability engines (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--technicians', type=int, default=500)
+        parser.add_argument('--days', type=int, default=60)
+        parser.add_argument('--booked', type=float, default=0.1, help='Fraction of slots to book')
+        parser.add_argument('--lookups', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            technicians, dates = self.create_fleet(options)
+            samples = [(random.choice(technicians), random.choice(dates)) for _ in range(options['lookups'])]
+
+            self.report(MATERIALIZED, samples)
+            # Rule-computed engines only keep the booked Slot rows.
+            Slot.objects.filter(technician__in=technicians, appointment__isnull=True).delete()
+            for name in ENGINES:
+                if name == BITMAP:
+                    self.build_bitmaps(technicians, dates)
+                if name != MATERIALIZED:
+                    self.report(name, samples)
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back.'))
+
+    def report(self, name, samples):
+        engine = ENGINES[name]()
+        timings = []
+        tracemalloc.start()
+        for technician, date in samples:
+            started = time.perf_counter()
+            engine.free_slots(technician.pk, date)
+            timings.append((time.perf_counter() - started) * 1000)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        timings.sort()
+        size = table_bytes(Slot)
+        line = (
+            f"{name:>12}: avg {sum(timings) / len(timings):.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, peak {peak / 1024:.0f} KiB, "
+            f"{Slot.objects.count()} slot rows, {size if size is not None else 'n/a'} bytes"
+        )
+        if name == BITMAP:
+            size = table_bytes(TechnicianDayAvailability)
+            line += (f" + {TechnicianDayAvailability.objects.count()} bitmap rows, "
+                     f"{size if size is not None else 'n/a'} bytes")
+        self.stdout.write(line)
+
+    def build_bitmaps(self, technicians, dates):
+        started = time.perf_counter()
+        for technician in technicians:
+            rebuild_day_masks(technician.pk, dates[0], dates[-1])
+        self.stdout.write(f"Built {len(technicians) * len(dates)} bitmap rows in {time.perf_counter() - started:.2f}s")
+
+    def create_fleet(self, options):
+        tag = uuid.uuid4().hex[:8]
+        users = CustomUser.objects.bulk_create([
+            CustomUser(mobile=f'+2{tag}{i:06d}', first_name='Benchmark', last_name=str(i))
+            for i in range(options['technicians'])
+        ])
+        technicians = Technician.objects.bulk_create([
+            Technician(user=user, technician_id=f'B{tag}{i:06d}', working_shift='MORNING')
+            for i, user in enumerate(users)
+        ])
+        self.schedule = Schedule.objects.create(
+            name=f'Benchmark {tag}', slot_duration=30, start_time=dt_time(8, 0), end_time=dt_time(16, 0),
+            monday=True, tuesday=True, wednesday=True, thursday=True, friday=True, saturday=True, sunday=True,
+        )
+        today = timezone.now().date()
+        dates = [today + timedelta(days=i) for i in range(options['days'])]
+        TechnicianSchedule.objects.bulk_create([
+            TechnicianSchedule(technician=technician, schedule=self.schedule, start_date=today, end_date=dates[-1])
+            for technician in technicians
+        ])
+        for technician in technicians:
+            bulk_create_slots(build_slots(self.schedule, technician, dates[0], dates[-1]))
+
+        customer = Customer.objects.create(name='Benchmark', mobile_number=f'+3{tag}')
+        slots = list(Slot.objects.filter(technician__in=technicians).values_list(
+            'id', 'technician_id', 'date', 'start_time', 'end_time',
+        ))
+        booked = random.sample(slots, int(len(slots) * options['booked']))
+        Appointment.objects.bulk_create(
+            # bulk_create() skips save(), so the slot columns are set here.
+            [Appointment(customer=customer, slot_id=slot_id, technician_id=technician_id,
+                         date=date, start_time=start_time, end_time=end_time)
+             for slot_id, technician_id, date, start_time, end_time in booked],
+            batch_size=500,
+        )
+        return technicians, dates
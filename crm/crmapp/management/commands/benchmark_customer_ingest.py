@@ -0,0 +1,95 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crmapp.customer_ingest import MAX_INGEST_ROWS, ingest_customers, provision_accounts
+from crmapp.models import Customer
+from crmapp.serializers import CustomerSerializer
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure customer ingestion throughput in records per second, one by one and in batches (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=5000, help='Records for the batch path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--single', type=int, default=200, help='Records for the one-by-one path')
+        parser.add_argument('--existing', type=float, default=0.2, help='Fraction of records updating a customer')
+        parser.add_argument('--accounts', type=float, default=0.01,
+                            help='Fraction of records asking for an account (each costs a password hash)')
+
+    def handle(self, *args, **options):
+        batch_size = min(options['batch_size'], MAX_INGEST_ROWS)
+        tag = uuid.uuid4().hex[:6]
+        with transaction.atomic():
+            user = CustomUser.objects.create(mobile=f'+1999{random.randrange(10 ** 8):08d}', first_name='Benchmark')
+            rows = self.make_rows(tag, options['records'] + options['single'], options['accounts'])
+            existing = rows[:int(len(rows) * options['existing'])]
+            Customer.objects.bulk_create(
+                [Customer(name='Old name', mobile_number=row['mobile_number'], mobile_key=row['mobile_number'])
+                 for row in existing], batch_size=500,
+            )
+            random.shuffle(rows)
+            single, batch = rows[:options['single']], rows[options['single']:]
+
+            started = time.perf_counter()
+            for row in single:
+                serializer = CustomerSerializer(data=row)
+                if serializer.is_valid():
+                    self.save_one(serializer, user)
+            self.rate('one by one', len(single), time.perf_counter() - started)
+
+            started = time.perf_counter()
+            jobs, statuses = [], {}
+            for start in range(0, len(batch), batch_size):
+                report, batch_jobs = ingest_customers(batch[start:start + batch_size], user=user)
+                for entry in report:
+                    statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+                jobs += batch_jobs
+            self.rate('batched', len(batch), time.perf_counter() - started, statuses)
+
+            # Run inline in one thread; run_jobs spreads these jobs over its workers.
+            started = time.perf_counter()
+            provisioned = 0
+            for job in jobs:
+                provisioned += provision_accounts(job.payload['customers'])['created']
+            self.rate('account job', provisioned, time.perf_counter() - started)
+
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back.'))
+
+    def make_rows(self, tag, count, accounts):
+        prefix = int(tag, 16) % 100
+        return [
+            {
+                'name': f'Benchmark {tag} {i}',
+                'mobile_number': f'+96659{prefix:02d}{i:06d}',
+                'notes': 'Imported by benchmark',
+                'create_account': random.random() < accounts,
+            }
+            for i in range(count)
+        ]
+
+    def save_one(self, serializer, user):
+        # What CustomerCreateAPI does per request, minus HTTP.
+        create_account = serializer.validated_data.pop('create_account', False)
+        customer = serializer.save(created_by=user, creation_method='API')
+        if create_account:
+            first_name, _, last_name = customer.name.partition(' ')
+            customer.user = CustomUser.objects.create_user(
+                mobile=customer.mobile_number, first_name=first_name, last_name=last_name,
+                password=CustomUser.objects.make_random_password(),
+            )
+            customer.save()
+
+    def rate(self, label, records, seconds, statuses=None):
+        line = f"{label:>12}: {records} records in {seconds:.2f}s, {records / seconds if seconds else 0:.0f} records/s"
+        if statuses:
+            line += ' (' + ', '.join(f'{count} {status}' for status, count in sorted(statuses.items())) + ')'
+        self.stdout.write(line)
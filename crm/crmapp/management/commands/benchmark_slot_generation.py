@@ -0,0 +1,55 @@
+import time
+import uuid
+from datetime import time as dt_time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crmapp.models import Schedule, Slot, Technician
+from crmapp.slots import build_slots, bulk_create_slots
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-row slot INSERT loop against the bulk slot generator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='Number of days to generate')
+        parser.add_argument('--duration', type=int, default=30, help='Slot duration in minutes')
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = CustomUser.objects.create(mobile=f'+1999{tag}', first_name='Benchmark', last_name=tag)
+        technician = Technician.objects.create(user=user, technician_id=f'BENCH-{tag}', working_shift='MORNING')
+        schedule = Schedule.objects.create(
+            name=f'Benchmark {tag}', slot_duration=options['duration'],
+            start_time=dt_time(8, 0), end_time=dt_time(20, 0),
+            monday=True, tuesday=True, wednesday=True, thursday=True,
+            friday=True, saturday=True, sunday=True,
+        )
+        start_date = timezone.now().date()
+        end_date = start_date + timedelta(days=options['days'] - 1)
+
+        try:
+            # Baseline: one Slot.objects.create() per slot, as generate_slots used to do.
+            started = time.perf_counter()
+            rows = 0
+            for slot in build_slots(schedule, technician, start_date, end_date):
+                Slot.objects.create(
+                    schedule=slot.schedule, technician=slot.technician, date=slot.date,
+                    start_time=slot.start_time, end_time=slot.end_time,
+                )
+                rows += 1
+            per_row_seconds = time.perf_counter() - started
+            Slot.objects.filter(technician=technician).delete()
+
+            bulk = bulk_create_slots(build_slots(schedule, technician, start_date, end_date))
+        finally:
+            schedule.delete()
+            user.delete()
+
+        self.stdout.write(f'per-row: {rows} slots in {per_row_seconds:.3f}s ({rows / per_row_seconds:,.0f} rows/s)')
+        self.stdout.write(f'bulk:    {bulk}')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {per_row_seconds / bulk.seconds:.1f}x'))
@@ -0,0 +1,80 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crmapp.customer_dedupe import (
+    DEFAULT_MAX_BLOCK, DEFAULT_THRESHOLD, MERGE_BATCH_SIZE, find_duplicates, merge_clusters,
+)
+
+REPORT_COLUMNS = ['cluster', 'customer_id', 'action', 'score', 'name', 'mobile_number', 'area_id', 'user_id',
+                  'appointments']
+
+
+class Command(BaseCommand):
+    help = 'Find near-duplicate customers (by phone and name) and merge them into one customer each'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be merged')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Minimum pair score (0-1) to treat two customers as the same')
+        parser.add_argument('--max-block', type=int, default=DEFAULT_MAX_BLOCK,
+                            help='Skip blocks with more customers than this')
+        parser.add_argument('--batch-size', type=int, default=MERGE_BATCH_SIZE, help='Clusters merged per transaction')
+        parser.add_argument('--report', help="Write one CSV line per customer in a cluster to this file ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        if not 0 < options['threshold'] <= 1:
+            raise CommandError('--threshold must be between 0 and 1.')
+        started = time.perf_counter()
+        clusters, reviews, stats = find_duplicates(threshold=options['threshold'], max_block=options['max_block'])
+        self.stdout.write(
+            f"Scanned {stats['customers']} customers in {time.perf_counter() - started:.2f}s: "
+            f"{stats['blocks']} blocks ({stats['skipped_blocks']} too big to compare), {stats['pairs']} pairs scored, "
+            f"{stats['matches']} matches, {stats['clusters']} clusters, {stats['duplicates']} duplicates, "
+            f"{stats['reviews']} pairs left for review."
+        )
+        if options['report']:
+            self.write_report(clusters, reviews, options['report'])
+
+        appointments = sum(row['appointments'] for cluster in clusters for row in cluster['rows']
+                           if row['pk'] != cluster['keeper'])
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Dry run: would merge {stats['duplicates']} customers and repoint {appointments} appointments."
+            ))
+            return
+        started = time.perf_counter()
+        merged = merge_clusters(clusters, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {merged['customers']} customers and repointed {merged['appointments']} appointments "
+            f"in {time.perf_counter() - started:.2f}s."
+        ))
+
+    def write_report(self, clusters, reviews, path):
+        output = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            writer = csv.writer(output)
+            writer.writerow(REPORT_COLUMNS)
+            for cluster in clusters:
+                best = {}
+                for a, b, score in cluster['pairs']:
+                    best[a] = max(best.get(a, 0), score)
+                    best[b] = max(best.get(b, 0), score)
+                for row in cluster['rows']:
+                    self.write_row(writer, cluster['keeper'], row,
+                                   'keep' if row['pk'] == cluster['keeper'] else 'merge', best.get(row['pk'], ''))
+            # Review pairs are never merged; check them by hand.
+            for review in reviews:
+                for row in review['rows']:
+                    self.write_row(writer, review['rows'][0]['pk'], row, 'review', review['score'])
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def write_row(self, writer, cluster, row, action, score):
+        writer.writerow([
+            cluster, row['pk'], action, score, row['display_name'], row['mobile_number'], row['area_id'] or '',
+            row['user_id'] or '', row['appointments'],
+        ])
@@ -0,0 +1,48 @@
+import sys
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from crmapp.appointment_queries import filter_appointments
+from crmapp.exports import EXPORT_FORMATS, export_stream
+from crmapp.models import Appointment
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Stream appointments with customer, technician, slot, services and materials to CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--output', help='File to write; defaults to stdout')
+        parser.add_argument('--from', dest='date_from', type=parse_date, help='First appointment date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=parse_date, help='Last appointment date (YYYY-MM-DD)')
+        parser.add_argument('--technician', type=int, help='Technician user id')
+        parser.add_argument('--area', type=int, help='Customer area id')
+        parser.add_argument('--status', choices=[value for value, _ in Appointment.STATUS_CHOICES])
+        parser.add_argument('--service', type=int, help='Service id')
+
+    def handle(self, *args, **options):
+        appointments = filter_appointments(
+            Appointment.objects.all(), options['date_from'], options['date_to'],
+            technician=options['technician'], area=options['area'], status=options['status'],
+            service=options['service'],
+        )
+        stream, _, _ = export_stream(appointments, options['format'], gzip=options['gzip'])
+
+        if options['output']:
+            mode = 'wb' if options['gzip'] else 'w'
+            with open(options['output'], mode, **({} if options['gzip'] else {'encoding': 'utf-8', 'newline': ''})) as out:
+                for chunk in stream:
+                    out.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f"Exported appointments to {options['output']}"))
+        elif options['gzip']:
+            for chunk in stream:
+                sys.stdout.buffer.write(chunk)
+        else:
+            for chunk in stream:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crmapp.slots import booking_horizon_end, extend_slot_horizon, prune_past_slots
+
+
+class Command(BaseCommand):
+    help = 'Extend every active technician schedule up to the booking horizon and prune past unbooked slots (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=0, help='Keep unbooked slots this many days into the past')
+        parser.add_argument('--no-prune', action='store_true', help='Do not delete past unbooked slots')
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        result = extend_slot_horizon(today)
+        self.stdout.write(f'Extended slots to {booking_horizon_end(today)}: {result}')
+
+        if not options['no_prune']:
+            deleted = prune_past_slots(today - timedelta(days=options['keep_days']))
+            self.stdout.write(f'Pruned {deleted} past unbooked slots')
+
+        self.stdout.write(self.style.SUCCESS('Slot horizon is up to date.'))
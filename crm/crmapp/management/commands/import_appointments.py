@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from crmapp.bulk_booking import MAX_BULK_ROWS, import_appointments, parse_csv, parse_json, summarize
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Book appointments in bulk from a CSV or JSON file and print a per-row report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON file; see crmapp/bulk_booking.py for the columns')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Defaults to the file extension')
+        parser.add_argument('--user', help='Mobile number of the user recorded as creator of new customers')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the rows without booking them')
+        parser.add_argument('--report', help='Write the full per-row report to this JSON file')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist.')
+        file_format = options['format'] or ('csv' if path.suffix.lower() == '.csv' else 'json')
+        text = path.read_text(encoding='utf-8-sig')
+        rows = parse_csv(text) if file_format == 'csv' else parse_json(text)
+
+        user = None
+        if options['user']:
+            try:
+                user = CustomUser.objects.get_by_natural_key(options['user'])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"No user with mobile {options['user']}.")
+
+        report = []
+        for start in range(0, len(rows), MAX_BULK_ROWS):
+            for entry in import_appointments(rows[start:start + MAX_BULK_ROWS], user=user, dry_run=options['dry_run']):
+                entry['row'] += start
+                report.append(entry)
+
+        for entry in report:
+            if entry['status'] == 'error':
+                self.stdout.write(self.style.WARNING(f"Row {entry['row'] + 1}: {entry['error']}"))
+        if options['report']:
+            Path(options['report']).write_text(json.dumps(report, indent=2))
+        summary = ', '.join(f'{count} {status}' for status, count in summarize(report).items()) or 'no rows'
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(report)} rows: {summary}.'))
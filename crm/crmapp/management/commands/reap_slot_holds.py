@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from crmapp.holds import reap_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Delete expired slot holds (they are already ignored; this only reclaims the rows)'
+
+    def handle(self, *args, **options):
+        deleted = reap_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired slot holds.'))
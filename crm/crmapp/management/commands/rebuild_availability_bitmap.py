@@ -0,0 +1,52 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crmapp.bitmaps import alignment_error, rebuild_day_masks
+from crmapp.models import Schedule, Technician, TechnicianDayAvailability
+from crmapp.slots import booking_horizon_end
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-technician-day availability bitmaps, e.g. after switching AVAILABILITY_ENGINE to bitmap'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--technician', type=int, action='append', help='Only this technician (user id)')
+        parser.add_argument('--from', dest='date_from', type=parse_date, help='First date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=parse_date, help='Last date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--no-prune', action='store_true', help='Keep bitmap rows for past days')
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        date_from = options['date_from'] or today
+        date_to = options['date_to'] or booking_horizon_end(today)
+        errors = {
+            schedule.name: alignment_error(schedule.start_time, schedule.get_duration())
+            for schedule in Schedule.objects.order_by('pk')
+        }
+        unaligned = [name for name, error in errors.items() if error]
+        if unaligned:
+            raise CommandError(f"{errors[unaligned[0]]} Fix these schedules first: {', '.join(unaligned)}.")
+
+        technicians = Technician.objects.order_by('pk')
+        if options['technician']:
+            technicians = technicians.filter(pk__in=options['technician'])
+
+        started = time.perf_counter()
+        rows = 0
+        for technician_id in technicians.values_list('pk', flat=True):
+            rows += len(rebuild_day_masks(technician_id, date_from, date_to))
+        seconds = time.perf_counter() - started
+        self.stdout.write(f'Rebuilt {rows} technician days from {date_from} to {date_to} in {seconds:.2f}s')
+
+        if not options['no_prune']:
+            deleted, _ = TechnicianDayAvailability.objects.filter(date__lt=today).delete()
+            self.stdout.write(f'Pruned {deleted} past bitmap rows')
+
+        self.stdout.write(self.style.SUCCESS('Availability bitmaps are up to date.'))
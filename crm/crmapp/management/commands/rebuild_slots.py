@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from crmapp.availability import get_engine
+from crmapp.models import TechnicianSchedule
+from crmapp.slots import rebuild_technician_schedules
+
+
+def init_worker():
+    # Forked workers must not reuse the parent's database connection.
+    django.setup()
+    connections.close_all()
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild technician slots in parallel, e.g. after a shared Schedule template changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', type=int, action='append', help='Only technicians using this Schedule id')
+        parser.add_argument('--technician', type=int, action='append', help='Only this technician (user id)')
+        parser.add_argument('--from', dest='date_from', type=parse_date, help='First date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=parse_date, help='Last date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=25, help='Technician schedules per task')
+
+    def handle(self, *args, **options):
+        if not get_engine().materializes_slots:
+            raise CommandError('The configured availability engine does not store slots; nothing to rebuild.')
+
+        schedules = TechnicianSchedule.objects.order_by('technician_id', 'pk')
+        if options['schedule']:
+            schedules = schedules.filter(schedule_id__in=options['schedule'])
+        if options['technician']:
+            schedules = schedules.filter(technician_id__in=options['technician'])
+        ids = list(schedules.values_list('pk', flat=True))
+        chunk_size = options['chunk_size']
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+        task_args = (options['date_from'], options['date_to'], options['dry_run'])
+
+        totals = {'schedules': 0, 'created': 0, 'deleted': 0, 'conflicts': 0}
+        started = time.perf_counter()
+        if options['workers'] <= 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                self.add_totals(totals, rebuild_technician_schedules(chunk, *task_args))
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=init_worker,
+            ) as pool:
+                futures = [pool.submit(rebuild_technician_schedules, chunk, *task_args) for chunk in chunks]
+                for future in as_completed(futures):
+                    self.add_totals(totals, future.result())
+        seconds = time.perf_counter() - started
+
+        rows = totals['created'] + totals['deleted']
+        verb = 'Would write' if options['dry_run'] else 'Wrote'
+        self.stdout.write(
+            f"{verb} {rows} slot rows ({totals['created']} created, {totals['deleted']} deleted) for "
+            f"{totals['schedules']} technician schedules in {seconds:.2f}s: "
+            f"{rows / seconds if seconds else 0:,.0f} rows/s, "
+            f"{totals['schedules'] / seconds if seconds else 0:,.1f} schedules/s"
+        )
+        if totals['conflicts']:
+            self.stdout.write(self.style.WARNING(f"{totals['conflicts']} booked slots no longer match their schedule and were kept."))
+        self.stdout.write(self.style.SUCCESS('Slot rebuild finished.'))
+
+    def add_totals(self, totals, result):
+        for key, value in result.items():
+            totals[key] += value
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from crmapp.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (slot generation and regeneration) from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of concurrent worker threads')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        processed = run_workers(options['workers'], options['once'], options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} jobs.'))
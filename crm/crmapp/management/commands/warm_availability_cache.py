@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.caching import is_local_cache
+from crmapp.availability_cache import cache_stats, cached_free_slots
+from crmapp.models import Technician
+
+
+class Command(BaseCommand):
+    help = ('Pre-fill the availability cache for the next N days (run after a deploy or cache flush). '
+            'Needs a shared cache backend such as Redis or Memcached')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Days ahead of today to warm, including today')
+        parser.add_argument('--technician', type=int, action='append', help='Only this technician (user id)')
+
+    def handle(self, *args, **options):
+        if is_local_cache():
+            # The entries would live in this process only and go away with it.
+            raise CommandError("The default cache is a per-process LocMemCache; warming it has no effect on the "
+                               "web workers. Configure a shared backend (Redis, Memcached) in CACHES first.")
+        today = timezone.now().date()
+        dates = [today + timedelta(days=i) for i in range(options['days'])]
+        technicians = Technician.objects.order_by('pk')
+        if options['technician']:
+            technicians = technicians.filter(pk__in=options['technician'])
+
+        started = time.perf_counter()
+        entries = 0
+        for technician_id in technicians.values_list('pk', flat=True):
+            for date in dates:
+                cached_free_slots(technician_id, date)
+                entries += 1
+        seconds = time.perf_counter() - started
+
+        stats = cache_stats()
+        self.stdout.write(
+            f"Warmed {entries} technician days in {seconds:.2f}s. "
+            f"Cache counters: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)"
+        )
+        self.stdout.write(self.style.SUCCESS('Availability cache is warm.'))
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0009_alter_appointment_materials_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='slot',
+            unique_together={('schedule', 'technician', 'date', 'start_time', 'end_time')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0010_slot_unique_per_technician'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='technicianschedule',
+            name='materialized_until',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
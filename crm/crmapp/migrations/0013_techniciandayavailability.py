@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0012_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechnicianDayAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('free_mask', models.BigIntegerField(default=0)),
+                ('technician', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_availability', to='crmapp.technician')),
+            ],
+            options={
+                'unique_together': {('technician', 'date')},
+            },
+        ),
+    ]
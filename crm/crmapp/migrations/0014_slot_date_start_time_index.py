@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0013_techniciandayavailability'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='slot',
+            index=models.Index(fields=['date', 'start_time'], name='crmapp_slot_date_816156_idx'),
+        ),
+    ]
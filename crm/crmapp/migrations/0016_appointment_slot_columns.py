@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def copy_slot_columns(apps, schema_editor):
+    """Fill date, times and technician from each appointment's slot, BATCH_SIZE rows at a time."""
+    Appointment = apps.get_model('crmapp', 'Appointment')
+    last_id = 0
+    while True:
+        batch = list(
+            Appointment.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', 'slot__technician_id', 'slot__date', 'slot__start_time', 'slot__end_time')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        appointments = []
+        for pk, technician_id, date, start_time, end_time in batch:
+            appointment = Appointment(pk=pk, date=date, start_time=start_time, end_time=end_time)
+            appointment.technician_id = technician_id
+            appointments.append(appointment)
+        with_technician = [a for a in appointments if a.technician_id]
+        without_technician = [a for a in appointments if not a.technician_id]
+        Appointment.objects.bulk_update(with_technician, ['technician', 'date', 'start_time', 'end_time'])
+        Appointment.objects.bulk_update(without_technician, ['date', 'start_time', 'end_time'])
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0015_slothold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='date',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='start_time',
+            field=models.TimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='end_time',
+            field=models.TimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(copy_slot_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0016_appointment_slot_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='date',
+            field=models.DateField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='start_time',
+            field=models.TimeField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='end_time',
+            field=models.TimeField(editable=False),
+        ),
+        migrations.AlterModelOptions(
+            name='appointment',
+            options={'ordering': ['date', 'start_time']},
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['date', 'start_time', 'id'], name='appointment_date_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['technician', 'date', 'start_time'], name='appointment_tech_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'date'], name='appointment_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def build_rollups(apps, schema_editor):
+    """Same aggregation as crmapp.rollups.rebuild_rollups(), over the historical models."""
+    Appointment = apps.get_model('crmapp', 'Appointment')
+    DailyAppointmentRollup = apps.get_model('crmapp', 'DailyAppointmentRollup')
+    key_fields = ('date', 'technician_id', 'customer__area_id', 'status')
+    totals = {}
+    for row in Appointment.objects.order_by().values(*key_fields).annotate(n=Count('id')):
+        totals[tuple(row[field] for field in key_fields)] = [row['n'], 0]
+    revenue = Appointment.service.through.objects.values(
+        *(f'appointment__{field}' for field in key_fields)
+    ).annotate(revenue=Sum('service__price'))
+    for row in revenue:
+        key = tuple(row[f'appointment__{field}'] for field in key_fields)
+        totals.setdefault(key, [0, 0])[1] += row['revenue'] or 0
+    DailyAppointmentRollup.objects.bulk_create([
+        DailyAppointmentRollup(date=date, technician_id=technician_id, area_id=area_id, status=status,
+                               count=count, revenue=revenue)
+        for (date, technician_id, area_id, status), (count, revenue) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_delete_appointment'),
+        ('crmapp', '0017_appointment_slot_columns_not_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppointmentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('SCHEDULED', 'Scheduled'), ('COMPLETED', 'Completed'), ('CANCELLED', 'Cancelled')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('area', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.area')),
+                ('technician', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='crmapp.technician')),
+            ],
+            options={
+                'unique_together': {('date', 'technician', 'area', 'status')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 is SQLite-only; other databases use crmapp.customer_search's icontains fallback.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE crmapp_customer_search USING fts5(name, mobile_number, notes, tokenize='trigram')"
+    )
+    schema_editor.execute(
+        "INSERT INTO crmapp_customer_search (rowid, name, mobile_number, notes) "
+        "SELECT id, name, mobile_number, COALESCE(notes, '') FROM crmapp_customer"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS crmapp_customer_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_delete_appointment'),
+        ('crmapp', '0018_dailyappointmentrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['customer', 'date', 'start_time'], name='appointment_customer_date_idx'),
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
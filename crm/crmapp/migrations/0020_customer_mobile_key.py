@@ -0,0 +1,87 @@
+from importlib import import_module
+
+from django.db import migrations, models
+
+from accounts.phones import phone_key
+
+BATCH_SIZE = 1000
+
+
+def merge_customers(apps, schema_editor, duplicates):
+    """Fold each duplicate customer into its keeper: {duplicate_pk: keeper_pk}."""
+    Customer = apps.get_model('crmapp', 'Customer')
+    Appointment = apps.get_model('crmapp', 'Appointment')
+    by_keeper = {}
+    for duplicate, keeper in duplicates.items():
+        by_keeper.setdefault(keeper, []).append(duplicate)
+    rows = Customer.objects.in_bulk([*duplicates, *by_keeper])
+    for keeper_pk, duplicate_pks in by_keeper.items():
+        keeper = rows[keeper_pk]
+        Appointment.objects.filter(customer_id__in=duplicate_pks).update(customer_id=keeper_pk)
+        for duplicate in (rows[pk] for pk in duplicate_pks):
+            if duplicate.notes and duplicate.notes not in (keeper.notes or ''):
+                keeper.notes = f"{keeper.notes}\n{duplicate.notes}" if keeper.notes else duplicate.notes
+            keeper.area_id = keeper.area_id or duplicate.area_id
+            if not keeper.user_id and duplicate.user_id:
+                keeper.user_id, duplicate.user_id = duplicate.user_id, None
+                Customer.objects.filter(pk=duplicate.pk).update(user_id=None)
+        Customer.objects.filter(pk=keeper_pk).update(notes=keeper.notes, area_id=keeper.area_id, user_id=keeper.user_id)
+    Customer.objects.filter(pk__in=duplicates).delete()
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM crmapp_customer_search WHERE rowid = %s', [(pk,) for pk in duplicates])
+
+
+def rebuild_rollups(apps, schema_editor):
+    """Merged appointments now count under the keeper's area; recompute the rollups as 0018 built them."""
+    apps.get_model('crmapp', 'DailyAppointmentRollup').objects.all().delete()
+    import_module('crmapp.migrations.0018_dailyappointmentrollup').build_rollups(apps, schema_editor)
+
+
+def fill_mobile_keys(apps, schema_editor):
+    """
+    Set mobile_key BATCH_SIZE customers at a time, oldest first. A customer whose
+    number normalizes to a key already taken is merged into that older customer,
+    and the dashboard rollups are rebuilt afterwards.
+    """
+    Customer = apps.get_model('crmapp', 'Customer')
+    last_pk = 0
+    merged = False
+    while True:
+        batch = list(Customer.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'mobile_number')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+        keys = {pk: phone_key(mobile) for pk, mobile in batch}
+        keepers = dict(Customer.objects.filter(mobile_key__in={key for key in keys.values() if key}).values_list('mobile_key', 'pk'))
+        updates, duplicates = [], {}
+        for pk, key in keys.items():
+            if key is None:
+                continue
+            if key in keepers:
+                duplicates[pk] = keepers[key]
+            else:
+                keepers[key] = pk
+                updates.append(Customer(pk=pk, mobile_key=key))
+        Customer.objects.bulk_update(updates, ['mobile_key'])
+        if duplicates:
+            merge_customers(apps, schema_editor, duplicates)
+            merged = True
+    if merged:
+        rebuild_rollups(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0019_customer_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='mobile_key',
+            field=models.CharField(db_index=True, editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(fill_mobile_keys, migrations.RunPython.noop),
+    ]
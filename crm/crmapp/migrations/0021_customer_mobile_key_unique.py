@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0020_customer_mobile_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='mobile_key',
+            field=models.CharField(editable=False, max_length=16, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0021_customer_mobile_key_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('SYNC_TECHNICIAN_SLOTS', 'Generate or reconcile technician slots'), ('PROVISION_CUSTOMER_ACCOUNTS', 'Create accounts for ingested customers')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def prepare_jobs(apps, schema_editor):
+    """Start the heartbeat of running jobs at started_at and fail all but the oldest duplicate pending job."""
+    BackgroundJob = apps.get_model('crmapp', 'BackgroundJob')
+    BackgroundJob.objects.filter(status='RUNNING').update(heartbeat_at=models.F('started_at'))
+    kept = {}
+    for pk, kind, key in BackgroundJob.objects.filter(status='PENDING').exclude(key='').order_by(
+        'created_at', 'pk',
+    ).values_list('pk', 'kind', 'key'):
+        first = kept.setdefault((kind, key), pk)
+        if first != pk:
+            BackgroundJob.objects.filter(pk=pk).update(status='FAILED', error=f"Duplicate of pending job #{first}.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0022_backgroundjob_provision_accounts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(prepare_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='backgroundjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'PENDING'), models.Q(('key', ''), _negated=True)), fields=('kind', 'key'), name='unique_pending_job_key'),
+        ),
+    ]
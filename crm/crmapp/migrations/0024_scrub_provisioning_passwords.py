@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def scrub_passwords(apps, schema_editor):
+    """Account jobs no longer return passwords; drop the ones earlier jobs stored in their result."""
+    BackgroundJob = apps.get_model('crmapp', 'BackgroundJob')
+    for job in BackgroundJob.objects.filter(kind='PROVISION_CUSTOMER_ACCOUNTS').exclude(result=None).only('result'):
+        if isinstance(job.result, dict) and 'temporary_passwords' in job.result:
+            job.result.pop('temporary_passwords')
+            job.save(update_fields=['result'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crmapp', '0023_backgroundjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(scrub_passwords, migrations.RunPython.noop),
+    ]
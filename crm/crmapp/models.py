@@ -4,10 +4,21 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from accounts.models import Area, CustomUser, Service
+from accounts.phones import normalize_phone, phone_key
 
 
 CustomUser = get_user_model()
 
+class CustomerManager(models.Manager):
+    def by_mobile(self, mobile):
+        """Customers whose number is `mobile` in any format; uses the unique mobile_key index."""
+        return self.filter(mobile_key=phone_key(mobile))
+
+    def get_or_create_by_mobile(self, mobile, defaults=None):
+        """get_or_create() keyed by the normalized number. Raises ValueError for an invalid number."""
+        key = normalize_phone(mobile)
+        return self.get_or_create(mobile_key=key, defaults={'mobile_number': mobile, **(defaults or {})})
+
 class Customer(models.Model):
     CREATION_METHODS = (
         ('AGENT', 'Added by Call Center Agent'),
@@ -18,6 +29,9 @@ class Customer(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=100)
     mobile_number = models.CharField(max_length=17, unique=True)
+    # E.164 form of mobile_number (accounts.phones.normalize_phone), set on save.
+    # Look customers up by this, not by the number as typed.
+    mobile_key = models.CharField(max_length=16, unique=True, null=True, editable=False)
    
     area = models.ForeignKey(Area, on_delete=models.SET_NULL, null=True, related_name='customers')
     notes = models.TextField(blank=True, null=True)
@@ -27,9 +41,33 @@ class Customer(models.Model):
     creation_method = models.CharField(max_length=5, choices=CREATION_METHODS, default='AGENT')
     create_account = models.BooleanField(default=False)
 
+    objects = CustomerManager()
+
     def __str__(self):
         return f"{self.name} - {self.mobile_number}"
 
+    def clean(self):
+        key = phone_key(self.mobile_number)
+        if key is None:
+            raise ValidationError({'mobile_number': "Enter a valid mobile number, e.g. +966551234567 or 0551234567."})
+        if Customer.objects.filter(mobile_key=key).exclude(pk=self.pk).exists():
+            raise ValidationError({'mobile_number': "A customer with this mobile number already exists."})
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The area the customer's appointments are counted under in the rollups;
+        # a 1-tuple so a NULL area differs from a deferred one.
+        if 'area_id' in instance.__dict__:
+            instance._loaded_area_id = (instance.area_id,)
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.mobile_key = phone_key(self.mobile_number)
+        if kwargs.get('update_fields') is not None and 'mobile_number' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'mobile_key'}
+        super().save(*args, **kwargs)
+
 class Technician(models.Model):
     SHIFT_CHOICES = (
         ('MORNING', 'Morning Shift'),
@@ -91,6 +129,12 @@ class Schedule(models.Model):
             raise ValidationError("Custom duration must be set when slot duration is custom")
         if self.start_time >= self.end_time:
             raise ValidationError("End time must be after start time")
+        from .availability import BITMAP, get_engine
+        from .bitmaps import alignment_error
+        if get_engine().name == BITMAP:
+            error = alignment_error(self.start_time, self.get_duration())
+            if error:
+                raise ValidationError(error)
 
     def get_duration(self):
         return self.custom_duration if self.slot_duration == 0 else self.slot_duration
@@ -110,7 +154,9 @@ class Slot(models.Model):
     end_time = models.TimeField()
 
     class Meta:
-        unique_together = ('schedule', 'date', 'start_time', 'end_time')
+        unique_together = ('schedule', 'technician', 'date', 'start_time', 'end_time')
+        # Serves date-ordered scans such as the cross-technician availability search.
+        indexes = [models.Index(fields=['date', 'start_time'])]
 
 
     def is_booked(self):
@@ -125,16 +171,27 @@ class Slot(models.Model):
         return f"{self.technician}: {self.date} {self.start_time} - {self.end_time}"
 # crm/models.py
 
+from django.conf import settings
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from datetime import timedelta, datetime, time
+from .signals import slots_changed
+from . import availability_cache, bitmaps, customer_search, rollups
+from .availability import BITMAP, get_engine
+from .conflicts import conflict_filter
+from .slots import (
+    SlotWriteResult, booking_horizon_end, build_day_slots, build_slots, bulk_create_slots, is_working_day,
+    reconcile_slots,
+)
 
 class TechnicianSchedule(models.Model):
     technician = models.ForeignKey('Technician', on_delete=models.CASCADE, related_name='schedules')
     schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE)
     start_date = models.DateField()
     end_date = models.DateField(null=True, blank=True)
+    # Last day slots have been generated for; see extend_slot_horizon.
+    materialized_until = models.DateField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.technician.name} - {self.schedule.name} ({self.start_date} to {self.end_date or 'ongoing'})"
@@ -148,61 +205,132 @@ class TechnicianSchedule(models.Model):
             )
         ]
     def check_conflicts(self):
-        overlapping_schedules = TechnicianSchedule.objects.filter(
-            technician=self.technician,
-            start_date__lte=self.end_date or datetime.max.date(),
-            end_date__gte=self.start_date
-        ).exclude(pk=self.pk)
-
-        for overlap in overlapping_schedules:
-            if (self.schedule.start_time < overlap.schedule.end_time and
-                self.schedule.end_time > overlap.schedule.start_time):
-                return True
-        return False
-
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-        if is_new:
-            self.generate_slots()
+        condition = conflict_filter(self.start_date, self.end_date, self.schedule)
+        if condition is None:
+            return False
+        return TechnicianSchedule.objects.filter(
+            condition, technician_id=self.technician_id
+        ).exclude(pk=self.pk).exists()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which slots this row owned so an edit can reconcile them.
+        instance._loaded_slot_scope = instance.slot_scope()
+        return instance
+
+    def request_slot_sync(self):
+        """Sync slots now, or queue the sync for the job worker when SLOT_JOBS_ASYNC is on."""
+        from .jobs import enqueue_slot_sync
+
+        self.slot_sync = self.slot_job = None
+        if not get_engine().materializes_slots:
+            # Nothing to write, but rule-computed availability changed.
+            self.send_slots_changed()
+            self._loaded_slot_scope = self.slot_scope()
+            return
+        if getattr(settings, 'SLOT_JOBS_ASYNC', False):
+            self.slot_job = enqueue_slot_sync(self)
+            self._loaded_slot_scope = self.slot_scope()
+        else:
+            self.slot_sync = self.sync_slots()
+
+    def slot_start_date(self, today=None):
+        # Past days are never materialized; prune_past_slots clears them out.
+        return max(self.start_date, today or timezone.now().date())
+
+    def slot_end_date(self, today=None):
+        horizon_end = booking_horizon_end(today)
+        return min(self.end_date, horizon_end) if self.end_date else horizon_end
+
+    def slot_scope(self):
+        return (self.technician_id, self.schedule_id, self.slot_start_date(), self.slot_end_date())
 
     def generate_slots(self):
-        current_date = self.start_date
-        end_date = self.end_date or (current_date + timedelta(days=365))  # Generate for a year if no end_date
-
-        while current_date <= end_date:
-            if self.is_working_day(current_date):
-                self.create_day_slots(current_date)
-            current_date += timedelta(days=1)
+        end_date = self.slot_end_date()
+        slots = build_slots(self.schedule, self.technician, self.slot_start_date(), end_date)
+        result = bulk_create_slots(slots)
+        self.mark_materialized(end_date)
+        self.send_slots_changed()
+        return result
+
+    def extend_slots(self, today=None):
+        """Materialize the days between `materialized_until` and the booking horizon."""
+        start_date = self.slot_start_date(today)
+        if self.materialized_until:
+            start_date = max(start_date, self.materialized_until + timedelta(days=1))
+        end_date = self.slot_end_date(today)
+        if start_date > end_date:
+            return SlotWriteResult()
+        result = bulk_create_slots(
+            build_slots(self.schedule, self.technician, start_date, end_date), ignore_conflicts=True
+        )
+        self.mark_materialized(end_date)
+        slots_changed.send(sender=TechnicianSchedule, technician_id=self.technician_id,
+                           date_from=start_date, date_to=end_date)
+        return result
+
+    def mark_materialized(self, end_date):
+        # A queryset update, so the post_save slot sync is not re-triggered.
+        TechnicianSchedule.objects.filter(pk=self.pk).update(materialized_until=end_date)
+        self.materialized_until = end_date
+
+    def sync_slots(self, dry_run=False, progress=None, date_from=None, date_to=None):
+        """
+        Insert missing and delete obsolete unbooked slots instead of rebuilding them all.
+        `date_from`/`date_to` limit the reconciliation to part of the schedule.
+        """
+        technician_id, schedule_id, start_date, end_date = self.slot_scope()
+        previous = getattr(self, '_loaded_slot_scope', None) or self.slot_scope()
+        scope_start, scope_end = min(start_date, previous[2]), max(end_date, previous[3])
+        if date_from:
+            start_date, scope_start = max(start_date, date_from), max(scope_start, date_from)
+        if date_to:
+            end_date, scope_end = min(end_date, date_to), min(scope_end, date_to)
+        existing = Slot.objects.filter(
+            models.Q(technician_id=technician_id, schedule_id=schedule_id) |
+            models.Q(technician_id=previous[0], schedule_id=previous[1]),
+            date__gte=scope_start,
+            date__lte=scope_end,
+        )
+        result = reconcile_slots(
+            build_slots(self.schedule, self.technician, start_date, end_date), existing,
+            dry_run=dry_run, progress=progress,
+        )
+        if not dry_run:
+            if not date_to:
+                self.mark_materialized(end_date)
+            self.send_slots_changed(previous, scope_start, scope_end)
+            if not date_to:
+                self._loaded_slot_scope = self.slot_scope()
+        return result
+
+    def send_slots_changed(self, previous=None, date_from=None, date_to=None):
+        previous = previous or getattr(self, '_loaded_slot_scope', None) or self.slot_scope()
+        current = self.slot_scope()
+        date_from = date_from or min(current[2], previous[2])
+        date_to = date_to or max(current[3], previous[3])
+        for technician_id in {current[0], previous[0]}:
+            slots_changed.send(sender=TechnicianSchedule, technician_id=technician_id,
+                               date_from=date_from, date_to=date_to)
 
     def is_working_day(self, date):
-        day_name = date.strftime("%A").lower()
-        return getattr(self.schedule, day_name)
+        return is_working_day(self.schedule, date)
 
     def create_day_slots(self, date):
-        start_time = datetime.combine(date, self.schedule.start_time)
-        end_time = datetime.combine(date, self.schedule.end_time)
-        slot_duration = timedelta(minutes=self.schedule.get_duration())
-
-        while start_time + slot_duration <= end_time:
-            Slot.objects.create(
-                schedule=self.schedule,
-                technician=self.technician,
-                date=date,
-                start_time=start_time.time(),
-                end_time=(start_time + slot_duration).time()
-            )
-            start_time += slot_duration
+        return bulk_create_slots(build_day_slots(self.schedule, self.technician, date))
+
     def __str__(self):
         return f"{self.technician.name} - {self.schedule.name} ({self.start_date} to {self.end_date or 'ongoing'})"
 
 @receiver(post_save, sender=TechnicianSchedule)
 def update_slots(sender, instance, created, **kwargs):
-    if not created:
-        # Delete existing slots
-        Slot.objects.filter(technician=instance.technician, date__gte=instance.start_date).delete()
-        # Regenerate slots
-        instance.generate_slots()
+    # Only touches the slots that changed; booked slots are never dropped.
+    instance.request_slot_sync()
+
+@receiver(post_delete, sender=TechnicianSchedule)
+def technician_schedule_deleted(sender, instance, **kwargs):
+    instance.send_slots_changed()
 
 
 class Material(models.Model):
@@ -229,33 +357,277 @@ class Appointment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     service = models.ManyToManyField(Service, related_name='appointments', blank=True)
     materials = models.ManyToManyField(Material, related_name='appointments', blank=True)
+    # Copied from `slot` on save (and by the Slot post_save receiver) so lists
+    # can filter and sort without joining crmapp_slot.
+    date = models.DateField(editable=False)
+    start_time = models.TimeField(editable=False)
+    end_time = models.TimeField(editable=False)
 
 
     def __str__(self):
         return f"{self.customer.name} - {self.slot}"
 
     def clean(self):
-        if self.slot.is_booked():
+        if self.slot_id and self.slot.is_booked():
             if self.slot.appointment and self.slot.appointment.pk != self.pk:
                 raise ValidationError("This slot is already booked.")
 
-    def save(self, *args, **kwargs):
-        self.full_clean()
+    def save(self, *args, validate=True, **kwargs):
+        if self.slot_id and (self.date is None or self.slot_id != getattr(self, '_loaded_slot_id', None)):
+            self.copy_slot_fields()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], *self.SLOT_FIELDS}
+        # crmapp.booking passes validate=False and lets the unique slot column reject double bookings.
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
 
-    @property
-    def date(self):
-        return self.slot.date
+    SLOT_FIELDS = ('technician', 'date', 'start_time', 'end_time')
 
-    @property
-    def start_time(self):
-        return self.slot.start_time
+    def copy_slot_fields(self):
+        slot = self.slot
+        self.date, self.start_time, self.end_time = slot.date, slot.start_time, slot.end_time
+        if slot.technician_id:
+            self.technician_id = slot.technician_id
 
     class Meta:
-        ordering = ['slot__date', 'slot__start_time']
+        ordering = ['date', 'start_time']
+        indexes = [
+            models.Index(fields=['date', 'start_time', 'id'], name='appointment_date_time_idx'),
+            models.Index(fields=['technician', 'date', 'start_time'], name='appointment_tech_date_idx'),
+            models.Index(fields=['status', 'date'], name='appointment_status_date_idx'),
+            # A customer's latest appointment, for customer search results.
+            models.Index(fields=['customer', 'date', 'start_time'], name='appointment_customer_date_idx'),
+        ]
 
     def get_services(self):
         return ", ".join([service.name for service in self.service.all()])
 
     def get_materials(self):
         return ", ".join([f"{material.code} - {material.description}" for material in self.materials.all()])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the booked slot so moving the appointment can free it.
+        instance._loaded_slot_id = instance.__dict__.get('slot_id')
+        # And the rollup key, so changing it can move the dashboard counts.
+        instance._rollup_state = rollups.rollup_state(instance)
+        return instance
+
+
+class TechnicianDayAvailability(models.Model):
+    """
+    One row per technician and day. Bit i of `free_mask` is set when the
+    i-th AVAILABILITY_UNIT_MINUTES unit of the day is working time and not
+    booked. Maintained only while AVAILABILITY_ENGINE is 'bitmap'; see
+    crmapp/bitmaps.py.
+    """
+    technician = models.ForeignKey(Technician, on_delete=models.CASCADE, related_name='day_availability')
+    date = models.DateField()
+    free_mask = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('technician', 'date')
+
+    def __str__(self):
+        return f"{self.technician_id} {self.date}: {self.free_mask:b}"
+
+
+class DailyAppointmentRollup(models.Model):
+    """
+    Appointment count and revenue per day, technician, customer area and
+    status, kept up to date by the receivers below; see crmapp/rollups.py.
+    """
+    date = models.DateField()
+    technician = models.ForeignKey(Technician, on_delete=models.SET_NULL, null=True, related_name='+')
+    area = models.ForeignKey(Area, on_delete=models.SET_NULL, null=True, related_name='+')
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'technician', 'area', 'status')
+
+    def __str__(self):
+        return f"{self.date} {self.technician_id} {self.area_id} {self.status}: {self.count}, {self.revenue}"
+
+
+def bitmap_engine_active():
+    return get_engine().name == BITMAP
+
+
+def _slot_interval(slot_id):
+    return Slot.objects.filter(pk=slot_id).values_list('technician_id', 'date', 'start_time', 'end_time').first()
+
+def _booked_interval(appointment):
+    if Appointment.slot.is_cached(appointment):
+        slot = appointment.slot
+        return slot.technician_id, slot.date, slot.start_time, slot.end_time
+    return _slot_interval(appointment.slot_id)
+
+@receiver(post_save, sender=Appointment)
+def appointment_slot_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_loaded_slot_id', None)
+    if previous == instance.slot_id and not created:
+        return
+    old = _slot_interval(previous) if previous and previous != instance.slot_id else None
+    new = _booked_interval(instance)
+    if bitmap_engine_active():
+        if old and old[0]:
+            bitmaps.release(*old, exclude_slot_id=instance.slot_id)
+        if new and new[0]:
+            # Raises IntegrityError when the units were taken concurrently.
+            bitmaps.claim(*new)
+    for interval in (old, new):
+        if interval and interval[0]:
+            availability_cache.invalidate(interval[0], interval[1])
+    instance._loaded_slot_id = instance.slot_id
+
+@receiver(post_save, sender=Customer)
+def customer_saved(sender, instance, created, update_fields=None, **kwargs):
+    customer_search.index_customers([instance])
+    if update_fields is not None and 'area' not in update_fields:
+        return
+    previous = getattr(instance, '_loaded_area_id', None)
+    if not created and previous is not None and previous[0] != instance.area_id:
+        rollups.move_customer_areas({instance.pk: previous[0]})
+    instance._loaded_area_id = (instance.area_id,)
+
+@receiver(post_delete, sender=Customer)
+def customer_deleted(sender, instance, **kwargs):
+    customer_search.unindex_customers([instance.pk])
+
+@receiver(post_save, sender=Slot)
+def slot_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    # Keep the booking's copied columns in step with an edited slot.
+    changes = {'date': instance.date, 'start_time': instance.start_time, 'end_time': instance.end_time}
+    if instance.technician_id:
+        changes['technician_id'] = instance.technician_id
+    booked = list(Appointment.objects.filter(slot=instance).values_list('pk', flat=True))
+    if booked:
+        rollups.add_appointments(booked, sign=-1)
+        Appointment.objects.filter(pk__in=booked).update(**changes)
+        rollups.add_appointments(booked)
+
+@receiver(post_save, sender=Appointment)
+def appointment_rollup_saved(sender, instance, created, **kwargs):
+    state = rollups.rollup_state(instance)
+    previous = getattr(instance, '_rollup_state', None)
+    if created:
+        rollups.apply_delta(rollups.rollup_key(state), 1)
+    elif previous is not None and state is not None and previous != state:
+        revenue = rollups.appointment_revenue(instance.pk)
+        rollups.apply_delta(rollups.rollup_key(previous), -1, -revenue)
+        rollups.apply_delta(rollups.rollup_key(state), 1, revenue)
+    instance._rollup_state = state
+
+@receiver(pre_delete, sender=Appointment)
+def appointment_rollup_deleting(sender, instance, **kwargs):
+    # The customer and service rows may be gone by post_delete.
+    state = getattr(instance, '_rollup_state', None) or rollups.rollup_state(instance)
+    if state is not None:
+        instance._rollup_removal = (rollups.rollup_key(state), rollups.appointment_revenue(instance.pk))
+
+@receiver(post_delete, sender=Appointment)
+def appointment_rollup_deleted(sender, instance, **kwargs):
+    removal = getattr(instance, '_rollup_removal', None)
+    if removal:
+        rollups.apply_delta(removal[0], -1, -removal[1])
+
+@receiver(m2m_changed, sender=Appointment.service.through)
+def appointment_services_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        through = sender.objects.filter(**{'service_id' if reverse else 'appointment_id': instance.pk})
+        instance._cleared_services = list(through.values_list('appointment_id', 'service_id'))
+    elif action == 'post_clear':
+        rollups.apply_service_changes(getattr(instance, '_cleared_services', []), -1)
+    elif action in ('post_add', 'post_remove'):
+        pairs = [(pk, instance.pk) for pk in pk_set] if reverse else [(instance.pk, pk) for pk in pk_set]
+        rollups.apply_service_changes(pairs, 1 if action == 'post_add' else -1)
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    old = _booked_interval(instance)
+    if not old or not old[0]:
+        return
+    if bitmap_engine_active():
+        bitmaps.release(*old)
+    availability_cache.invalidate(old[0], old[1])
+
+@receiver(slots_changed)
+def slots_changed_handler(sender, technician_id, date_from, date_to, **kwargs):
+    if technician_id is None:
+        return
+    # Only today up to the booking horizon is ever offered for booking.
+    date_from = max(date_from, timezone.now().date())
+    date_to = min(date_to, booking_horizon_end())
+    if date_from > date_to:
+        return
+    if bitmap_engine_active():
+        bitmaps.rebuild_day_masks(technician_id, date_from, date_to)
+    availability_cache.invalidate(technician_id, date_from, date_to)
+
+
+class SlotHold(models.Model):
+    """
+    A short claim on a technician's time while an agent fills in the booking
+    form. Other users don't see held slots; see crmapp/holds.py. Rows past
+    expires_at are ignored and removed by reap_slot_holds.
+    """
+    technician = models.ForeignKey(Technician, on_delete=models.CASCADE, related_name='slot_holds')
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='slot_holds')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('technician', 'date', 'start_time', 'end_time')
+
+    def __str__(self):
+        return f"{self.technician_id}: {self.date} {self.start_time} - {self.end_time} held by {self.user_id}"
+
+
+class BackgroundJob(models.Model):
+    KIND_CHOICES = (
+        ('SYNC_TECHNICIAN_SLOTS', 'Generate or reconcile technician slots'),
+        ('PROVISION_CUSTOMER_ACCOUNTS', 'Create accounts for ingested customers'),
+    )
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # Jobs sharing a key never run at the same time and are coalesced while pending.
+    key = models.CharField(max_length=100, blank=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    payload = models.JSONField(default=dict, blank=True)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent complete")
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='background_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed while the job runs; see crmapp.jobs.requeue_stale_jobs.
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'key'], condition=models.Q(status='PENDING') & ~models.Q(key=''),
+                name='unique_pending_job_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
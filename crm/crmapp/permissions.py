@@ -0,0 +1,26 @@
+# crm/permissions.py
+
+from rest_framework.permissions import BasePermission
+
+
+class IsBackOffice(BasePermission):
+    """
+    Signed-in agents, managers, technicians and staff; never customers.
+    Methods in `admin_methods` also need a superuser, as on the technician
+    and area pages.
+    """
+    admin_methods = ()
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated or (user.user_type == 'CUSTOMER' and not user.is_staff):
+            return False
+        return request.method not in self.admin_methods or user.is_superuser
+
+
+class IsBackOfficeAdminWrites(IsBackOffice):
+    admin_methods = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class IsBackOfficeAdminDeletes(IsBackOffice):
+    admin_methods = ('DELETE',)
@@ -0,0 +1,220 @@
+# crm/rollups.py
+
+"""
+Daily appointment rollups for the manager dashboard. DailyAppointmentRollup
+holds one row per (date, technician, customer area, status) with the number of
+appointments and their revenue (sum of Service.price). Signals in models.py
+apply deltas as appointments and their services change; rebuild_rollups()
+recomputes a date range from scratch for repair.
+
+Revenue uses the service price at the time the delta is applied; a rebuild
+uses current prices. Appointments are counted under their customer's current
+area: when a customer's area changes, move_customer_areas() re-keys the
+customer's rows (the Customer receiver in models.py does this on save; bulk
+writes call it themselves).
+"""
+
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+ZERO = Decimal('0.00')
+
+
+def _aggregate(appointments):
+    """{(date, technician_id, area_id, status): [count, revenue]} for an Appointment queryset."""
+    from .models import Appointment
+
+    key_fields = ('date', 'technician_id', 'customer__area_id', 'status')
+    totals = {}
+    for row in appointments.order_by().values(*key_fields).annotate(n=Count('id')):
+        totals[tuple(row[field] for field in key_fields)] = [row['n'], ZERO]
+    revenue = Appointment.service.through.objects.filter(
+        appointment__in=appointments.order_by().values('pk'),
+    ).values(*(f'appointment__{field}' for field in key_fields)).annotate(revenue=Sum('service__price'))
+    for row in revenue:
+        key = tuple(row[f'appointment__{field}'] for field in key_fields)
+        totals.setdefault(key, [0, ZERO])[1] += row['revenue'] or ZERO
+    return totals
+
+
+def apply_delta(key, count=0, revenue=ZERO):
+    """Add `count` and `revenue` to the rollup row for `key`, creating it if needed."""
+    from .models import DailyAppointmentRollup
+
+    if not count and not revenue:
+        return
+    date, technician_id, area_id, status = key
+    rows = DailyAppointmentRollup.objects.filter(
+        date=date, technician_id=technician_id, area_id=area_id, status=status,
+    )
+    for _ in range(2):
+        # Update a single row: NULL technician or area keys aren't unique in the database.
+        row_id = rows.values_list('pk', flat=True).first()
+        if row_id is not None:
+            DailyAppointmentRollup.objects.filter(pk=row_id).update(
+                count=F('count') + count, revenue=F('revenue') + revenue,
+            )
+            return
+        try:
+            with transaction.atomic():
+                DailyAppointmentRollup.objects.create(
+                    date=date, technician_id=technician_id, area_id=area_id, status=status,
+                    count=count, revenue=revenue,
+                )
+            return
+        except IntegrityError:
+            # Created concurrently; update it on the second pass.
+            continue
+
+
+def add_appointments(appointment_ids, sign=1, counts=True):
+    """
+    Apply the current state of the given appointments, or remove it with
+    sign=-1. With counts=False only their revenue is applied.
+    """
+    from .models import Appointment
+
+    if not appointment_ids:
+        return
+    for key, (count, revenue) in _aggregate(Appointment.objects.filter(pk__in=appointment_ids)).items():
+        apply_delta(key, sign * count if counts else 0, sign * revenue)
+
+
+def rollup_state(appointment):
+    """The fields an appointment's rollup key comes from, or None if any is deferred."""
+    state = tuple(appointment.__dict__.get(field) for field in ('date', 'technician_id', 'status', 'customer_id'))
+    return None if state[0] is None or state[3] is None or state[2] is None else state
+
+
+def rollup_key(state):
+    """
+    (date, technician_id, area_id, status) for a rollup_state(). The area is
+    read from the database, which is what the rows are keyed on; a customer
+    instance cached on the appointment may be stale.
+    """
+    from .models import Customer
+
+    date, technician_id, status, customer_id = state
+    area_id = Customer.objects.filter(pk=customer_id).values_list('area_id', flat=True).first()
+    return date, technician_id, area_id, status
+
+
+def area_changes(customers):
+    """{customer id: loaded area} for Customer instances whose area_id differs from the one they were loaded with."""
+    changes = {}
+    for customer in customers:
+        loaded = getattr(customer, '_loaded_area_id', None)
+        if loaded is not None and loaded[0] != customer.area_id:
+            changes[customer.pk] = loaded[0]
+    return changes
+
+
+def move_customer_areas(previous_areas, chunk_size=500):
+    """
+    Re-key the rollups of customers whose area changed. `previous_areas` maps
+    customer id to the area the customer's appointments were counted under;
+    call it once the new areas are saved.
+    """
+    from .models import Appointment
+
+    by_area = {}
+    for customer_id, area_id in previous_areas.items():
+        by_area.setdefault(area_id, []).append(customer_id)
+    for old_area_id, customer_ids in by_area.items():
+        for start in range(0, len(customer_ids), chunk_size):
+            appointments = Appointment.objects.filter(customer_id__in=customer_ids[start:start + chunk_size])
+            for (date, technician_id, area_id, status), (count, revenue) in _aggregate(appointments).items():
+                if area_id != old_area_id:
+                    apply_delta((date, technician_id, old_area_id, status), -count, -revenue)
+                    apply_delta((date, technician_id, area_id, status), count, revenue)
+
+
+def appointment_revenue(appointment_id):
+    from .models import Appointment
+
+    total = Appointment.service.through.objects.filter(
+        appointment_id=appointment_id,
+    ).aggregate(revenue=Sum('service__price'))['revenue']
+    return total or ZERO
+
+
+def apply_service_changes(pairs, sign):
+    """Add (sign=1) or remove (sign=-1) the revenue of (appointment_id, service_id) pairs."""
+    from accounts.models import Service
+    from .models import Appointment
+
+    if not pairs:
+        return
+    prices = dict(Service.objects.filter(pk__in={service_id for _, service_id in pairs}).values_list('pk', 'price'))
+    revenue = {}
+    for appointment_id, service_id in pairs:
+        revenue[appointment_id] = revenue.get(appointment_id, ZERO) + (prices.get(service_id) or ZERO)
+    keys = Appointment.objects.filter(pk__in=revenue).values_list(
+        'pk', 'date', 'technician_id', 'customer__area_id', 'status',
+    )
+    for appointment_id, *key in keys:
+        apply_delta(tuple(key), 0, sign * revenue[appointment_id])
+
+
+def rebuild_rollups(date_from=None, date_to=None):
+    """Recompute the rollups for [date_from, date_to] (open-ended when None). Returns the row count."""
+    from .models import Appointment, DailyAppointmentRollup
+
+    appointments = Appointment.objects.all()
+    rollups = DailyAppointmentRollup.objects.all()
+    if date_from:
+        appointments = appointments.filter(date__gte=date_from)
+        rollups = rollups.filter(date__gte=date_from)
+    if date_to:
+        appointments = appointments.filter(date__lte=date_to)
+        rollups = rollups.filter(date__lte=date_to)
+    with transaction.atomic():
+        rollups.delete()
+        rows = DailyAppointmentRollup.objects.bulk_create([
+            DailyAppointmentRollup(
+                date=date, technician_id=technician_id, area_id=area_id, status=status,
+                count=count, revenue=revenue,
+            )
+            for (date, technician_id, area_id, status), (count, revenue) in _aggregate(appointments).items()
+        ], batch_size=500)
+    return len(rows)
+
+
+DASHBOARD_GROUPS = {
+    'status': 'status',
+    'technician': 'technician_id',
+    'area': 'area_id',
+    'date': 'date',
+}
+
+
+def dashboard_summary(date_from, date_to, group_by='status', technician=None, area=None):
+    """
+    Totals and per-group counts and revenue read from the rollup table. The
+    cost depends on the number of days and groups, not on appointment history.
+    """
+    from .models import DailyAppointmentRollup
+
+    rows = DailyAppointmentRollup.objects.filter(date__gte=date_from, date__lte=date_to)
+    if technician:
+        rows = rows.filter(technician_id=technician)
+    if area:
+        rows = rows.filter(area_id=area)
+    field = DASHBOARD_GROUPS[group_by]
+    groups = list(
+        rows.values(field).annotate(appointments=Sum('count'), total_revenue=Sum('revenue'))
+        .filter(appointments__gt=0).order_by(field)
+    )
+    for group in groups:
+        # SQLite sums decimals as floats.
+        group['total_revenue'] = Decimal(group['total_revenue'] or 0).quantize(ZERO)
+    return {
+        'count': sum(group['appointments'] for group in groups),
+        'revenue': sum((group['total_revenue'] for group in groups), ZERO),
+        'groups': [
+            {'key': group[field], 'count': group['appointments'], 'revenue': group['total_revenue']}
+            for group in groups
+        ],
+    }
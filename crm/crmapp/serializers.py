@@ -1,6 +1,7 @@
 # crm/serializers.py
 
 from rest_framework import serializers
+from accounts.phones import clean_phone
 from .models import Customer
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -8,12 +9,23 @@ class CustomerSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Customer
-        fields = ['name', 'mobile_number', 'city', 'area', 'notes', 'create_account']
+        fields = ['name', 'mobile_number', 'area', 'notes', 'create_account']
+
+    def validate_mobile_number(self, value):
+        key = clean_phone(value)
+        existing = Customer.objects.filter(mobile_key=key)
+        if self.instance is not None:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
+            raise serializers.ValidationError("A customer with this mobile number already exists.")
+        return key
     
 # crm/serializers.py
 
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from .models import Schedule, Slot, TechnicianSchedule
+from .conflicts import find_schedule_conflicts
 
 class SlotSerializer(serializers.ModelSerializer):
     class Meta:
@@ -29,7 +41,89 @@ class ScheduleSerializer(serializers.ModelSerializer):
                   'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday',
                   'slots']
 
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        candidate = Schedule(**{
+            field: attrs.get(field, getattr(self.instance, field, None))
+            for field in ('slot_duration', 'custom_duration', 'start_time', 'end_time')
+        })
+        try:
+            candidate.clean()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return attrs
+
 class TechnicianScheduleSerializer(serializers.ModelSerializer):
+    slot_job = serializers.SerializerMethodField()
+
     class Meta:
         model = TechnicianSchedule
-        fields = ['id', 'technician', 'schedule', 'start_date', 'end_date']
\ No newline at end of file
+        fields = ['id', 'technician', 'schedule', 'start_date', 'end_date', 'materialized_until', 'slot_job']
+        read_only_fields = ['materialized_until']
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        instance = self.instance
+        candidate = TechnicianSchedule(
+            pk=instance.pk if instance else None,
+            technician=attrs.get('technician', instance.technician if instance else None),
+            schedule=attrs.get('schedule', instance.schedule if instance else None),
+            start_date=attrs.get('start_date', instance.start_date if instance else None),
+            end_date=attrs.get('end_date', instance.end_date if instance else None),
+        )
+        conflicts = find_schedule_conflicts([candidate]).get(0)
+        if conflicts:
+            raise serializers.ValidationError(f"This schedule overlaps: {', '.join(conflicts)}")
+        return attrs
+
+    def get_slot_job(self, obj):
+        # Set on the instance when a save queued slot generation.
+        job = getattr(obj, 'slot_job', None)
+        return job.pk if job else None
+
+# crm/serializers.py
+
+from rest_framework import serializers
+from .models import Appointment, BackgroundJob, Technician
+from .booking import book_appointment
+
+class TechnicianSerializer(serializers.ModelSerializer):
+    create_account = serializers.BooleanField(required=False, default=False, write_only=True)
+
+    class Meta:
+        model = Technician
+        fields = ['user', 'technician_id', 'working_areas', 'working_shift', 'services', 'create_account']
+
+class AppointmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Appointment
+        fields = ['id', 'customer', 'technician', 'slot', 'status', 'notes', 'service', 'materials']
+        # The unique slot column is enforced by the INSERT itself; see crmapp.booking.
+        extra_kwargs = {'slot': {'validators': []}}
+
+    def create(self, validated_data):
+        return self.book(Appointment(), validated_data)
+
+    def update(self, instance, validated_data):
+        return self.book(instance, validated_data)
+
+    def book(self, appointment, validated_data):
+        many_to_many = {field: validated_data.pop(field) for field in ('service', 'materials') if field in validated_data}
+        for field, value in validated_data.items():
+            setattr(appointment, field, value)
+
+        def save_m2m():
+            for field, value in many_to_many.items():
+                getattr(appointment, field).set(value)
+
+        request = self.context.get('request')
+        booking = book_appointment(appointment, save_m2m, user=request.user if request else None)
+        if not booking:
+            raise serializers.ValidationError({'slot': [booking.error]})
+        return appointment
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BackgroundJob
+        fields = ['id', 'kind', 'status', 'progress', 'payload', 'result', 'error',
+                  'created_at', 'started_at', 'finished_at']
@@ -0,0 +1,8 @@
+# crm/signals.py
+
+from django.dispatch import Signal
+
+# Sent when the availability of a technician may have changed for a date range
+# (slots generated, reconciled or pruned, or the schedule rules edited).
+# Arguments: technician_id, date_from, date_to.
+slots_changed = Signal()
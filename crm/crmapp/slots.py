@@ -0,0 +1,247 @@
+# crm/slots.py
+
+import logging
+import time as _time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT statement. Django caps this further on SQLite to stay
+# under the bound-parameter limit.
+SLOT_BULK_BATCH_SIZE = 500
+
+# Days ahead of today that slots are materialized for; the extend_slot_horizon
+# command moves the window forward daily.
+DEFAULT_BOOKING_HORIZON_DAYS = 60
+
+WEEKDAY_FIELDS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class SlotWriteResult:
+    def __init__(self, rows=0, seconds=0.0):
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.rows} slots in {self.seconds:.3f}s ({self.rows_per_second:,.0f} rows/s)"
+
+
+def booking_horizon_end(today=None):
+    today = today or timezone.now().date()
+    return today + timedelta(days=getattr(settings, 'SLOT_BOOKING_HORIZON_DAYS', DEFAULT_BOOKING_HORIZON_DAYS))
+
+
+def is_working_day(schedule, date):
+    return getattr(schedule, WEEKDAY_FIELDS[date.weekday()])
+
+
+def iter_slot_times(schedule, date):
+    """Yield (start_time, end_time) pairs for every slot of `schedule` on `date`."""
+    start = datetime.combine(date, schedule.start_time)
+    end = datetime.combine(date, schedule.end_time)
+    duration = timedelta(minutes=schedule.get_duration())
+
+    while start + duration <= end:
+        yield start.time(), (start + duration).time()
+        start += duration
+
+
+def build_day_slots(schedule, technician, date):
+    """Return unsaved Slot instances for one day of a schedule."""
+    from .models import Slot
+
+    return [
+        Slot(schedule=schedule, technician=technician, date=date, start_time=start, end_time=end)
+        for start, end in iter_slot_times(schedule, date)
+    ]
+
+
+def build_slots(schedule, technician, start_date, end_date):
+    """Return unsaved Slot instances for every working day in [start_date, end_date]."""
+    slots = []
+    current_date = start_date
+    while current_date <= end_date:
+        if is_working_day(schedule, current_date):
+            slots.extend(build_day_slots(schedule, technician, current_date))
+        current_date += timedelta(days=1)
+    return slots
+
+
+def bulk_create_slots(slots, batch_size=SLOT_BULK_BATCH_SIZE, ignore_conflicts=False):
+    """Insert `slots` in chunked bulk INSERTs inside a single transaction."""
+    from .models import Slot
+
+    started = _time.perf_counter()
+    with transaction.atomic():
+        for i in range(0, len(slots), batch_size):
+            Slot.objects.bulk_create(slots[i:i + batch_size], batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+    result = SlotWriteResult(len(slots), _time.perf_counter() - started)
+    logger.info("Created %s", result)
+    return result
+
+
+class SlotReconcileResult:
+    def __init__(self, created=0, deleted=0, conflicts=None, seconds=0.0):
+        self.created = created
+        self.deleted = deleted
+        # Booked slots that no longer match the schedule. They are kept so the
+        # appointment survives, and reported so someone can move it.
+        self.conflicts = conflicts or []
+        self.seconds = seconds
+
+    @property
+    def rows(self):
+        return self.created + self.deleted
+
+    def __str__(self):
+        return (f"{self.created} slots created, {self.deleted} deleted, "
+                f"{len(self.conflicts)} booked conflicts in {self.seconds:.3f}s")
+
+
+def slot_key(technician_id, schedule_id, date, start_time, end_time):
+    return (technician_id, schedule_id, date, start_time, end_time)
+
+
+def reconcile_slots(target_slots, existing, batch_size=SLOT_BULK_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Make the Slot rows in `existing` (a queryset scope) match `target_slots`.
+
+    Existing rows are read in one query. Missing slots are bulk inserted,
+    obsolete unbooked slots are deleted and obsolete booked slots are left in
+    place and returned as conflicts. `progress`, if given, is called with the
+    fraction of writes done after each chunk.
+    """
+    from .models import Slot
+
+    started = _time.perf_counter()
+    target = {
+        slot_key(s.technician_id, s.schedule_id, s.date, s.start_time, s.end_time): s
+        for s in target_slots
+    }
+
+    existing_keys = set()
+    obsolete_ids = []
+    conflicts = []
+    rows = existing.values_list('id', 'technician_id', 'schedule_id', 'date', 'start_time', 'end_time', 'appointment')
+    for slot_id, technician_id, schedule_id, date, start_time, end_time, appointment_id in rows:
+        key = slot_key(technician_id, schedule_id, date, start_time, end_time)
+        if key in target:
+            existing_keys.add(key)
+        elif appointment_id is None:
+            obsolete_ids.append(slot_id)
+        else:
+            conflicts.append(slot_id)
+
+    missing = [slot for key, slot in target.items() if key not in existing_keys]
+    deleted = len(obsolete_ids)
+
+    if not dry_run:
+        total = len(missing) + len(obsolete_ids)
+        with transaction.atomic():
+            for i in range(0, len(missing), batch_size):
+                Slot.objects.bulk_create(missing[i:i + batch_size], batch_size=batch_size)
+                if progress:
+                    progress(min(i + batch_size, len(missing)) / total)
+            deleted = 0
+            for i in range(0, len(obsolete_ids), batch_size):
+                # Re-check the booking so a slot booked since the read is not dropped.
+                deleted += Slot.objects.filter(
+                    pk__in=obsolete_ids[i:i + batch_size], appointment__isnull=True
+                ).delete()[0]
+                if progress:
+                    progress((len(missing) + min(i + batch_size, len(obsolete_ids))) / total)
+
+    result = SlotReconcileResult(len(missing), deleted, conflicts, _time.perf_counter() - started)
+    logger.info("Reconciled slots: %s", result)
+    if conflicts:
+        logger.warning("Booked slots no longer covered by their schedule: %s", conflicts)
+    return result
+
+
+def sync_schedule_slots(schedule):
+    """Reconcile the slots of every technician using `schedule`, plus its template slots."""
+    from .availability import get_engine
+
+    today = timezone.now().date()
+    result = SlotReconcileResult()
+    if get_engine().materializes_slots:
+        result = reconcile_slots(
+            build_day_slots(schedule, None, today),
+            schedule.slots.filter(technician__isnull=True, date=today),
+        )
+    for technician_schedule in schedule.technicianschedule_set.select_related('technician', 'schedule'):
+        # Queued instead of run inline when SLOT_JOBS_ASYNC is on.
+        technician_schedule.request_slot_sync()
+        synced = technician_schedule.slot_sync
+        if synced is None:
+            continue
+        result.created += synced.created
+        result.deleted += synced.deleted
+        result.conflicts += synced.conflicts
+        result.seconds += synced.seconds
+    return result
+
+
+def extend_slot_horizon(today=None):
+    """
+    Materialize slots up to the booking horizon for every active TechnicianSchedule.
+
+    Only the days past each schedule's `materialized_until` are built, and
+    inserts ignore existing rows, so running this more than once a day is
+    harmless.
+    """
+    from .availability import get_engine
+    from .models import TechnicianSchedule
+
+    today = today or timezone.now().date()
+    result = SlotWriteResult()
+    if not get_engine().materializes_slots:
+        return result
+    schedules = TechnicianSchedule.objects.filter(
+        start_date__lte=booking_horizon_end(today),
+    ).exclude(end_date__lt=today).select_related('schedule', 'technician')
+    for technician_schedule in schedules:
+        written = technician_schedule.extend_slots(today)
+        result.rows += written.rows
+        result.seconds += written.seconds
+    return result
+
+
+def prune_past_slots(before, batch_size=SLOT_BULK_BATCH_SIZE):
+    """Delete unbooked slots dated before `before` in batches. Returns the number deleted."""
+    from .models import Slot
+
+    # Past days are outside every availability window, so no slots_changed here.
+    deleted = 0
+    stale = Slot.objects.filter(date__lt=before, appointment__isnull=True)
+    while True:
+        ids = list(stale.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Slot.objects.filter(pk__in=ids, appointment__isnull=True).delete()[0]
+
+
+def rebuild_technician_schedules(technician_schedule_ids, date_from=None, date_to=None, dry_run=False):
+    """
+    Reconcile the slots of the given TechnicianSchedules and return totals.
+    This is the unit of work each `rebuild_slots` worker process runs.
+    """
+    from .models import TechnicianSchedule
+
+    totals = {'schedules': 0, 'created': 0, 'deleted': 0, 'conflicts': 0}
+    schedules = TechnicianSchedule.objects.filter(pk__in=technician_schedule_ids).select_related('schedule', 'technician')
+    for technician_schedule in schedules:
+        result = technician_schedule.sync_slots(dry_run=dry_run, date_from=date_from, date_to=date_to)
+        totals['schedules'] += 1
+        totals['created'] += result.created
+        totals['deleted'] += result.deleted
+        totals['conflicts'] += len(result.conflicts)
+    return totals
@@ -1,3 +1,965 @@
-from django.test import TestCase
+import contextlib
+import csv
+import gzip
+import io
+import json
+import threading
+from datetime import time, timedelta
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_save
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.area_tree import cached_area_tree
+from accounts.models import Area, City, CustomUser, Service
+from accounts.phones import normalize_phone, phone_key
+from accounts.team import team_members
+from .appointment_queries import keyset_page
+from .availability import availability_heatmap, get_engine, search_availability
+from .availability_cache import _timeout, cache_key, cached_free_slots
+from .bitmaps import compute_day_masks, get_day_masks
+from .booking import SLOT_TAKEN, book_appointment
+from .bulk_booking import _find_slots, import_appointments
+from .holds import SLOT_HELD, hold_slot, reap_expired_holds
+from .conflicts import find_schedule_conflicts
+from .customer_dedupe import find_duplicates
+from .customer_ingest import ingest_customers
+from .customer_search import search_customers
+from .jobs import SYNC_TECHNICIAN_SLOTS, claim_next_job, enqueue, requeue_stale_jobs, run_job
+from .models import (
+    Appointment, BackgroundJob, Customer, DailyAppointmentRollup, Schedule, Slot, SlotHold, Technician,
+    TechnicianDayAvailability, TechnicianSchedule,
+)
+from .rollups import rebuild_rollups
+from .slots import WEEKDAY_FIELDS, extend_slot_horizon, sync_schedule_slots
+
+
+def create_technician(mobile='+966500000001', technician_id='T-1'):
+    user = CustomUser.objects.create(mobile=mobile, first_name='Test', last_name='Technician', user_type='TECHNICIAN')
+    return Technician.objects.create(user=user, technician_id=technician_id, working_shift='MORNING')
+
+
+def create_schedule(start_time=time(8), end_time=time(12), duration=60):
+    return Schedule.objects.create(
+        name='Morning', slot_duration=duration if duration in (30, 60, 90, 120) else 0,
+        custom_duration=None if duration in (30, 60, 90, 120) else duration,
+        start_time=start_time, end_time=end_time, **{day: True for day in WEEKDAY_FIELDS},
+    )
+
+
+def create_slot():
+    technician = create_technician()
+    schedule = Schedule.objects.create(name='Morning', slot_duration=60, start_time=time(8), end_time=time(12))
+    return Slot.objects.create(
+        schedule=schedule, technician=technician, date=timezone.now().date() + timedelta(days=1),
+        start_time=time(8), end_time=time(9),
+    )
+
+
+@override_settings(SLOT_BOOKING_HORIZON_DAYS=6)
+class SlotGenerationTests(TestCase):
+    def setUp(self):
+        self.technician = create_technician()
+        self.today = timezone.now().date()
+
+    def test_assignment_generates_working_days_up_to_the_horizon(self):
+        schedule = create_schedule(time(8), time(10), 45)
+        schedule.monday = False
+        schedule.save()
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=schedule,
+                                          start_date=self.today - timedelta(days=3))
+        days = [day for day in (self.today + timedelta(days=i) for i in range(7)) if day.weekday() != 0]
+        slots = Slot.objects.filter(technician=self.technician)
+        self.assertEqual(sorted(set(slots.values_list('date', flat=True))), days)
+        self.assertEqual(set(slots.values_list('start_time', 'end_time')),
+                         {(time(8), time(8, 45)), (time(8, 45), time(9, 30))})
+        self.assertEqual(slots.count(), 2 * len(days))
+
+    def test_edits_reconcile_and_keep_booked_slots(self):
+        schedule = create_schedule()
+        assignment = TechnicianSchedule.objects.create(technician=self.technician, schedule=schedule, start_date=self.today)
+        tomorrow = self.today + timedelta(days=1)
+        slots = Slot.objects.filter(technician=self.technician)
+        booked = slots.get(date=tomorrow, start_time=time(9))
+        Appointment.objects.create(customer=Customer.objects.create(name='Booked', mobile_number='+966500000950'),
+                                   technician=self.technician, slot=booked)
+        kept = set(slots.filter(date__lte=tomorrow).values_list('pk', flat=True))
+
+        # Shortening the assignment only deletes the days it no longer covers.
+        assignment.end_date = tomorrow
+        assignment.save()
+        self.assertEqual(set(slots.values_list('pk', flat=True)), kept)
+
+        schedule.slot_duration = 30
+        schedule.save()
+        with self.assertLogs('crmapp.slots', 'WARNING'):
+            result = sync_schedule_slots(schedule)
+        self.assertEqual(result.conflicts, [booked.pk])
+        self.assertEqual(
+            sorted(slots.filter(date=tomorrow).values_list('start_time', 'end_time')),
+            sorted([(time(8 + i // 2, i % 2 * 30), time(8 + (i + 1) // 2, (i + 1) % 2 * 30)) for i in range(8)]
+                   + [(time(9), time(10))]),
+        )
+        self.assertTrue(Slot.objects.filter(pk=booked.pk, appointment__isnull=False).exists())
+
+    def test_horizon_extension_only_adds_new_days_once(self):
+        assignment = TechnicianSchedule.objects.create(
+            technician=self.technician, schedule=create_schedule(), start_date=self.today,
+        )
+        slots = Slot.objects.filter(technician=self.technician)
+        self.assertEqual(slots.count(), 7 * 4)
+        with self.settings(SLOT_BOOKING_HORIZON_DAYS=8):
+            self.assertEqual(extend_slot_horizon().rows, 2 * 4)
+            self.assertEqual(extend_slot_horizon().rows, 0)
+            self.assertEqual(extend_slot_horizon(self.today + timedelta(days=1)).rows, 4)
+        self.assertEqual(slots.count(), 10 * 4)
+        assignment.refresh_from_db()
+        self.assertEqual(assignment.materialized_until, self.today + timedelta(days=9))
+
+    def test_rebuild_command_restores_missing_slots(self):
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=create_schedule(), start_date=self.today)
+        slots = Slot.objects.filter(technician=self.technician)
+        slots.filter(date=self.today + timedelta(days=2)).delete()
+        out = io.StringIO()
+        call_command('rebuild_slots', '--dry-run', '--workers', '1', stdout=out)
+        self.assertIn('Would write 4 slot rows (4 created, 0 deleted) for 1 technician schedules', out.getvalue())
+        self.assertEqual(slots.count(), 6 * 4)
+        call_command('rebuild_slots', '--workers', '1', '--technician', str(self.technician.pk), stdout=io.StringIO())
+        self.assertEqual(slots.count(), 7 * 4)
+        with self.settings(AVAILABILITY_ENGINE='virtual'), self.assertRaises(CommandError):
+            call_command('rebuild_slots', stdout=io.StringIO())
+
+
+class ScheduleConflictTests(TestCase):
+    def setUp(self):
+        self.technician = create_technician()
+        self.today = timezone.now().date()
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=self.schedule(time(8), time(12), 'monday'),
+                                          start_date=self.today, end_date=self.today + timedelta(days=30))
+
+    def schedule(self, start_time, end_time, *days):
+        return Schedule.objects.create(name=f'{start_time}-{end_time}', slot_duration=60, start_time=start_time,
+                                       end_time=end_time, **{day: True for day in days})
+
+    def assignment(self, schedule, start=0, end=None):
+        return TechnicianSchedule(technician=self.technician, schedule=schedule, start_date=self.today + timedelta(days=start),
+                                  end_date=self.today + timedelta(days=end) if end is not None else None)
+
+    def test_overlap_needs_shared_dates_days_and_hours(self):
+        self.assertTrue(self.assignment(self.schedule(time(11), time(14), 'monday', 'friday')).check_conflicts())
+        self.assertFalse(self.assignment(self.schedule(time(12), time(14), 'monday')).check_conflicts())
+        self.assertFalse(self.assignment(self.schedule(time(8), time(12), 'tuesday')).check_conflicts())
+        self.assertFalse(self.assignment(self.schedule(time(8), time(12), 'monday'), start=31).check_conflicts())
+        self.assertFalse(self.assignment(self.schedule(time(8), time(12))).check_conflicts())
+
+    def test_batch_is_checked_against_itself_and_the_stored_rows(self):
+        evening = self.schedule(time(16), time(20), 'sunday')
+        stored = TechnicianSchedule.objects.get()
+        batch = [self.assignment(evening, end=10), self.assignment(evening, start=5), self.assignment(stored.schedule)]
+        conflicts = find_schedule_conflicts(batch)
+        self.assertEqual(sorted(conflicts), [0, 1, 2])
+        self.assertEqual(conflicts[2], [f'{stored.schedule.name} ({stored.start_date} to {stored.end_date})'])
+        self.assertEqual(sorted(find_schedule_conflicts(batch, ignore=[stored.pk])), [0, 1])
+
+
+class BookAppointmentTests(TestCase):
+    def test_second_booking_of_a_slot_is_rejected(self):
+        slot = create_slot()
+        customer = Customer.objects.create(name='First', mobile_number='+966500000100')
+
+        first = book_appointment(Appointment(customer=customer, technician=slot.technician, slot=slot))
+        second = book_appointment(Appointment(customer=customer, technician=slot.technician, slot=slot))
+
+        self.assertTrue(first.ok)
+        self.assertEqual(second.error, SLOT_TAKEN)
+        self.assertEqual(Appointment.objects.filter(slot=slot).count(), 1)
+
+    def test_slot_columns_follow_the_slot(self):
+        slot = create_slot()
+        appointment = Appointment.objects.create(customer=Customer.objects.create(name='Copied', mobile_number='+966500000980'),
+                                                 slot=slot)
+        columns = ('technician_id', 'date', 'start_time', 'end_time')
+        self.assertEqual(Appointment.objects.values_list(*columns).get(),
+                         (slot.technician_id, slot.date, time(8), time(9)))
+
+        other = Slot.objects.create(schedule=slot.schedule, technician=create_technician('+966500000981', 'T-2'),
+                                    date=slot.date + timedelta(days=1), start_time=time(9), end_time=time(10))
+        appointment = Appointment.objects.get()
+        appointment.slot = other
+        appointment.save(update_fields=['slot'])
+        self.assertEqual(Appointment.objects.values_list(*columns).get(),
+                         (other.technician_id, other.date, time(9), time(10)))
+
+        other.start_time, other.end_time = time(10), time(11)
+        other.save()
+        self.assertEqual(Appointment.objects.values_list(*columns).get(),
+                         (other.technician_id, other.date, time(10), time(11)))
+
+
+class SlotHoldTests(TestCase):
+    def setUp(self):
+        self.slot = create_slot()
+        self.agent = CustomUser.objects.create(mobile='+966500000800', user_type='MANAGER')
+        self.rival = CustomUser.objects.create(mobile='+966500000801', user_type='MANAGER')
+        self.customer = Customer.objects.create(name='Held', mobile_number='+966500000802')
+
+    def hold(self, user):
+        return hold_slot(user, self.slot.technician_id, self.slot.date, self.slot.start_time, self.slot.end_time)
+
+    def book(self, user):
+        appointment = Appointment(customer=self.customer, technician=self.slot.technician, slot=self.slot)
+        return appointment, book_appointment(appointment, user=user)
+
+    def test_only_the_holder_can_hold_or_book(self):
+        hold, error = self.hold(self.rival)
+        self.assertIsNone(error)
+        self.assertEqual(self.hold(self.agent), (None, SLOT_HELD))
+        appointment, booking = self.book(self.agent)
+        self.assertEqual(booking.error, SLOT_HELD)
+        self.assertIsNone(appointment.pk)
+
+        again, error = self.hold(self.rival)
+        self.assertEqual((again.pk, error), (hold.pk, None))
+        self.assertTrue(self.book(self.rival)[1].ok)
+        self.assertFalse(SlotHold.objects.exists())
+        self.assertEqual(self.hold(self.agent), (None, SLOT_TAKEN))
+
+    def test_expired_hold_is_ignored_and_reaped(self):
+        hold, _ = self.hold(self.rival)
+        SlotHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reap_expired_holds(), 1)
+
+        hold, _ = self.hold(self.rival)
+        SlotHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        taken, error = self.hold(self.agent)
+        self.assertEqual((taken.user, error), (self.agent, None))
+
+    def test_hold_placed_while_booking_is_seen(self):
+        def hold_during_booking(sender, instance, created, **kwargs):
+            # What a concurrent hold_slot() would have committed after a check made before the write.
+            if created:
+                SlotHold.objects.create(
+                    technician=self.slot.technician, date=self.slot.date, start_time=self.slot.start_time,
+                    end_time=self.slot.end_time, user=self.rival, expires_at=timezone.now() + timedelta(minutes=3),
+                )
+
+        post_save.connect(hold_during_booking, sender=Appointment)
+        self.addCleanup(post_save.disconnect, hold_during_booking, sender=Appointment)
+        self.assertEqual(self.book(self.agent)[1].error, SLOT_HELD)
+        self.assertFalse(Appointment.objects.exists())
+
+
+class AppointmentFormBookingTests(TestCase):
+    """A booking refused at write time must leave the customer untouched."""
+
+    def setUp(self):
+        self.slot = create_slot()
+        self.technician = self.slot.technician
+        self.area = Area.objects.create(name='North', city=City.objects.create(name='Riyadh'))
+        self.technician.working_areas.add(self.area)
+        self.other_slot = Slot.objects.create(
+            schedule=self.slot.schedule, technician=self.technician, date=self.slot.date,
+            start_time=time(9), end_time=time(10),
+        )
+        self.agent = CustomUser.objects.create(mobile='+966500000700', user_type='MANAGER')
+        rival = CustomUser.objects.create(mobile='+966500000701', user_type='MANAGER')
+        hold_slot(rival, self.technician.pk, self.other_slot.date, self.other_slot.start_time, self.other_slot.end_time)
+        self.client.force_login(self.agent)
+
+    def post(self, url, name, mobile_number):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.client.post(url, {
+                'city': self.area.city_id, 'area': self.area.pk, 'technician': self.technician.pk,
+                'date': self.other_slot.date.isoformat(), 'slot': self.other_slot.pk,
+                'name': name, 'mobile_number': mobile_number,
+            })
+
+    def test_failed_create_keeps_no_new_customer(self):
+        response = self.post('/appointments/create/', 'New', '+966500000702')
+        self.assertEqual(response.context['form'].errors['slot'], [SLOT_HELD])
+        self.assertFalse(Customer.objects.by_mobile('+966500000702').exists())
+
+    def test_failed_edit_keeps_the_customer_unchanged(self):
+        customer = Customer.objects.create(name='Before', mobile_number='+966500000703')
+        appointment = Appointment.objects.create(customer=customer, technician=self.technician, slot=self.slot)
+        response = self.post(f'/appointments/{appointment.pk}/edit/', 'After', '+966500000704')
+        self.assertEqual(response.context['form'].errors['slot'], [SLOT_HELD])
+        customer.refresh_from_db()
+        self.assertEqual((customer.name, customer.mobile_key), ('Before', '+966500000703'))
+        self.assertEqual(Appointment.objects.get(pk=appointment.pk).slot_id, self.slot.pk)
+
+
+class AppointmentListTests(TestCase):
+    """Two technicians with the same four booked times: ties are broken by id."""
+
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.now().date() + timedelta(days=1)
+        self.area = Area.objects.create(name='North', city=City.objects.create(name='Riyadh'))
+        customer = Customer.objects.create(name='Listed', mobile_number='+966500000970', area=self.area)
+        schedule = create_schedule()
+        self.technicians = []
+        for index in range(2):
+            technician = create_technician(f'+96650000097{index + 1}', f'T-{index + 1}')
+            TechnicianSchedule.objects.create(technician=technician, schedule=schedule, start_date=self.day)
+            for slot in Slot.objects.filter(technician=technician, date__lte=self.day + timedelta(days=1),
+                                            start_time__in=[time(8), time(10)]):
+                Appointment.objects.create(customer=customer, technician=technician, slot=slot)
+            self.technicians.append(technician)
+        self.agent = CustomUser.objects.create(mobile='+966500000979', user_type='MANAGER')
+        self.client.force_login(self.agent)
+
+    def test_keyset_pages_cover_every_row_once(self):
+        expected = list(Appointment.objects.order_by('date', 'start_time', 'id').values_list('pk', flat=True))
+        self.assertEqual(len(expected), 8)
+        for descending in (False, True):
+            seen, cursor = [], None
+            while True:
+                page, cursor = keyset_page(Appointment.objects.all(), cursor, 3, descending=descending)
+                seen += [appointment.pk for appointment in page]
+                if not cursor:
+                    break
+            self.assertEqual(seen, expected[::-1] if descending else expected)
+        with self.assertRaises(ValueError):
+            keyset_page(Appointment.objects.all(), 'junk')
+
+    def test_list_view_pages_through_the_filtered_rows(self):
+        technician = self.technicians[1]
+        params = {'technician': technician.pk, 'page_size': 3}
+        first = self.client.get('/appointments/', params)
+        second = self.client.get('/appointments/', {**params, 'cursor': first.context['next_cursor']})
+        listed = [appointment.pk for response in (first, second) for appointment in response.context['appointments']]
+        self.assertEqual(listed, list(Appointment.objects.filter(technician=technician)
+                                      .order_by('date', 'start_time', 'id').values_list('pk', flat=True)))
+        self.assertEqual((first.context['appointment_count'], second.context['next_cursor']), (4, None))
+        self.assertEqual(len(self.client.get('/appointments/', {'cursor': 'junk'}).context['appointments']), 8)
+
+    def test_export_streams_csv_ndjson_and_gzip(self):
+        appointment = Appointment.objects.order_by('date', 'start_time', 'id').first()
+        appointment.service.add(Service.objects.create(name='AC repair', price=100),
+                                Service.objects.create(name='Cleaning', price=50))
+        params = {'date_from': self.day.isoformat(), 'technician': self.technicians[0].pk}
+        response = self.client.get('/appointments/export/', params)
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([int(row['id']) for row in rows], list(
+            Appointment.objects.filter(technician=self.technicians[0]).order_by('date', 'start_time', 'id')
+            .values_list('pk', flat=True)))
+        self.assertEqual((rows[0]['services'], rows[0]['customer_area']), ('AC repair; Cleaning', 'North'))
+
+        response = self.client.get('/appointments/export/', {**params, 'export_format': 'ndjson', 'gzip': '1'})
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [int(row['id']) for row in rows])
+        self.assertEqual(self.client.get('/appointments/export/', {'export_format': 'xml'}).status_code, 400)
+
+
+class ProfileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = CustomUser.objects.create(mobile='+966500000990', first_name='Maha', user_type='MANAGER')
+        self.technician = create_technician('+966500000991', 'T-9')
+        self.technician.user.managers.add(self.manager)
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=create_schedule(),
+                                          start_date=timezone.now().date() + timedelta(days=1))
+        customer = Customer.objects.create(name='Profiled', mobile_number='+966500000993')
+        for slot in Slot.objects.filter(technician=self.technician).order_by('date', 'start_time')[:5]:
+            Appointment.objects.create(customer=customer, technician=self.technician, slot=slot)
+
+    def test_team_membership_is_cached_until_it_changes(self):
+        self.assertEqual(team_members(self.manager), [self.technician.user])
+        with self.assertNumQueries(0):
+            team_members(self.manager)
+        other = create_technician('+966500000992', 'T-10').user
+        other.managers.add(self.manager)
+        self.assertEqual(team_members(self.manager), [self.technician.user, other])
+
+    def test_profile_pages_the_team_appointments(self):
+        self.client.force_login(self.manager)
+        pages, params = [], {}
+        with mock.patch('accounts.views.PROFILE_PAGE_SIZE', 2):
+            while True:
+                response = self.client.get('/accounts/profile/', params)
+                pages.append([appointment.pk for appointment in response.context['appointments']])
+                if not response.context['next_cursor']:
+                    break
+                params = {'cursor': response.context['next_cursor']}
+        expected = list(Appointment.objects.order_by('date', 'start_time', 'id').values_list('pk', flat=True))
+        self.assertEqual(pages, [expected[:2], expected[2:4], expected[4:]])
+        self.assertEqual(response.context['appointment_count'], 5)
+        self.assertEqual(list(self.client.get('/accounts/profile/', {'scope': 'past'}).context['appointments']), [])
+
+
+class RollupAreaTests(TestCase):
+    """The incremental rollups must match a rebuild after a customer changes area."""
+
+    def setUp(self):
+        city = City.objects.create(name='Riyadh')
+        self.first_area = Area.objects.create(name='North', city=city)
+        self.second_area = Area.objects.create(name='South', city=city)
+        slot = create_slot()
+        self.customer = Customer.objects.create(
+            name='Moving', mobile_number='+966500000300', area=self.first_area,
+        )
+        self.appointment = Appointment(customer=self.customer, technician=slot.technician, slot=slot)
+        book_appointment(self.appointment)
+
+    def rollups(self):
+        return sorted(
+            DailyAppointmentRollup.objects.exclude(count=0).values_list('date', 'technician_id', 'area_id', 'status', 'count')
+        )
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_status_change_after_customer_moved(self):
+        customer = Customer.objects.get(pk=self.customer.pk)
+        customer.area = self.second_area
+        customer.save()
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        appointment.status = 'COMPLETED'
+        appointment.save(validate=False)
+        self.assertEqual(
+            self.rollups(), [(appointment.date, appointment.technician_id, self.second_area.pk, 'COMPLETED', 1)],
+        )
+        self.assertMatchesRebuild()
+
+    def test_bulk_ingest_moves_rollups_with_the_customer(self):
+        ingest_customers([{'name': 'Moving', 'mobile_number': '0500000300', 'area': self.second_area.pk}])
+        Appointment.objects.get(pk=self.appointment.pk).delete()
+        self.assertEqual(self.rollups(), [])
+        self.assertMatchesRebuild()
+
+
+class PhoneNormalizationTests(TestCase):
+    def test_formats_give_one_key(self):
+        for value in ('+966 55 123 4567', '0551234567', '00966551234567', '966551234567', '551234567'):
+            self.assertEqual(normalize_phone(value), '+966551234567', value)
+        self.assertEqual(normalize_phone('+1 (415) 555-0123'), '+14155550123')
+
+    def test_junk_is_refused(self):
+        for value in ('98765', '055123', '+96698765', '0096655123', 'abc', '', '0'):
+            self.assertIsNone(phone_key(value), value)
+
+    def test_admin_search_by_number_keeps_the_filters(self):
+        admin = CustomUser.objects.create_superuser('+966500000900', 'Admin', 'User', 'secret')
+        Customer.objects.create(name='By API', mobile_number='0551234567', creation_method='API')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/crmapp/customer/', {'q': '+966 55 123 4567', 'creation_method__exact': 'AGENT'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+        response = self.client.get('/admin/crmapp/customer/', {'q': '+966 55 123 4567', 'creation_method__exact': 'API'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_migration_merges_duplicates_and_rebuilds_rollups(self):
+        city = City.objects.create(name='Riyadh')
+        north, south = Area.objects.create(name='North', city=city), Area.objects.create(name='South', city=city)
+        slot = create_slot()
+        keeper = Customer.objects.create(name='Keeper', mobile_number='+966551234567', area=south)
+        duplicate = Customer.objects.create(name='Duplicate', mobile_number='0551234568', area=north)
+        appointment = Appointment(customer=duplicate, technician=slot.technician, slot=slot)
+        book_appointment(appointment)
+        # As before 0020: the same number in another format and no key yet.
+        Customer.objects.filter(pk=duplicate.pk).update(mobile_number='0551234567')
+        Customer.objects.update(mobile_key=None)
+
+        migration = import_module('crmapp.migrations.0020_customer_mobile_key')
+        migration.fill_mobile_keys(apps, mock.Mock(connection=connection))
+
+        self.assertEqual(list(Customer.objects.values_list('pk', 'mobile_key')), [(keeper.pk, '+966551234567')])
+        self.assertEqual(Appointment.objects.get(pk=appointment.pk).customer_id, keeper.pk)
+        self.assertEqual(
+            list(DailyAppointmentRollup.objects.values_list('area_id', 'count')), [(south.pk, 1)],
+        )
+
+
+class FindDuplicatesTests(TestCase):
+    def setUp(self):
+        self.area = Area.objects.create(name='North', city=City.objects.create(name='Riyadh'))
+
+    def test_near_phone_pair_is_reviewed_not_merged(self):
+        # Same common name and area, numbers one digit apart: a score of exactly 0.8.
+        first = Customer.objects.create(name='Mohammed Ahmed', mobile_number='+966551234567', area=self.area)
+        second = Customer.objects.create(name='Mohammed Ahmed', mobile_number='+966551234568', area=self.area)
+        clusters, reviews, stats = find_duplicates()
+        self.assertEqual(clusters, [])
+        self.assertEqual([[row['pk'] for row in review['rows']] for review in reviews], [[first.pk, second.pk]])
+        self.assertEqual(reviews[0]['score'], 0.8)
+
+    def test_same_tail_in_another_country_is_reviewed(self):
+        first = Customer.objects.create(name='Ali Hassan', mobile_number='+966559998888', area=self.area)
+        second = Customer.objects.create(name='Ali Hasan', mobile_number='+971559998888', area=self.area)
+        clusters, reviews, stats = find_duplicates()
+        self.assertEqual(clusters, [])
+        self.assertEqual([[row['pk'] for row in review['rows']] for review in reviews], [[first.pk, second.pk]])
+
+    def test_unnormalized_number_with_the_same_tail_is_merged(self):
+        first = Customer.objects.create(name='Ali Hassan', mobile_number='+966559998888', area=self.area)
+        second = Customer.objects.create(name='Ali Hasan', mobile_number='55-999-8888 ext', area=self.area)
+        self.assertIsNone(second.mobile_key)
+        clusters, reviews, stats = find_duplicates()
+        self.assertEqual([(cluster['keeper'], cluster['duplicates']) for cluster in clusters], [(first.pk, [second.pk])])
+        self.assertEqual(reviews, [])
+
+    def test_customers_with_two_accounts_are_reviewed(self):
+        first = Customer.objects.create(name='Ali Hassan', mobile_number='+966559998888', area=self.area,
+                                        user=CustomUser.objects.create(mobile='+966559998888'))
+        middle = Customer.objects.create(name='Ali Hassan', mobile_number='559998888 x', area=self.area)
+        last = Customer.objects.create(name='Ali Hasan', mobile_number='5599 98888 y', area=self.area,
+                                       user=CustomUser.objects.create(mobile='+966500000901'))
+        clusters, reviews, stats = find_duplicates()
+        self.assertEqual([(cluster['keeper'], cluster['duplicates']) for cluster in clusters], [(first.pk, [middle.pk])])
+        self.assertEqual([[row['pk'] for row in review['rows']] for review in reviews], [[first.pk, last.pk],
+                                                                                        [middle.pk, last.pk]])
+
+
+class CustomerSearchTests(TestCase):
+    def setUp(self):
+        self.area = Area.objects.create(name='North', city=City.objects.create(name='Riyadh'))
+        self.older = Customer.objects.create(name='Noura Saleh', mobile_number='0551239876', area=self.area)
+        self.newer = Customer.objects.create(name='Nourah Saad', mobile_number='+966551230001',
+                                             notes='Gate code 4421')
+
+    def search(self, query):
+        return [customer.pk for customer, appointment in search_customers(query)]
+
+    def test_substring_of_name_mobile_or_notes_matches_newest_first(self):
+        self.assertEqual(self.search('oura'), [self.newer.pk, self.older.pk])
+        self.assertEqual(self.search('nourah saleh'), [])
+        self.assertEqual(self.search('oura sal'), [self.older.pk])
+        self.assertEqual(self.search('0551239'), [self.older.pk])
+        self.assertEqual(self.search('+96655123'), [self.newer.pk, self.older.pk])
+        self.assertEqual(self.search('4421'), [self.newer.pk])
+        self.assertEqual(self.search('no'), [])
+
+    def test_renamed_and_deleted_customers_leave_the_index(self):
+        self.older.name = 'Huda Saleh'
+        self.older.save()
+        self.newer.delete()
+        self.assertEqual(self.search('oura'), [])
+        self.assertEqual(self.search('huda'), [self.older.pk])
+
+    def test_view_returns_the_latest_appointment(self):
+        slot = create_slot()
+        Appointment.objects.create(customer=self.older, technician=slot.technician, slot=slot)
+        agent = CustomUser.objects.create(mobile='+966500000940', user_type='MANAGER')
+        self.client.force_login(agent)
+        response = self.client.get('/ajax/search-customers/', {'q': 'saleh'}).json()
+        self.assertEqual([(row['id'], row['area']) for row in response['results']], [(self.older.pk, 'North')])
+        self.assertEqual(response['results'][0]['latest_appointment']['start_time'], '08:00')
+        response = self.client.get('/ajax/search-customers/', {'q': 'nour', 'limit': 1}).json()
+        self.assertEqual([row['id'] for row in response['results']], [self.newer.pk])
+        self.assertIsNone(response['results'][0]['latest_appointment'])
+        self.assertEqual(self.client.get('/ajax/search-customers/', {'q': 'nour', 'limit': 'x'}).status_code, 400)
+
+
+class CustomerIngestTests(TestCase):
+    def test_dry_run_then_upsert_on_the_normalized_number(self):
+        rows = [{'name': 'Sara Ali', 'mobile_number': '0551230000'},
+                {'name': 'Again', 'mobile_number': '+966 55 123 0000'}, {'name': 'Bad', 'mobile_number': '98765'}]
+        report, jobs = ingest_customers(rows, dry_run=True)
+        self.assertEqual([entry['status'] for entry in report], ['valid', 'error', 'error'])
+        self.assertEqual(report[1]['error'], "Same mobile number as row 0.")
+        self.assertEqual((Customer.objects.count(), jobs), (0, []))
+
+        created = ingest_customers(rows[:1])[0][0]
+        report, _ = ingest_customers([{'name': 'Sara A.', 'mobile_number': '00966551230000', 'notes': 'VIP'}])
+        self.assertEqual((report[0]['status'], report[0]['customer']), ('updated', created['customer']))
+        customer = Customer.objects.get()
+        self.assertEqual((customer.name, customer.notes), ('Sara A.', 'VIP'))
+
+    def test_accounts_are_created_without_password_and_link_only_customer_users(self):
+        CustomUser.objects.create(mobile='+966551230002', user_type='CUSTOMER')
+        CustomUser.objects.create(mobile='+966551230003', user_type='TECHNICIAN')
+        rows = [{'name': f'Customer {i}', 'mobile_number': f'05512300{i:02d}', 'create_account': True}
+                for i in (1, 2, 3)]
+        report, jobs = ingest_customers(rows)
+        self.assertEqual([entry['account'] for entry in report], ['queued'] * 3)
+        self.assertTrue(run_job(claim_next_job()))
+
+        job = BackgroundJob.objects.get(pk=jobs[0].pk)
+        self.assertEqual(job.result, {'created': 1, 'linked': 1, 'skipped': 1})
+        new, linked, skipped = (Customer.objects.by_mobile(f'05512300{i:02d}').get() for i in (1, 2, 3))
+        self.assertFalse(new.user.has_usable_password())
+        self.assertEqual(new.user.user_type, 'CUSTOMER')
+        self.assertEqual(linked.user.mobile, '+966551230002')
+        self.assertIsNone(skipped.user)
+
+
+class JobQueueTests(TestCase):
+    def test_enqueue_coalesces_pending_jobs_with_the_same_key(self):
+        first = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        self.assertEqual(enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1'), first)
+        self.assertNotEqual(enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:2'), first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BackgroundJob.objects.create(kind=SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+
+    def test_claim_skips_jobs_whose_key_is_running(self):
+        first = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        self.assertEqual(claim_next_job(), first)
+        second = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        other = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:2')
+        self.assertNotEqual(second, first)
+        self.assertEqual(claim_next_job(), other)
+        self.assertIsNone(claim_next_job())
+
+    @override_settings(JOB_STALE_SECONDS=60)
+    def test_job_of_a_dead_worker_is_requeued(self):
+        job = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        claim_next_job()
+        BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        with self.assertLogs('crmapp.jobs', 'WARNING'):
+            self.assertEqual(claim_next_job(), job)
+        self.assertEqual(BackgroundJob.objects.get(pk=job.pk).status, 'RUNNING')
+
+    @override_settings(JOB_STALE_SECONDS=60)
+    def test_dead_job_fails_when_a_newer_one_is_queued(self):
+        job = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        claim_next_job()
+        newer = enqueue(SYNC_TECHNICIAN_SLOTS, key='technician_schedule:1')
+        BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=61))
+        with self.assertLogs('crmapp.jobs', 'WARNING'):
+            self.assertEqual(requeue_stale_jobs(), 0)
+        self.assertEqual(BackgroundJob.objects.get(pk=job.pk).status, 'FAILED')
+        self.assertEqual(claim_next_job(), newer)
+
+
+class ApiPermissionTests(TestCase):
+    def setUp(self):
+        self.slot = create_slot()
+        customer = Customer.objects.create(name='Booked', mobile_number='+966500000400')
+        self.appointment = Appointment.objects.create(customer=customer, technician=self.slot.technician, slot=self.slot)
+
+    def test_customers_cannot_use_the_api(self):
+        self.client.force_login(CustomUser.objects.create(mobile='+966500000401', user_type='CUSTOMER'))
+        self.assertEqual(self.client.get('/api/appointments/').status_code, 403)
+        self.assertEqual(self.client.get('/api/jobs/').status_code, 403)
+
+    def test_agents_read_but_only_superusers_delete_or_edit_schedules(self):
+        self.client.force_login(CustomUser.objects.create(mobile='+966500000402', user_type='MANAGER'))
+        self.assertEqual(self.client.get('/api/appointments/').status_code, 200)
+        self.assertEqual(self.client.delete(f'/api/appointments/{self.appointment.pk}/').status_code, 403)
+        self.assertEqual(self.client.delete(f'/api/schedules/{self.slot.schedule_id}/').status_code, 403)
+        self.assertTrue(Appointment.objects.filter(pk=self.appointment.pk).exists())
+
+
+class EngineParityTests(TestCase):
+    """The materialized, virtual and bitmap engines must offer the same free slots."""
+
+    def setUp(self):
+        self.technician = create_technician()
+        self.day = timezone.now().date() + timedelta(days=1)
+        self.customer = Customer.objects.create(name='Parity', mobile_number='+966500000500')
+
+    def assign(self, schedule):
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=schedule, start_date=self.day)
+
+    def free(self, engine):
+        return [(slot['start_time'], slot['end_time'])
+                for slot in get_engine(engine).free_slots(self.technician.pk, self.day)]
+
+    def book(self, start):
+        slot = Slot.objects.get(technician=self.technician, date=self.day, start_time=start)
+        return Appointment.objects.create(customer=self.customer, technician=self.technician, slot=slot)
+
+    def assertEnginesAgree(self, expected):
+        for engine in ('materialized', 'virtual', 'bitmap'):
+            self.assertEqual(self.free(engine), expected, engine)
+
+    def test_bookings_cancellations_and_moves(self):
+        self.assign(create_schedule())
+        with self.settings(AVAILABILITY_ENGINE='bitmap'):
+            get_day_masks(self.technician.pk, [self.day])
+            first, second = self.book(time(9)), self.book(time(10))
+            first.delete()
+            second.slot = Slot.objects.get(technician=self.technician, date=self.day, start_time=time(11))
+            second.save()
+            stored = TechnicianDayAvailability.objects.get(technician=self.technician, date=self.day).free_mask
+            self.assertEqual(stored, compute_day_masks(self.technician.pk, [self.day])[self.day])
+        self.assertEnginesAgree([(time(8), time(9)), (time(9), time(10)), (time(10), time(11))])
+
+    @override_settings(AVAILABILITY_ENGINE='virtual')
+    def test_virtual_engine_only_stores_booked_slots(self):
+        self.assign(create_schedule())
+        self.assertFalse(Slot.objects.exists())
+        engine = get_engine()
+        token = engine.free_slots(self.technician.pk, self.day)[1]['id']
+        slot = engine.resolve_slot(self.technician, self.day, token)
+        self.assertTrue(book_appointment(Appointment(customer=self.customer, technician=self.technician, slot=slot)))
+        self.assertEqual(Slot.objects.count(), 1)
+        self.assertEqual(self.free('virtual'), [(time(8), time(9)), (time(10), time(11)), (time(11), time(12))])
+        for value in (token, f'{slot.schedule_id}-0815-0915', 'junk'):
+            with self.assertRaises(ValidationError):
+                engine.find_slot(self.technician, self.day, value)
+
+    def test_unaligned_schedule(self):
+        schedule = create_schedule(time(8, 15), time(10, 15), 30)
+        self.assign(schedule)
+        self.book(time(8, 45))
+        expected = [(time(8, 15), time(8, 45)), (time(9, 15), time(9, 45)), (time(9, 45), time(10, 15))]
+        self.assertEqual(self.free('materialized'), expected)
+        self.assertEqual(self.free('virtual'), expected)
+        # The bitmap engine can't represent it, so it refuses the schedule instead.
+        with self.settings(AVAILABILITY_ENGINE='bitmap'), self.assertRaises(ValidationError):
+            schedule.clean()
+        with self.settings(AVAILABILITY_ENGINE='bitmap'):
+            create_schedule(time(8), time(10, 15), 30).clean()
+            with self.assertRaises(ValidationError):
+                create_schedule(time(8), time(12), 45).clean()
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.technician = create_technician()
+        self.day = timezone.now().date() + timedelta(days=1)
+        TechnicianSchedule.objects.create(technician=self.technician, schedule=create_schedule(), start_date=self.day)
+
+    def row(self, start, mobile='+966500000900'):
+        return {'name': 'Bulk', 'mobile_number': mobile, 'technician': self.technician.pk,
+                'date': self.day.isoformat(), 'start_time': start}
+
+    def test_dry_run_validates_without_writing(self):
+        rows = [self.row('08:00'), self.row('08:00', '+966500000901'), self.row('08:30'), self.row('09:00', '123')]
+        report = import_appointments(rows, dry_run=True)
+        self.assertEqual([entry['status'] for entry in report], ['valid', 'error', 'error', 'error'])
+        self.assertEqual(report[1]['error'], SLOT_TAKEN)
+        self.assertFalse(Appointment.objects.exists())
+        self.assertFalse(Customer.objects.exists())
+
+    def test_commit_books_rows_and_refuses_booked_slots(self):
+        report = import_appointments([self.row('08:00'), self.row('09:00')])
+        self.assertEqual([entry['status'] for entry in report], ['booked', 'booked'])
+        self.assertEqual(Customer.objects.by_mobile('+966500000900').count(), 1)
+        self.assertEqual(
+            sorted(Appointment.objects.values_list('slot__start_time', flat=True)), [time(8), time(9)],
+        )
+        self.assertEqual(import_appointments([self.row('09:00')])[0]['error'], SLOT_TAKEN)
+
+    @override_settings(AVAILABILITY_ENGINE='bitmap')
+    def test_bitmap_engine_claims_the_bits(self):
+        import_appointments([self.row('08:00')])
+        stored = TechnicianDayAvailability.objects.get(technician=self.technician, date=self.day).free_mask
+        self.assertEqual(stored, compute_day_masks(self.technician.pk, [self.day])[self.day])
+
+        def booked_after_validation(engine, keys):
+            found = _find_slots(engine, keys)
+            # Another booking covering 09:00-10:00 commits between validation and the INSERT.
+            TechnicianDayAvailability.objects.filter(technician=self.technician).update(free_mask=0)
+            return found
+
+        with mock.patch('crmapp.bulk_booking._find_slots', booked_after_validation):
+            report = import_appointments([self.row('09:00')])
+        self.assertEqual(report[0]['error'], SLOT_TAKEN)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class AvailabilitySearchTests(TestCase):
+    """Two technicians in the area, one outside it; 8-10 in hourly slots."""
+
+    def setUp(self):
+        cache.clear()
+        self.day = timezone.now().date() + timedelta(days=1)
+        city = City.objects.create(name='Riyadh')
+        self.area = Area.objects.create(name='North', city=city)
+        self.service = Service.objects.create(name='AC repair', price=100)
+        schedule = create_schedule(time(8), time(10))
+        self.technicians = []
+        for index, area in enumerate((self.area, self.area, Area.objects.create(name='South', city=city))):
+            technician = create_technician(f'+96650000000{index + 1}', f'T-{index + 1}')
+            technician.working_areas.add(area)
+            TechnicianSchedule.objects.create(technician=technician, schedule=schedule, start_date=self.day)
+            self.technicians.append(technician)
+        first, second = self.technicians[:2]
+        second.services.add(self.service)
+        Appointment.objects.create(
+            customer=Customer.objects.create(name='Booked', mobile_number='+966500000961'), technician=first,
+            slot=Slot.objects.get(technician=first, date=self.day, start_time=time(8)),
+        )
+        hold_slot(CustomUser.objects.create(mobile='+966500000962', user_type='MANAGER'), second.pk, self.day, time(9), time(10))
+        self.agent = CustomUser.objects.create(mobile='+966500000960', user_type='MANAGER')
+
+    def openings(self, **kwargs):
+        openings, cursor = search_availability(self.area.pk, date_from=self.day, date_to=self.day, user=self.agent, **kwargs)
+        return [(opening['technician_id'], opening['start_time']) for opening in openings], cursor
+
+    def test_search_ranks_free_unheld_slots_across_technicians(self):
+        first, second = self.technicians[:2]
+        for engine in ('materialized', 'virtual', 'bitmap'):
+            with self.settings(AVAILABILITY_ENGINE=engine):
+                page, cursor = self.openings(limit=2)
+                self.assertEqual(page, [(second.pk, time(8)), (first.pk, time(9))], engine)
+                # The last opening is held by another agent, so the second page is empty.
+                self.assertEqual(self.openings(limit=2, cursor=cursor), ([], None), engine)
+                self.assertEqual(self.openings(service_ids=[self.service.pk])[0], [(second.pk, time(8))], engine)
+
+    def test_available_slots_api_batches_technicians_and_days(self):
+        first, second = self.technicians[:2]
+        self.client.force_login(self.agent)
+        url = '/api/appointments/available_slots/'
+        response = self.client.get(url, {'technician': f'{first.pk},{second.pk}',
+                                         'date_from': self.day.isoformat(), 'date_to': (self.day + timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        days = {technician: {day: [slot[:2] for slot in slots] for day, slots in by_day.items()}
+                for technician, by_day in response.json()['technicians'].items()}
+        later = (self.day + timedelta(days=1)).isoformat()
+        self.assertEqual(days, {
+            str(first.pk): {self.day.isoformat(): [['09:00', '10:00']], later: [['08:00', '09:00'], ['09:00', '10:00']]},
+            str(second.pk): {self.day.isoformat(): [['08:00', '09:00']], later: [['08:00', '09:00'], ['09:00', '10:00']]},
+        })
+        self.assertEqual(self.client.get(url, {'technician': first.pk}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'technician': first.pk, 'date_from': self.day.isoformat(),
+                                               'date_to': (self.day + timedelta(days=31)).isoformat()}).status_code, 400)
+
+    def test_heatmap_counts_free_and_booked_slots_per_day(self):
+        first, second = self.technicians[:2]
+        today, later = self.day - timedelta(days=1), self.day + timedelta(days=1)
+        for engine in ('materialized', 'virtual', 'bitmap'):
+            with self.settings(AVAILABILITY_ENGINE=engine):
+                self.assertEqual(availability_heatmap(today, later, area_id=self.area.pk), [
+                    {'date': today, 'free': 0, 'booked': 0},
+                    {'date': self.day, 'free': 3, 'booked': 1},
+                    {'date': later, 'free': 4, 'booked': 0},
+                ], engine)
+                self.assertEqual(availability_heatmap(self.day, self.day, service_ids=[self.service.pk], by_technician=True),
+                                 [{'date': self.day, 'technician_id': second.pk, 'free': 2, 'booked': 0}], engine)
+
+        self.client.force_login(self.agent)
+        response = self.client.get('/ajax/availability-heatmap/', {'month': f'{self.day:%Y-%m}', 'city_id': self.area.city_id})
+        days = {row['date']: (row['free'], row['booked']) for row in response.json()['days']}
+        self.assertEqual(days[self.day.isoformat()], (2 + 3, 1))
+        self.assertEqual(self.client.get('/ajax/availability-heatmap/', {'month': 'June'}).status_code, 400)
+
+
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.slot = create_slot()
+        self.technician = self.slot.technician
+        self.other = create_technician('+966500000002', 'T-2')
+        self.day = self.slot.date
+        self.days = [(self.technician.pk, self.day), (self.technician.pk, self.day + timedelta(days=1)),
+                     (self.other.pk, self.day)]
+        for technician_id, day in self.days:
+            cached_free_slots(technician_id, day)
+
+    def cached(self):
+        return [day for day in self.days if cache.get(cache_key('materialized', *day)) is not None]
+
+    def test_booking_drops_only_its_technician_day(self):
+        customer = Customer.objects.create(name='Cached', mobile_number='+966500000600')
+        with self.captureOnCommitCallbacks(execute=True):
+            book_appointment(Appointment(customer=customer, technician=self.technician, slot=self.slot))
+        self.assertEqual(self.cached(), self.days[1:])
+        self.assertEqual(cached_free_slots(self.technician.pk, self.day), [])
+
+    def test_schedule_change_drops_only_its_technician(self):
+        schedule = Schedule.objects.create(name='Other', slot_duration=60, start_time=time(13), end_time=time(15),
+                                           **{day: True for day in WEEKDAY_FIELDS})
+        with self.captureOnCommitCallbacks(execute=True):
+            TechnicianSchedule.objects.create(technician=self.other, schedule=schedule, start_date=self.day)
+        self.assertEqual(self.cached(), self.days[:2])
+
+    def test_timeout_is_capped_with_a_per_process_cache(self):
+        with self.settings(AVAILABILITY_CACHE_TIMEOUT=300, LOCAL_CACHE_MAX_TIMEOUT=60):
+            self.assertEqual(_timeout(), 60)
+            with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                self.assertEqual(_timeout(), 300)
+
+    def test_warm_up_refuses_a_per_process_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_availability_cache')
+
+
+class AreaTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.riyadh = City.objects.create(name='Riyadh')
+        self.north = Area.objects.create(name='North', city=self.riyadh)
+        self.malqa = Area.objects.create(name='Malqa', city=self.riyadh, parent=self.north)
+        self.jeddah = City.objects.create(name='Jeddah')
+        admin = CustomUser.objects.create_superuser('+966500000930', 'Admin', 'User', 'secret')
+        self.client.force_login(admin)
+
+    def test_tree_is_built_from_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            tree = json.loads(cached_area_tree()[0])
+        self.assertEqual(tree, [
+            {'id': self.riyadh.pk, 'name': 'Riyadh', 'areas': [{
+                'id': self.north.pk, 'name': 'North', 'parent': None, 'sub_areas': [{
+                    'id': self.malqa.pk, 'name': 'Malqa', 'parent': {'id': self.north.pk, 'name': 'North'},
+                    'sub_areas': [],
+                }],
+            }]},
+            {'id': self.jeddah.pk, 'name': 'Jeddah', 'areas': []},
+        ])
+        with self.assertNumQueries(0):
+            cached_area_tree()
+
+    def test_etag_answers_304_until_a_city_or_area_changes(self):
+        response = self.client.get('/get-cities-and-areas/')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get('/get-cities-and-areas/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Area.objects.create(name='Corniche', city=self.jeddah)
+        response = self.client.get('/get-cities-and-areas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([area['name'] for area in response.json()[1]['areas']], ['Corniche'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jeddah.name = 'Jeddah City'
+            self.jeddah.save()
+        self.assertEqual(self.client.get('/get-cities-and-areas/').json()[1]['name'], 'Jeddah City')
+
+    def test_timeout_is_capped_with_a_per_process_cache(self):
+        with self.settings(AREA_TREE_CACHE_TIMEOUT=3600, LOCAL_CACHE_MAX_TIMEOUT=60), \
+                mock.patch('accounts.area_tree.cache') as fake_cache:
+            fake_cache.get.return_value = None
+            cached_area_tree()
+            self.assertEqual(fake_cache.set.call_args.args[2], 60)
+            with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+                cached_area_tree()
+                self.assertEqual(fake_cache.set.call_args.args[2], 3600)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    # Needs a file-backed test database (DATABASES TEST NAME) so each thread
+    # gets its own connection with real locking.
+    THREADS = 10
+
+    def test_exactly_one_of_many_concurrent_bookings_wins(self):
+        slot = create_slot()
+        customers = [
+            Customer.objects.create(name=f'Customer {i}', mobile_number=f'+9665000002{i:02d}')
+            for i in range(self.THREADS)
+        ]
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def book(customer):
+            try:
+                barrier.wait()
+                results.append(book_appointment(
+                    Appointment(customer=customer, technician_id=slot.technician_id, slot_id=slot.pk)
+                ))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.THREADS)
+        self.assertEqual(sum(result.ok for result in results), 1)
+        self.assertTrue(all(result.error == SLOT_TAKEN for result in results if not result.ok))
+        self.assertEqual(Appointment.objects.filter(slot=slot).count(), 1)
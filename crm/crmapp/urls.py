@@ -2,9 +2,16 @@
 
 from django.urls import path, include
 from . import views
-from . import views_services, views_areas, views_technicians
+from . import views_services, views_areas, views_technicians, views_availability, views_dashboard
 from rest_framework.routers import DefaultRouter
+from . import api
 
+router = DefaultRouter()
+router.register('technicians', api.TechnicianViewSet)
+router.register('schedules', api.ScheduleViewSet)
+router.register('technician-schedules', api.TechnicianScheduleViewSet)
+router.register('appointments', api.AppointmentViewSet)
+router.register('jobs', api.BackgroundJobViewSet)
 
 urlpatterns = [
     # ... existing url patterns ...
@@ -25,11 +32,18 @@ urlpatterns = [
 
 
     path('appointments/', views.appointment_list, name='appointment_list'),
+    path('appointments/export/', views.appointment_export, name='appointment_export'),
     path('appointments/create/', views.appointment_create, name='appointment_create'),
     path('ajax/load-areas/', views.load_areas, name='ajax_load_areas'),
     path('ajax/load-technicians/', views.load_technicians, name='ajax_load_technicians'),
     path('ajax/load-slots/', views.load_slots, name='ajax_load_slots'),
+    path('ajax/search-availability/', views_availability.search_availability_view, name='ajax_search_availability'),
+    path('ajax/availability-heatmap/', views_availability.availability_heatmap_view, name='ajax_availability_heatmap'),
+    path('ajax/hold-slot/', views_availability.hold_slot_view, name='ajax_hold_slot'),
+    path('ajax/release-slot-hold/', views_availability.release_slot_hold_view, name='ajax_release_slot_hold'),
+    path('ajax/dashboard-summary/', views_dashboard.dashboard_summary_view, name='ajax_dashboard_summary'),
     path('ajax/get-or-create-customer/', views.get_or_create_customer, name='ajax_get_or_create_customer'),
+    path('ajax/search-customers/', views.search_customers_view, name='ajax_search_customers'),
     path('ajax/load-technician-services/', views.ajax_load_technician_services, name='ajax_load_technician_services'),
 
     path('appointments/<int:pk>/edit/', views.appointment_edit, name='appointment_edit'),
@@ -60,4 +74,8 @@ urlpatterns = [
     path('get-service/', views_services.get_service, name='get_service'),
 
     path('get-working-areas/', views_areas.get_working_areas, name='get_working_areas'),
+
+    path('api/customers/', api.CustomerCreateAPI.as_view(), name='api_customer_create'),
+    path('api/customers/bulk/', api.CustomerBulkAPI.as_view(), name='api_customer_bulk'),
+    path('api/', include(router.urls)),
 ]
\ No newline at end of file
@@ -19,7 +19,19 @@ from django.contrib import messages
 from .models import Schedule, TechnicianSchedule, Slot
 from django.db.models import Q 
 from .forms import ScheduleForm, TechnicianScheduleForm
+from .slots import SlotWriteResult, build_day_slots, bulk_create_slots, sync_schedule_slots
+from .availability import get_engine
+from .availability_cache import cached_free_slots
+from .booking import book_appointment
+from .holds import active_holds, without_held
+from .appointment_queries import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, appointment_window, cached_count, clean_filters, filter_appointments, keyset_page,
+)
+from .exports import EXPORT_FORMATS, export_stream
+from .customer_search import DEFAULT_LIMIT as DEFAULT_SEARCH_LIMIT, MAX_LIMIT as MAX_SEARCH_LIMIT, search_customers
+from .views_availability import parse_date
 from datetime import datetime, timedelta
+from django.http import StreamingHttpResponse
 CustomUser = get_user_model()
 
 CustomUser = get_user_model()
@@ -77,9 +89,10 @@ def schedule_edit(request, pk):
         form = ScheduleForm(request.POST, instance=schedule)
         if form.is_valid():
             schedule = form.save()
-            schedule.slots.all().delete()  # Delete existing slots
-            create_slots(schedule)  # Create new slots
+            result = sync_schedule_slots(schedule)
             messages.success(request, 'Schedule updated successfully.')
+            if result.conflicts:
+                messages.warning(request, f'{len(result.conflicts)} booked slots no longer match the schedule and were kept.')
             return redirect('schedule_list')
     else:
         form = ScheduleForm(instance=schedule)
@@ -104,8 +117,10 @@ def technician_schedule_create(request):
     if request.method == 'POST':
         form = TechnicianScheduleForm(request.POST)
         if form.is_valid():
-            form.save()
+            technician_schedule = form.save()
             messages.success(request, 'Technician schedule created successfully.')
+            if technician_schedule.slot_job:
+                messages.info(request, 'Slots are being generated in the background.')
             return redirect('technician_schedule_list')
     else:
         form = TechnicianScheduleForm()
@@ -117,8 +132,13 @@ def technician_schedule_edit(request, pk):
     if request.method == 'POST':
         form = TechnicianScheduleForm(request.POST, instance=technician_schedule)
         if form.is_valid():
-            form.save()
+            technician_schedule = form.save()
             messages.success(request, 'Technician schedule updated successfully.')
+            if technician_schedule.slot_job:
+                messages.info(request, 'Slots are being updated in the background.')
+            result = technician_schedule.slot_sync
+            if result and result.conflicts:
+                messages.warning(request, f'{len(result.conflicts)} booked slots no longer match the schedule and were kept.')
             return redirect('technician_schedule_list')
     else:
         form = TechnicianScheduleForm(instance=technician_schedule)
@@ -134,18 +154,9 @@ def technician_schedule_delete(request, pk):
     return render(request, 'crm/technician_schedule_confirm_delete.html', {'technician_schedule': technician_schedule})
 
 def create_slots(schedule):
-    start_time = datetime.combine(datetime.today(), schedule.start_time)
-    end_time = datetime.combine(datetime.today(), schedule.end_time)
-    duration = schedule.get_duration()
-    
-    current_time = start_time
-    while current_time + timedelta(minutes=duration) <= end_time:
-        Slot.objects.create(
-            schedule=schedule,
-            start_time=current_time.time(),
-            end_time=(current_time + timedelta(minutes=duration)).time()
-        )
-        current_time += timedelta(minutes=duration)
+    if not get_engine().materializes_slots:
+        return SlotWriteResult()
+    return bulk_create_slots(build_day_slots(schedule, None, timezone.now().date()))
 
 # crm/views.py
 
@@ -153,8 +164,10 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
+from django.db import transaction
 from .models import Appointment, TechnicianSchedule, Slot
 from .forms import AppointmentForm
+from .availability import get_engine
 import json
 from django.core.serializers import serialize
 from django.http import JsonResponse
@@ -164,56 +177,74 @@ from django.http import JsonResponse
 
 @login_required
 def appointment_list(request):
-    today = timezone.now().date()
+    from accounts.models import Service
+
     time_period = request.GET.get('time_period', '7d')  # Default to 7 days
     custom_date_range = request.GET.get('custom_date')
+    start_date, end_date = appointment_window(time_period, custom_date_range, timezone.now().date())
 
-    if custom_date_range:
-        start_date, end_date = custom_date_range.split(' to ')
-        start_date = timezone.datetime.strptime(start_date, '%d %b, %Y').date()
-        end_date = timezone.datetime.strptime(end_date, '%d %b, %Y').date()
-    else:
-        if time_period == 'today':
-            start_date = today
-            end_date = today
-        elif time_period == '7d':
-            start_date = today
-            end_date = today + timedelta(days=7)
-        elif time_period == '1m':
-            start_date = today
-            end_date = today + timedelta(days=30)
-        elif time_period == '6m':
-            start_date = today
-            end_date = today + timedelta(days=180)
-        elif time_period == '1y':
-            start_date = today
-            end_date = today + timedelta(days=365)
-        else:
-            start_date = today
-            end_date = today + timedelta(days=7)  # Default to 7 days
-
-    appointments = Appointment.objects.select_related(
-        'slot', 
-        'customer', 
-        'slot__technician', 
-        'slot__technician__user',
+    filters = clean_filters(request.GET)
+    appointments = filter_appointments(Appointment.objects.all(), start_date, end_date, **filters)
+    listed = appointments.select_related(
+        'customer',
+        'technician__user',
         'customer__user'
     ).prefetch_related(
         'service',
         'materials'
-    ).filter(
-        slot__date__gte=start_date,
-        slot__date__lte=end_date
-    ).order_by('slot__date', 'slot__start_time')
-    
+    )
+    try:
+        page_size = max(min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE), 1)
+        page, next_cursor = keyset_page(listed, request.GET.get('cursor'), page_size)
+    except ValueError:
+        messages.error(request, 'Invalid page link, showing the first page.')
+        page, next_cursor = keyset_page(listed)
+
+    params = request.GET.copy()
+    params.pop('cursor', None)
     context = {
-        'appointments': appointments,
-        'appointment_count': appointments.count(),
+        'appointments': page,
+        'appointment_count': cached_count(appointments, (start_date, end_date, sorted(filters.items()))),
         'time_period': time_period,
         'custom_date_range': custom_date_range,
+        'filters': filters,
+        'technicians': Technician.objects.select_related('user').order_by('user__first_name'),
+        'areas': Area.objects.order_by('name'),
+        'services': Service.objects.order_by('name'),
+        'status_choices': Appointment.STATUS_CHOICES,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'query_string': params.urlencode(),
     }
     return render(request, 'crm/appointment_list.html', context)
 
+@login_required
+def appointment_export(request):
+    """
+    Stream the appointments matching appointment_list's filters as CSV or NDJSON
+    (?export_format=ndjson), gzipped with ?gzip=1. date_from/date_to (YYYY-MM-DD)
+    override the time period, and either may be left open.
+    """
+    file_format = request.GET.get('export_format', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"export_format must be one of {', '.join(EXPORT_FORMATS)}."}, status=400)
+    try:
+        if 'date_from' in request.GET or 'date_to' in request.GET:
+            start_date = parse_date(request.GET.get('date_from'))
+            end_date = parse_date(request.GET.get('date_to'))
+        else:
+            start_date, end_date = appointment_window(
+                request.GET.get('time_period', '7d'), request.GET.get('custom_date'), timezone.now().date(),
+            )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date range.'}, status=400)
+
+    appointments = filter_appointments(Appointment.objects.all(), start_date, end_date, **clean_filters(request.GET))
+    stream, content_type, extension = export_stream(appointments, file_format, gzip=request.GET.get('gzip') == '1')
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="appointments-{timezone.now():%Y%m%d}.{extension}"'
+    return response
+
 @login_required
 def appointment_create(request):
     if request.method == 'POST':
@@ -221,27 +252,26 @@ def appointment_create(request):
         if form.is_valid():
             name = form.cleaned_data['name']
             mobile_number = form.cleaned_data['mobile_number']
-            customer, created = Customer.objects.get_or_create(
-                mobile_number=mobile_number,
-                defaults={'name': name}
-            )
-            appointment = form.save(commit=False)
-            appointment.customer = customer
-            appointment.technician = form.cleaned_data['technician']
-            appointment.save()
-            form.save_m2m()  # Save many-to-many relationships
-
-            # Debugging statements
-            print(f"Appointment ID: {appointment.id}")
-            print(f"Selected Materials IDs: {form.cleaned_data['materials'].values_list('id', flat=True)}")
-            print(f"Appointment Materials: {[material.code for material in appointment.materials.all()]}")
-
-            messages.success(request, 'Appointment booked successfully.')
-            return redirect('appointment_list')
+            with transaction.atomic():
+                customer, created = Customer.objects.get_or_create_by_mobile(
+                    mobile_number,
+                    defaults={'name': name}
+                )
+                appointment = form.save(commit=False)
+                appointment.customer = customer
+                appointment.technician = form.cleaned_data['technician']
+                booking = book_appointment(appointment, form.save_m2m, user=request.user)
+                if not booking:
+                    # Don't keep a customer created for a booking that failed.
+                    transaction.set_rollback(True)
+
+            if booking:
+                messages.success(request, 'Appointment booked successfully.')
+                return redirect('appointment_list')
+            form.add_error('slot', booking.error)
+            messages.error(request, booking.error)
         else:
             messages.error(request, 'There was an error with your form. Please check the details and try again.')
-            print('There was an error with your form. Please check the details and try again.')
-            print(form.errors)
     else:
         form = AppointmentForm()
 
@@ -253,14 +283,14 @@ def appointment_edit(request, pk):
     appointment = get_object_or_404(Appointment, pk=pk)
 
     initial_data = {
-        'city': appointment.slot.technician.working_areas.first().city.pk,
-        'area': appointment.slot.technician.working_areas.first().pk,
-        'technician': appointment.slot.technician.pk,
+        'city': appointment.technician.working_areas.first().city.pk,
+        'area': appointment.technician.working_areas.first().pk,
+        'technician': appointment.technician_id,
         'name': appointment.customer.name,
         'mobile_number': appointment.customer.mobile_number,
         'notes': appointment.notes,
-        'date': appointment.slot.date,
-        'slot': appointment.slot.pk,
+        'date': appointment.date,
+        'slot': get_engine().slot_value(appointment.slot),
         'service': [service.pk for service in appointment.service.all()],
         'materials': [material.pk for material in appointment.materials.all()],
     }
@@ -268,24 +298,32 @@ def appointment_edit(request, pk):
     if request.method == 'POST':
         form = AppointmentForm(request.POST, instance=appointment)
         print(f"Debug - POST data: {request.POST}")
-        if form.is_valid():
+        if form.is_valid() and Customer.objects.by_mobile(
+            form.cleaned_data['mobile_number']
+        ).exclude(pk=appointment.customer_id).exists():
+            form.add_error('mobile_number', 'Another customer already has this mobile number.')
+        elif form.is_valid():
             print("Debug - Form is valid")
             # Update the customer information
             name = form.cleaned_data['name']
             mobile_number = form.cleaned_data['mobile_number']
-            customer = appointment.customer
-            customer.name = name
-            customer.mobile_number = mobile_number
-            customer.save()
-
             # Save the appointment instance without committing (to handle many-to-many)
-            appointment = form.save(commit=False)
-            appointment.customer = customer  # Ensure the customer is set
-            appointment.save()
-            form.save_m2m()  # Save many-to-many relationships (services)
-
-            messages.success(request, 'Appointment updated successfully.')
-            return redirect('appointment_list')
+            with transaction.atomic():
+                customer = appointment.customer
+                customer.name = name
+                customer.mobile_number = mobile_number
+                customer.save()
+                appointment = form.save(commit=False)
+                appointment.customer = customer  # Ensure the customer is set
+                booking = book_appointment(appointment, form.save_m2m, user=request.user)
+                if not booking:
+                    # The customer changes go with the booking that failed.
+                    transaction.set_rollback(True)
+
+            if booking:
+                messages.success(request, 'Appointment updated successfully.')
+                return redirect('appointment_list')
+            form.add_error('slot', booking.error)
         else:
             print('Debug - Form is invalid:', form.errors)
     else:
@@ -323,12 +361,16 @@ def get_available_slots(request):
     if not technician_id or not date:
         return JsonResponse({'error': 'Both technician and date are required.'}, status=400)
 
-    available_slots = Slot.objects.filter(
-        technician_id=technician_id,
-        date=date
-    ).exclude(appointment__isnull=False)
+    try:
+        technician_id, date = int(technician_id), datetime.strptime(date, '%Y-%m-%d').date()
+        available_slots = without_held(
+            cached_free_slots(technician_id, date),
+            active_holds([technician_id], date, exclude_user=request.user).get((technician_id, date)),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid technician or date.'}, status=400)
 
-    slots_data = [{'id': slot.id, 'time': f"{slot.start_time.strftime('%H:%M')} - {slot.end_time.strftime('%H:%M')}"} 
+    slots_data = [{'id': slot['id'], 'time': f"{slot['start_time'].strftime('%H:%M')} - {slot['end_time'].strftime('%H:%M')}"} 
                   for slot in available_slots]
 
     return JsonResponse({'slots': slots_data})
@@ -395,18 +437,11 @@ def load_slots(request):
         date = datetime.strptime(date_str, '%Y-%m-%d').date()
         print(f"Parsed date: {date}")
         
-        slots = Slot.objects.filter(technician_id=technician_id, date=date)
-        
         # Include the current appointment's slot
-        if appointment_id:
-            slots = slots.filter(Q(appointment__isnull=True) | Q(appointment__id=appointment_id))
-        else:
-            slots = slots.filter(appointment__isnull=True)
-        
-        slots = slots.values('id', 'start_time', 'end_time')
-        print(f"Found slots: {slots}")
-        
-        slots_list = list(slots)
+        slots_list = without_held(
+            cached_free_slots(technician_id, date, appointment_id),
+            active_holds([technician_id], date, exclude_user=request.user).get((technician_id, date)),
+        )
         print(f"Sending slots data: {slots_list}")
         
         return JsonResponse(slots_list, safe=False)
@@ -425,10 +460,39 @@ def load_slots(request):
 def get_or_create_customer(request):
     name = request.GET.get('name')
     mobile = request.GET.get('mobile')
-    customer, created = Customer.objects.get_or_create(mobile_number=mobile, defaults={'name': name})
+    try:
+        customer, created = Customer.objects.get_or_create_by_mobile(mobile, defaults={'name': name})
+    except ValueError:
+        return JsonResponse({'error': 'Enter a valid mobile number.'}, status=400)
     return JsonResponse({'id': customer.id, 'name': customer.name, 'mobile': customer.mobile_number})
 
 
+@login_required
+def search_customers_view(request):
+    """As-you-type customer lookup by any part of the name, mobile number or notes."""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(min(int(request.GET.get('limit', DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT), 1)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    results = []
+    for customer, appointment in search_customers(query, limit):
+        results.append({
+            'id': customer.pk,
+            'name': customer.name,
+            'mobile_number': customer.mobile_number,
+            'area': customer.area.name if customer.area else None,
+            'latest_appointment': appointment and {
+                'id': appointment.pk,
+                'date': appointment.date,
+                'start_time': appointment.start_time.strftime('%H:%M'),
+                'status': appointment.status,
+                'technician': appointment.technician.name if appointment.technician else None,
+            },
+        })
+    return JsonResponse({'query': query, 'results': results})
+
+
 from django.contrib.auth.decorators import user_passes_test
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
@@ -1,6 +1,8 @@
 from django.contrib.auth.decorators import user_passes_test
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from accounts.area_tree import cached_area_tree
 from accounts.models import City, Area
 
 @user_passes_test(lambda u: u.is_superuser)
@@ -36,30 +38,15 @@ def add_area(request):
             return JsonResponse({'status': 'error', 'message': 'Invalid parent area.'})
     return JsonResponse({'status': 'error', 'message': 'Invalid area name or city.'})
 
+def area_tree_etag(request):
+    return cached_area_tree()[1]
+
 @user_passes_test(lambda u: u.is_superuser)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=area_tree_etag)
 def get_cities_and_areas(request):
-    cities = City.objects.all()
-    data = []
-    for city in cities:
-        city_data = {
-            'id': city.id,
-            'name': city.name,
-            'areas': get_areas_with_subareas(city)
-        }
-        data.append(city_data)
-    return JsonResponse(data, safe=False)
-
-def get_areas_with_subareas(city, parent=None):
-    areas = []
-    for area in Area.objects.filter(city=city, parent=parent):
-        area_data = {
-            'id': area.id,
-            'name': area.name,
-            'parent': {'id': area.parent.id, 'name': area.parent.name} if area.parent else None,
-            'sub_areas': get_areas_with_subareas(city, parent=area)
-        }
-        areas.append(area_data)
-    return areas
+    # The whole tree comes from one query and is cached until a City or Area changes.
+    return HttpResponse(cached_area_tree()[0], content_type='application/json')
 
 def get_area_hierarchy(areas):
     result = []
@@ -0,0 +1,120 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+
+from .availability import get_engine, search_availability
+from .availability_cache import cached_heatmap
+from .holds import hold_seconds, hold_slot, release_holds
+
+MAX_SEARCH_RESULTS = 100
+MAX_HEATMAP_DAYS = 31
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def parse_time(value):
+    return datetime.strptime(value, '%H:%M').time() if value else None
+
+
+@login_required
+def search_availability_view(request):
+    area_id = request.GET.get('area_id')
+    if not area_id:
+        return JsonResponse({'error': 'area_id is required.'}, status=400)
+
+    try:
+        service_ids = [int(service_id) for service_id in request.GET.getlist('service') if service_id]
+        limit = min(int(request.GET.get('limit', 10)), MAX_SEARCH_RESULTS)
+        openings, next_cursor = search_availability(
+            int(area_id), service_ids,
+            date_from=parse_date(request.GET.get('date_from')),
+            date_to=parse_date(request.GET.get('date_to')),
+            time_from=parse_time(request.GET.get('time_from')),
+            time_to=parse_time(request.GET.get('time_to')),
+            limit=max(limit, 1),
+            cursor=request.GET.get('cursor'),
+            user=request.user,
+        )
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid area, service, date, time or limit.'}, status=400)
+
+    return JsonResponse({
+        'engine': get_engine().name,
+        'results': [{
+            'slot': opening['id'],
+            'technician_id': opening['technician_id'],
+            'technician_name': opening['technician_name'],
+            'date': opening['date'].isoformat(),
+            'start_time': opening['start_time'].strftime('%H:%M'),
+            'end_time': opening['end_time'].strftime('%H:%M'),
+        } for opening in openings],
+        'next_cursor': next_cursor,
+    })
+
+
+@login_required
+def availability_heatmap_view(request):
+    """
+    Free/booked slot counts per day for ?month=YYYY-MM (or date_from/date_to),
+    filtered by city_id, area_id and service; group_by=technician splits
+    each day per technician.
+    """
+    try:
+        month = request.GET.get('month')
+        if month:
+            first = datetime.strptime(month, '%Y-%m').date()
+            date_from = first
+            date_to = date(first.year, first.month, calendar.monthrange(first.year, first.month)[1])
+        else:
+            date_from = parse_date(request.GET.get('date_from')) or datetime.now().date()
+            date_to = parse_date(request.GET.get('date_to')) or date_from + timedelta(days=MAX_HEATMAP_DAYS - 1)
+        area_id = int(request.GET['area_id']) if request.GET.get('area_id') else None
+        city_id = int(request.GET['city_id']) if request.GET.get('city_id') else None
+        service_ids = [int(service_id) for service_id in request.GET.getlist('service') if service_id]
+    except ValueError:
+        return JsonResponse({'error': 'Invalid month, date, city, area or service.'}, status=400)
+    if date_to < date_from or (date_to - date_from).days >= MAX_HEATMAP_DAYS:
+        return JsonResponse({'error': f'The date range must cover 1 to {MAX_HEATMAP_DAYS} days.'}, status=400)
+
+    by_technician = request.GET.get('group_by') == 'technician'
+    rows = cached_heatmap(date_from, date_to, area_id, city_id, service_ids, by_technician)
+    return JsonResponse({
+        'engine': get_engine().name,
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'days': [{**row, 'date': row['date'].isoformat()} for row in rows],
+    })
+
+
+@login_required
+@require_POST
+def hold_slot_view(request):
+    """Hold the slot an agent just picked so other agents stop seeing it."""
+    try:
+        technician_id = int(request.POST.get('technician_id'))
+        date = parse_date(request.POST.get('date'))
+        appointment_id = int(request.POST['appointment_id']) if request.POST.get('appointment_id') else None
+        start_time, end_time = get_engine().slot_times(technician_id, date, request.POST.get('slot'))
+    except ValidationError as e:
+        return JsonResponse({'error': e.messages[0]}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid technician, date or slot.'}, status=400)
+
+    hold, error = hold_slot(request.user, technician_id, date, start_time, end_time, appointment_id)
+    if error:
+        return JsonResponse({'error': error}, status=409)
+    return JsonResponse({'hold': hold.pk, 'expires_at': hold.expires_at.isoformat(), 'seconds': hold_seconds()})
+
+
+@login_required
+@require_POST
+def release_slot_hold_view(request):
+    return JsonResponse({'released': release_holds(request.user)})
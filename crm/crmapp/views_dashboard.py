@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+
+from .rollups import DASHBOARD_GROUPS, dashboard_summary
+from .views_availability import parse_date
+
+DEFAULT_DASHBOARD_DAYS = 30
+MAX_DASHBOARD_DAYS = 366
+
+
+@login_required
+def dashboard_summary_view(request):
+    """
+    Appointment counts and revenue between date_from and date_to (default the
+    last 30 days), grouped by status, technician, area or date.
+    """
+    group_by = request.GET.get('group_by', 'status')
+    if group_by not in DASHBOARD_GROUPS:
+        return JsonResponse({'error': f"group_by must be one of {', '.join(DASHBOARD_GROUPS)}."}, status=400)
+    try:
+        date_to = parse_date(request.GET.get('date_to')) or datetime.now().date()
+        date_from = parse_date(request.GET.get('date_from')) or date_to - timedelta(days=DEFAULT_DASHBOARD_DAYS - 1)
+        technician = int(request.GET['technician']) if request.GET.get('technician') else None
+        area = int(request.GET['area']) if request.GET.get('area') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date or id.'}, status=400)
+    if date_from > date_to or (date_to - date_from).days >= MAX_DASHBOARD_DAYS:
+        return JsonResponse({'error': f'Pick a range of at most {MAX_DASHBOARD_DAYS} days.'}, status=400)
+
+    summary = dashboard_summary(date_from, date_to, group_by, technician, area)
+    return JsonResponse({
+        'date_from': date_from.isoformat(),
+        'date_to': date_to.isoformat(),
+        'group_by': group_by,
+        'count': summary['count'],
+        'revenue': str(summary['revenue']),
+        'groups': [
+            {'key': group['key'], 'count': group['count'], 'revenue': str(group['revenue'])}
+            for group in summary['groups']
+        ],
+    })